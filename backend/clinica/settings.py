@@ -15,6 +15,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework_simplejwt',
     'drf_spectacular',
@@ -106,6 +107,81 @@ CLINIC_PHONE = os.getenv("CLINIC_PHONE", "Telefone: —")
 CLINIC_CRO = os.getenv("CLINIC_CRO", "CRO: —")
 # Caminho opcional para logotipo (PNG/JPG). Pode ser absoluto no container ou relativo ao BASE_DIR
 CLINIC_LOGO_PATH = os.getenv("CLINIC_LOGO_PATH", "")
+# Logo e textos do cabeçalho ficam em cache por processo; intervalo (s) entre as
+# verificações de mtime do logo (0 = conferir a cada PDF)
+PDF_RECURSOS_VERIFICACAO_SEGUNDOS = float(os.getenv("PDF_RECURSOS_VERIFICACAO_SEGUNDOS", "10"))
+# Papel timbrado (PDF) aplicado às prescrições exportadas; absoluto ou relativo ao BASE_DIR.
+# Fica em cache por processo como o logo. Com MMAP o arquivo é mapeado em vez de copiado
+# para a memória (troque o arquivo com mv, não o reescreva no lugar)
+PRESCRIPTION_TEMPLATE_PATH = os.getenv("PRESCRIPTION_TEMPLATE_PATH", "")
+PRESCRIPTION_TEMPLATE_MMAP = os.getenv("PRESCRIPTION_TEMPLATE_MMAP", "0") == "1"
+# Diretório extra com modelos de documentos em JSON (<tipo>.json), além dos de
+# pacientes/modelos_documentos; um arquivo com o mesmo tipo substitui o padrão
+DOCUMENTOS_MODELOS_DIR = os.getenv("DOCUMENTOS_MODELOS_DIR", "")
+# Geração de documentos em lote (pacientes.geracao_lote): processos de renderização
+# do comando gerar_documentos_lote (<= 1 = renderizar no próprio processo). Pela API
+# (documentos/gerar-lote/) o lote vai para a fila de PDFs, até MAX_PACIENTES por pedido
+DOCUMENTOS_LOTE_PROCESSOS = int(os.getenv("DOCUMENTOS_LOTE_PROCESSOS", "2"))
+DOCUMENTOS_LOTE_MAX_PACIENTES = int(os.getenv("DOCUMENTOS_LOTE_MAX_PACIENTES", "500"))
+# Geração de PDFs em segundo plano (exportar/gerar com assincrono=1): threads por
+# processo e máximo de gerações pendentes/em andamento antes de responder 503
+PDF_ASSINCRONO_WORKERS = int(os.getenv("PDF_ASSINCRONO_WORKERS", "2"))
+PDF_ASSINCRONO_FILA_MAX = int(os.getenv("PDF_ASSINCRONO_FILA_MAX", "20"))
+
+# Uploads de documentos (core.uploads): gravados direto no armazenamento por conteúdo,
+# com tamanho máximo por arquivo em MB (acima disso a resposta é 413)
+UPLOAD_ARQUIVO_MAX_MB = float(os.getenv("UPLOAD_ARQUIVO_MAX_MB", "100"))
+
+# Download de documentos (core.downloads). Sem proxy o Django envia o arquivo (com
+# Range). Com "x-accel-redirect" o nginx serve o arquivo de uma location interna:
+#   location /protegido/ { internal; alias /app/media/; }
+# Com "x-sendfile" (Apache mod_xsendfile/lighttpd) o proxy recebe o caminho absoluto
+DOWNLOAD_PROXY = os.getenv("DOWNLOAD_PROXY", "")
+DOWNLOAD_ACCEL_PREFIXO = os.getenv("DOWNLOAD_ACCEL_PREFIXO", "/protegido/")
+# Validade dos links assinados do ZIP de documentos (core.downloads.link_assinado)
+DOWNLOAD_LINK_VALIDADE_SEGUNDOS = int(os.getenv("DOWNLOAD_LINK_VALIDADE_SEGUNDOS", "60"))
+
+# Miniaturas dos documentos (pacientes.miniaturas): lado máximo em px, diretório
+# (absoluto ou relativo ao BASE_DIR) e tamanho máximo em MB; acima dele saem as
+# menos acessadas
+MINIATURAS_TAMANHO = int(os.getenv("MINIATURAS_TAMANHO", "320"))
+MINIATURAS_DIR = os.getenv("MINIATURAS_DIR", "cache/miniaturas")
+MINIATURAS_MAX_MB = int(os.getenv("MINIATURAS_MAX_MB", "500"))
+
+# PDFs de orçamento renderizados (orcamentos.pdf): um arquivo por versão do orçamento,
+# apagado quando ele ou os itens mudam. Absoluto ou relativo ao BASE_DIR; fora do
+# MEDIA_ROOT para não ser servido diretamente
+ORCAMENTOS_PDF_CACHE_DIR = os.getenv("ORCAMENTOS_PDF_CACHE_DIR", "cache/orcamentos_pdf")
+
+# Dashboard: tempo (s) em cache das estatísticas de pacientes
+PACIENTES_STATS_CACHE_TTL = int(os.getenv("PACIENTES_STATS_CACHE_TTL", "60"))
+
+# Tarefas em segundo plano (importações etc.): threads por processo e modo síncrono
+BACKGROUND_WORKERS = int(os.getenv("BACKGROUND_WORKERS", "2"))
+BACKGROUND_TASKS_EAGER = os.getenv("BACKGROUND_TASKS_EAGER", "0") == "1"
+
+# Importação de contatos no PostgreSQL via COPY + INSERT ... ON CONFLICT (0 = sempre ORM)
+IMPORTACAO_COPY_POSTGRES = os.getenv("IMPORTACAO_COPY_POSTGRES", "1") == "1"
+
+# Entrega das mensagens de convite (pacientes.entrega). O transporte padrão é o
+# fake local, que não envia nada e só é aceito com DEBUG ligado: sem DEBUG as
+# mensagens ficam na fila até MENSAGENS_TRANSPORTE apontar para um transporte
+# real, como "pacientes.entrega.TransporteHTTP" (com MENSAGENS_GATEWAY_URL)
+MENSAGENS_TRANSPORTE = os.getenv("MENSAGENS_TRANSPORTE", "pacientes.entrega.TransporteFake")
+MENSAGENS_GATEWAY_URL = os.getenv("MENSAGENS_GATEWAY_URL", "")
+MENSAGENS_GATEWAY_TOKEN = os.getenv("MENSAGENS_GATEWAY_TOKEN", "")
+MENSAGENS_TAXA_POR_SEGUNDO = float(os.getenv("MENSAGENS_TAXA_POR_SEGUNDO", "10"))
+MENSAGENS_RAJADA = int(os.getenv("MENSAGENS_RAJADA", "20"))
+MENSAGENS_CONCORRENCIA = int(os.getenv("MENSAGENS_CONCORRENCIA", "4"))
+MENSAGENS_MAX_TENTATIVAS = int(os.getenv("MENSAGENS_MAX_TENTATIVAS", "5"))
+MENSAGENS_BACKOFF_BASE = float(os.getenv("MENSAGENS_BACKOFF_BASE", "1.0"))  # segundos
+MENSAGENS_LOTE = int(os.getenv("MENSAGENS_LOTE", "200"))
+
+# Particionamento mensal de ConviteMensagem no PostgreSQL (pacientes.particoes),
+# ativado com `manage.py manter_particoes_mensagens --converter`. Retenção em
+# meses completos além do atual (0 = nunca desanexar)
+MENSAGENS_PARTICOES_FUTURAS = int(os.getenv("MENSAGENS_PARTICOES_FUTURAS", "3"))
+MENSAGENS_RETENCAO_MESES = int(os.getenv("MENSAGENS_RETENCAO_MESES", "0"))
 
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = DEBUG
@@ -123,7 +199,7 @@ REST_FRAMEWORK = {
         'rest_framework_simplejwt.authentication.JWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'core.pagination.KeysetPagination',  # ?paginacao=cursor ativa o modo keyset
     'PAGE_SIZE': 100,
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
@@ -0,0 +1,202 @@
+"""Armazenamento de arquivos endereçado pelo conteúdo, com deduplicação.
+
+`ArmazenamentoConteudo` calcula o SHA-256 enquanto grava o upload num
+temporário e guarda cada conteúdo uma única vez em
+`documentos/conteudo/<aa>/<sha256><ext>`. Reenviar o mesmo exame ou gerar de
+novo o mesmo PDF só incrementa `ArquivoConteudo.referencias`; cada `save` no
+storage é uma referência e cada `delete` libera uma. O arquivo só sai do disco
+quando ninguém mais aponta para ele.
+
+O Django não apaga arquivos ao apagar registros nem ao trocar o arquivo de um
+registro: os modelos que usam este storage conectam `liberar_arquivos` ao
+`post_delete` e `liberar_substituidos` ao `post_save` (ver `liberar_ao_apagar`).
+Nomes antigos (fora do prefixo) continuam sendo lidos e apagados normalmente;
+`manage.py deduplicar_documentos` migra os existentes.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F, FileField
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from .models import ArquivoConteudo
+
+PREFIXO = "documentos/conteudo"
+
+
+class ArmazenamentoConteudo(FileSystemStorage):
+    """FileSystemStorage que grava cada conteúdo uma vez, pelo hash."""
+
+    def _save(self, name, content):
+        if getattr(content, "sha256", None) and hasattr(content, "temporary_file_path"):
+            # Upload recebido por core.uploads: já está no diretório dos blobs e com o hash;
+            # o temporário é apagado quando o Django fecha o upload
+            return self.registrar(content.temporary_file_path(), content.sha256, content.size, name)
+        diretorio = self.path(PREFIXO)
+        os.makedirs(diretorio, exist_ok=True)
+        # Temporário no mesmo sistema de arquivos do destino: o rename final é atômico
+        fd, temporario = tempfile.mkstemp(dir=diretorio, prefix=".upload-")
+        try:
+            h = hashlib.sha256()
+            tamanho = 0
+            with os.fdopen(fd, "wb") as destino:
+                for chunk in content.chunks():
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode("utf-8")
+                    h.update(chunk)
+                    tamanho += len(chunk)
+                    destino.write(chunk)
+            return self.registrar(temporario, h.hexdigest(), tamanho, name)
+        finally:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+
+    def registrar(self, caminho, sha256, tamanho, nome_original=""):
+        """Soma uma referência ao conteúdo `sha256` e devolve o nome do blob.
+
+        Se o conteúdo é novo, o blob vira um hard link de `caminho` (mesmo
+        sistema de arquivos; sem copiar) e recebe a extensão de `nome_original`.
+        `caminho` continua existindo: quem chamou é que o apaga.
+
+        A referência é somada na transação corrente. Quem grava o registro deve
+        fazer o `save` do arquivo e o INSERT/UPDATE dentro do mesmo
+        `transaction.atomic()`: se o registro falhar, a referência é desfeita
+        junto (um blob novo fica só como arquivo órfão, que `deduplicar_documentos
+        --remover-orfaos` apaga). Fora de uma transação a referência já está
+        gravada quando o registro falha, e sobra uma até o próximo
+        `deduplicar_documentos`.
+        """
+        with transaction.atomic():
+            # A escrita vem primeiro: trava a linha do blob (um `delete` simultâneo espera)
+            # e no SQLite pega o lock de escrita logo no início da transação
+            if not ArquivoConteudo.objects.filter(sha256=sha256).update(referencias=F("referencias") + 1):
+                try:
+                    with transaction.atomic():
+                        ArquivoConteudo.objects.create(
+                            sha256=sha256,
+                            nome=nome_blob(sha256, _extensao(nome_original)),
+                            tamanho=tamanho,
+                            referencias=1,
+                        )
+                except IntegrityError:
+                    # Outro upload do mesmo conteúdo criou o blob entre as duas consultas
+                    ArquivoConteudo.objects.filter(sha256=sha256).update(referencias=F("referencias") + 1)
+            blob = ArquivoConteudo.objects.get(sha256=sha256)
+            destino = self.path(blob.nome)
+            if not os.path.exists(destino):
+                # Novo conteúdo (ou blob perdido do disco): o arquivo recebido vira o blob
+                os.makedirs(os.path.dirname(destino), exist_ok=True)
+                _vincular(caminho, destino)
+                if self.file_permissions_mode is not None:
+                    os.chmod(destino, self.file_permissions_mode)
+        return blob.nome
+
+    def delete(self, name):
+        if not name or not name.startswith(PREFIXO + "/"):
+            return super().delete(name)
+        with transaction.atomic():
+            if not ArquivoConteudo.objects.filter(nome=name).update(referencias=F("referencias") - 1):
+                # Blob sem registro
+                return super().delete(name)
+            blob = ArquivoConteudo.objects.get(nome=name)
+            if blob.referencias == 0:
+                blob.delete()
+                super().delete(name)
+
+_armazenamento = None
+
+
+def obter_armazenamento():
+    """Instância usada pelos FileFields (callable: as migrações guardam só a referência)."""
+    global _armazenamento
+    if _armazenamento is None:
+        _armazenamento = ArmazenamentoConteudo()
+    return _armazenamento
+
+
+def nome_blob(sha256, extensao=""):
+    return f"{PREFIXO}/{sha256[:2]}/{sha256}{extensao}"
+
+
+def liberar_arquivos(sender, instance, **kwargs):
+    """Receiver de `post_delete`: libera a referência de cada arquivo do registro apagado."""
+    for campo in _campos_conteudo(sender):
+        arquivo = getattr(instance, campo.attname)
+        # Arquivos com nome antigo (um por registro) ficam como sempre ficaram
+        if arquivo and arquivo.name.startswith(PREFIXO + "/"):
+            # Só depois do commit: se a exclusão for desfeita o arquivo continua referenciado
+            transaction.on_commit(lambda storage=campo.storage, nome=arquivo.name: storage.delete(nome))
+
+
+def guardar_anteriores(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Receiver de `pre_save`: anota os arquivos do banco que este save vai substituir.
+
+    Conta como substituído o arquivo que mudou de nome e também o que recebeu um
+    upload novo com o mesmo conteúdo: o `save` do upload soma uma referência ao
+    mesmo blob, e a antiga precisa sair.
+    """
+    instance._arquivos_substituidos = []
+    if raw or instance.pk is None:
+        return
+    campos = [
+        campo for campo in _campos_conteudo(sender)
+        if update_fields is None or campo.name in update_fields
+    ]
+    if not campos:
+        return
+    anteriores = sender._base_manager.filter(pk=instance.pk).values(*(campo.attname for campo in campos)).first()
+    for campo in campos:
+        anterior = (anteriores or {}).get(campo.attname)
+        if not anterior or not anterior.startswith(PREFIXO + "/"):
+            continue
+        atual = getattr(instance, campo.attname)
+        if not atual or atual.name != anterior or not atual._committed:
+            instance._arquivos_substituidos.append((campo.storage, anterior))
+
+
+def liberar_substituidos(sender, instance, raw=False, **kwargs):
+    """Receiver de `post_save`: libera a referência dos arquivos substituídos neste save."""
+    substituidos = getattr(instance, "_arquivos_substituidos", None) or []
+    instance._arquivos_substituidos = []
+    for storage, nome in substituidos:
+        # Só depois do commit, como em `liberar_arquivos`
+        transaction.on_commit(lambda storage=storage, nome=nome: storage.delete(nome))
+
+
+def liberar_ao_apagar(*modelos):
+    """Conecta os receivers que liberam referências ao apagar ou trocar o arquivo dos registros."""
+    for modelo in modelos:
+        post_delete.connect(liberar_arquivos, sender=modelo, dispatch_uid=f"liberar_arquivos_{modelo._meta.label}")
+        pre_save.connect(guardar_anteriores, sender=modelo, dispatch_uid=f"guardar_anteriores_{modelo._meta.label}")
+        post_save.connect(liberar_substituidos, sender=modelo, dispatch_uid=f"liberar_substituidos_{modelo._meta.label}")
+
+
+# --------- Helpers ---------
+def _campos_conteudo(modelo):
+    return [
+        campo for campo in modelo._meta.concrete_fields
+        if isinstance(campo, FileField) and isinstance(campo.storage, ArmazenamentoConteudo)
+    ]
+
+
+def _vincular(origem, destino):
+    try:
+        os.link(origem, destino)
+    except FileExistsError:
+        # Criado por outro upload do mesmo conteúdo
+        pass
+    except OSError:
+        # Sistema de arquivos sem hard link: copia e troca de uma vez
+        temporario = f"{destino}.{os.getpid()}.tmp"
+        shutil.copyfile(origem, temporario)
+        os.replace(temporario, destino)
+
+
+def _extensao(nome):
+    extensao = os.path.splitext(nome or "")[1].lower()
+    # Extensões estranhas (ou nomes sem extensão) viram blob sem extensão
+    return extensao if 1 < len(extensao) <= 10 and extensao[1:].isalnum() else ""
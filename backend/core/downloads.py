@@ -0,0 +1,248 @@
+"""Download de arquivos protegidos (documentos de pacientes e de débitos).
+
+A view confere as permissões e `resposta_arquivo` entrega os bytes:
+
+- `DOWNLOAD_PROXY = "x-accel-redirect"` (nginx): a resposta só leva o
+  cabeçalho `X-Accel-Redirect` com `DOWNLOAD_ACCEL_PREFIXO` + nome do arquivo, e
+  o nginx serve o arquivo de uma location `internal` (Range, ETag e sendfile
+  por conta dele).
+- `DOWNLOAD_PROXY = "x-sendfile"` (Apache mod_xsendfile, lighttpd): idem com
+  o caminho absoluto em `X-Sendfile`.
+- Sem proxy: o próprio Django envia o arquivo em streaming, com ETag,
+  Last-Modified (304) e Range de um intervalo (206/416), para que downloads de
+  radiografias grandes possam ser retomados e o visualizador possa pular
+  direto para um trecho sem o arquivo inteiro passar pelo Python.
+
+`resposta_zip` monta um ZIP com vários arquivos durante o envio: cada bloco
+lido do disco sai para o cliente assim que é comprimido, sem arquivo
+temporário e com memória constante, seja qual for o tamanho total.
+
+Downloads grandes (o ZIP) não passam pelo client com o token, que guardaria a
+resposta inteira na memória do navegador: a view emite um `link_assinado`,
+válido por `DOWNLOAD_LINK_VALIDADE_SEGUNDOS`, e o navegador o abre direto,
+gravando em disco à medida que recebe. `LinkAssinado` é a permissão que aceita
+esse link.
+"""
+import logging
+import mimetypes
+import os
+import re
+import zipfile
+from urllib.parse import quote, urlencode
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe, quote_etag
+from rest_framework.permissions import BasePermission
+
+logger = logging.getLogger(__name__)
+
+_SALT_LINK = "core.downloads.link"
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+TAMANHO_BLOCO = 256 * 1024
+# Formatos já comprimidos: vão para o ZIP sem recompressão (ZIP_STORED)
+EXTENSOES_SEM_COMPRESSAO = {
+    ".pdf", ".jpg", ".jpeg", ".png", ".gif", ".webp", ".zip", ".gz", ".mp4", ".mov", ".heic", ".docx", ".xlsx",
+}
+
+
+def resposta_arquivo(request, arquivo, nome=None, content_type=None, anexo=False):
+    """Resposta de download de um FieldFile já autorizado pela view."""
+    if not arquivo:
+        raise Http404("Documento sem arquivo.")
+    nome = nome or os.path.basename(arquivo.name)
+    if not os.path.splitext(nome)[1]:
+        # Nomes de exibição sem extensão (ex.: "Prescrição #12") ganham a do arquivo
+        nome += os.path.splitext(arquivo.name)[1]
+    content_type = content_type or mimetypes.guess_type(nome)[0] or "application/octet-stream"
+
+    modo = getattr(settings, "DOWNLOAD_PROXY", "")
+    if modo == "x-accel-redirect":
+        response = HttpResponse(content_type=content_type)
+        prefixo = getattr(settings, "DOWNLOAD_ACCEL_PREFIXO", "/protegido/").rstrip("/")
+        response["X-Accel-Redirect"] = f"{prefixo}/{quote(arquivo.name)}"
+    elif modo == "x-sendfile":
+        response = HttpResponse(content_type=content_type)
+        response["X-Sendfile"] = arquivo.path
+    else:
+        response = _resposta_direta(request, arquivo.path, content_type)
+    response["Content-Disposition"] = content_disposition_header(anexo, nome)
+    return response
+
+
+def resposta_zip(entradas, nome):
+    """Download de um ZIP gerado em streaming.
+
+    `entradas`: iterável de (caminho dentro do ZIP, FieldFile, datetime). Arquivos
+    ausentes no disco são pulados (e registrados no log) sem interromper o ZIP.
+    """
+    response = StreamingHttpResponse(_gerar_zip(entradas), content_type="application/zip")
+    response["Content-Disposition"] = content_disposition_header(True, nome)
+    # O tamanho final não é conhecido: o nginx não deve segurar a resposta no buffer
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def link_assinado(request, caminho):
+    """URL absoluta de `caminho` com `?assinatura=` do usuário da requisição."""
+    assinatura = signing.TimestampSigner(salt=_SALT_LINK).sign_object(
+        {"caminho": caminho, "usuario": request.user.pk}
+    )
+    return request.build_absolute_uri(f"{caminho}?{urlencode({'assinatura': assinatura})}")
+
+
+class LinkAssinado(BasePermission):
+    """Aceita a requisição sem token quando traz um `link_assinado` deste caminho, ainda no prazo.
+
+    O usuário que pediu o link precisa continuar ativo. Combine com a permissão da
+    view (`LinkAssinado | DjangoModelPermissions`) para o acesso normal continuar valendo.
+    """
+
+    def has_permission(self, request, view):
+        assinatura = request.query_params.get("assinatura")
+        if not assinatura:
+            return False
+        validade = getattr(settings, "DOWNLOAD_LINK_VALIDADE_SEGUNDOS", 60)
+        try:
+            dados = signing.TimestampSigner(salt=_SALT_LINK).unsign_object(assinatura, max_age=validade)
+        except signing.BadSignature:
+            return False
+        if dados.get("caminho") != request.path:
+            return False
+        return get_user_model().objects.filter(pk=dados.get("usuario"), is_active=True).exists()
+
+
+# --------- Helpers ---------
+class _Saida:
+    """Destino do ZipFile: acumula o que foi escrito até o gerador repassar ao cliente.
+
+    Sem seek/tell o zipfile grava em modo streaming (tamanhos e CRC no descritor
+    depois dos dados de cada arquivo).
+    """
+
+    def __init__(self):
+        self.partes = []
+
+    def write(self, dados):
+        self.partes.append(bytes(dados))
+        return len(dados)
+
+    def flush(self):
+        pass
+
+    def esvaziar(self):
+        dados = b"".join(self.partes)
+        self.partes.clear()
+        return dados
+
+
+def _gerar_zip(entradas):
+    saida = _Saida()
+    with zipfile.ZipFile(saida, "w", allowZip64=True) as zf:
+        for nome, arquivo, data in entradas:
+            try:
+                tamanho = os.path.getsize(arquivo.path)
+                origem = open(arquivo.path, "rb")
+            except (FileNotFoundError, ValueError):
+                logger.warning("Arquivo ausente, fora do ZIP: %s", arquivo.name if arquivo else nome)
+                continue
+            info = zipfile.ZipInfo(nome, date_time=_data_zip(data))
+            info.external_attr = 0o644 << 16
+            if os.path.splitext(nome)[1].lower() in EXTENSOES_SEM_COMPRESSAO:
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+            # Com o tamanho informado o zipfile decide sozinho se a entrada precisa de ZIP64
+            info.file_size = tamanho
+            with origem, zf.open(info, "w") as destino:
+                for bloco in iter(lambda: origem.read(TAMANHO_BLOCO), b""):
+                    destino.write(bloco)
+                    dados = saida.esvaziar()
+                    if dados:
+                        yield dados
+            yield saida.esvaziar()
+    # Diretório central
+    yield saida.esvaziar()
+
+
+def _data_zip(data):
+    if data is None:
+        return (1980, 1, 1, 0, 0, 0)
+    if timezone.is_aware(data):
+        data = timezone.localtime(data)
+    return max(data.timetuple()[:6], (1980, 1, 1, 0, 0, 0))
+
+
+def _resposta_direta(request, caminho, content_type):
+    try:
+        info = os.stat(caminho)
+    except FileNotFoundError:
+        raise Http404("Arquivo não encontrado.")
+    tamanho = info.st_size
+    ultima_alteracao = int(info.st_mtime)
+    # Mesmo formato do nginx (mtime-tamanho): o ETag não muda ao trocar de modo
+    etag = quote_etag(f"{ultima_alteracao:x}-{tamanho:x}")
+
+    response = get_conditional_response(request, etag=etag, last_modified=ultima_alteracao)
+    if response is None:
+        intervalo = _intervalo(request, tamanho, etag, ultima_alteracao)
+        if intervalo is None:
+            response = FileResponse(open(caminho, "rb"), content_type=content_type)
+        elif intervalo is False:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{tamanho}"
+        else:
+            inicio, fim = intervalo
+            response = StreamingHttpResponse(_ler(caminho, inicio, fim), status=206, content_type=content_type)
+            response["Content-Range"] = f"bytes {inicio}-{fim}/{tamanho}"
+            response["Content-Length"] = str(fim - inicio + 1)
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(ultima_alteracao)
+    return response
+
+
+def _intervalo(request, tamanho, etag, ultima_alteracao):
+    """(início, fim) do Range pedido; None = arquivo inteiro; False = intervalo impossível (416).
+
+    Só um intervalo por requisição: pedidos com vários (ou malformados) recebem
+    o arquivo inteiro, o que a RFC 9110 permite.
+    """
+    cabecalho = request.META.get("HTTP_RANGE", "").strip()
+    if not cabecalho:
+        return None
+    if_range = request.META.get("HTTP_IF_RANGE", "").strip()
+    if if_range and if_range != etag and parse_http_date_safe(if_range) != ultima_alteracao:
+        # O cliente tem uma versão antiga: manda o arquivo atual inteiro
+        return None
+    m = _RANGE.match(cabecalho)
+    if not m or not (m[1] or m[2]):
+        return None
+    if m[1]:
+        inicio = int(m[1])
+        fim = min(int(m[2]), tamanho - 1) if m[2] else tamanho - 1
+        if inicio >= tamanho or fim < inicio:
+            return False
+    else:
+        # bytes=-N: os últimos N bytes
+        sufixo = int(m[2])
+        if sufixo == 0 or tamanho == 0:
+            return False
+        inicio, fim = max(0, tamanho - sufixo), tamanho - 1
+    return inicio, fim
+
+
+def _ler(caminho, inicio, fim):
+    with open(caminho, "rb") as arquivo:
+        arquivo.seek(inicio)
+        restante = fim - inicio + 1
+        while restante > 0:
+            bloco = arquivo.read(min(TAMANHO_BLOCO, restante))
+            if not bloco:
+                break
+            restante -= len(bloco)
+            yield bloco
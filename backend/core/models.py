@@ -48,4 +48,19 @@ class User(AbstractBaseUser, PermissionsMixin):
     REQUIRED_FIELDS = []
 
     def __str__(self):
-        return self.email
\ No newline at end of file
+        return self.email
+
+class ArquivoConteudo(models.Model):
+    """Arquivo gravado uma única vez por conteúdo (ver core.armazenamento).
+
+    `referencias` conta os registros que apontam para `nome`; o arquivo é
+    apagado quando chega a zero.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    nome = models.CharField(max_length=255)
+    tamanho = models.BigIntegerField(default=0)
+    referencias = models.PositiveIntegerField(default=0)
+    criado_em = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.nome} ({self.referencias} referência(s))"
@@ -0,0 +1,203 @@
+import base64
+import json
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ParseError
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+
+
+class KeysetPagination(PageNumberPagination):
+    """Paginação por página (padrão) com modo keyset opcional por requisição.
+
+    Com `?paginacao=cursor` (ou `?cursor=...`) a listagem deixa de usar
+    `COUNT(*)` + `OFFSET`: cada página filtra a partir dos valores da última
+    linha da página anterior, seguindo a ordenação efetiva do queryset
+    (`-criado_em`, `nome`, `-data`, ...) com desempate estável por `id`.
+    `?total=aproximado` acrescenta o total da listagem: sem filtros, a
+    estimativa do tamanho da tabela lida de `pg_class.reltuples` (contagem
+    exata nos demais bancos); com filtros (busca, paciente, status...), a
+    contagem exata do queryset filtrado, já que a estimativa seria da tabela
+    inteira.
+    """
+
+    cursor_query_param = "cursor"
+    modo_query_param = "paginacao"
+    total_query_param = "total"
+
+    def usar_cursor(self, request):
+        params = request.query_params
+        return self.cursor_query_param in params or params.get(self.modo_query_param) == "cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.modo_cursor = self.usar_cursor(request)
+        if not self.modo_cursor:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        self.ordenacao = self._ordenacao_keyset(queryset)
+        queryset = queryset.order_by(*[("-" if desc else "") + nome for nome, desc in self.ordenacao])
+
+        self.total_aproximado = None
+        if request.query_params.get(self.total_query_param) == "aproximado":
+            self.total_aproximado = self._total_aproximado(queryset)
+
+        valores = self._decode_cursor(request.query_params.get(self.cursor_query_param))
+        if valores is not None:
+            queryset = queryset.filter(self._filtro_apos(queryset.model, valores))
+
+        pagina = list(queryset[: page_size + 1])
+        self.tem_proxima = len(pagina) > page_size
+        pagina = pagina[:page_size]
+        self.ultimo = pagina[-1] if pagina else None
+        return pagina
+
+    def get_paginated_response(self, data):
+        if not getattr(self, "modo_cursor", False):
+            return super().get_paginated_response(data)
+        payload = {"next": self.get_next_link(), "results": data}
+        if self.total_aproximado is not None:
+            payload["total_aproximado"] = self.total_aproximado
+        return Response(payload)
+
+    def get_next_link(self):
+        if not getattr(self, "modo_cursor", False):
+            return super().get_next_link()
+        if not self.tem_proxima or self.ultimo is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.modo_query_param)
+        url = remove_query_param(url, self.total_query_param)
+        return replace_query_param(url, self.cursor_query_param, self._encode_cursor(self.ultimo))
+
+    def get_paginated_response_schema(self, schema):
+        resposta = super().get_paginated_response_schema(schema)
+        resposta["properties"]["total_aproximado"] = {"type": "integer", "nullable": True}
+        return resposta
+
+    def get_schema_operation_parameters(self, view):
+        parametros = super().get_schema_operation_parameters(view)
+        parametros += [
+            {
+                "name": self.modo_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Use 'cursor' para paginação keyset (sem COUNT/OFFSET).",
+                "schema": {"type": "string", "enum": ["cursor"]},
+            },
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Cursor opaco retornado em 'next'.",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": self.total_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Use 'aproximado' para incluir o total (estimado sem filtros; modo cursor).",
+                "schema": {"type": "string", "enum": ["aproximado"]},
+            },
+        ]
+        return parametros
+
+    # --------- Helpers ---------
+    def _ordenacao_keyset(self, queryset):
+        ordering = list(queryset.query.order_by)
+        if not ordering and queryset.query.default_ordering:
+            ordering = list(queryset.model._meta.ordering)
+
+        ordenacao = []
+        for item in ordering:
+            if not isinstance(item, str):
+                raise ParseError("Ordenação não suportada na paginação por cursor.")
+            desc = item.startswith("-")
+            nome = item.lstrip("-")
+            if nome == "pk":
+                nome = "id"
+            if "__" in nome:
+                raise ParseError(f"Ordenação '{item}' não suportada na paginação por cursor.")
+            try:
+                campo = queryset.model._meta.get_field(nome)
+            except FieldDoesNotExist:
+                campo = None
+                if nome not in queryset.query.annotations:
+                    raise ParseError(f"Ordenação '{item}' inválida.")
+            if campo is not None and campo.null:
+                raise ParseError(f"Campo '{nome}' aceita nulos e não pode ser usado com cursor.")
+            ordenacao.append((nome, desc))
+
+        if not any(nome == "id" for nome, _ in ordenacao):
+            desc = ordenacao[0][1] if ordenacao else False
+            ordenacao.append(("id", desc))
+        return ordenacao
+
+    def _filtro_apos(self, model, valores):
+        if len(valores) != len(self.ordenacao):
+            raise NotFound("Cursor inválido.")
+        convertidos = []
+        for (nome, _), valor in zip(self.ordenacao, valores):
+            try:
+                campo = model._meta.get_field(nome)
+                convertidos.append(campo.to_python(valor))
+            except FieldDoesNotExist:
+                convertidos.append(valor)
+            except Exception:
+                raise NotFound("Cursor inválido.")
+
+        # (a, b, id) > (va, vb, vid) expandido respeitando a direção de cada campo
+        filtro = Q()
+        for i, (nome, desc) in enumerate(self.ordenacao):
+            cond = Q(**{f"{nome}__{'lt' if desc else 'gt'}": convertidos[i]})
+            for j in range(i):
+                cond &= Q(**{self.ordenacao[j][0]: convertidos[j]})
+            filtro |= cond
+        return filtro
+
+    def _encode_cursor(self, obj):
+        valores = []
+        for nome, _ in self.ordenacao:
+            valor = getattr(obj, nome)
+            if hasattr(valor, "isoformat"):
+                valor = valor.isoformat()
+            elif not isinstance(valor, (int, float, str, bool)):
+                valor = str(valor)
+            valores.append(valor)
+        bruto = json.dumps(valores, separators=(",", ":")).encode("utf-8")
+        return base64.urlsafe_b64encode(bruto).decode("ascii")
+
+    def _decode_cursor(self, cursor):
+        if not cursor:
+            return None
+        try:
+            valores = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        except (ValueError, TypeError):
+            raise NotFound("Cursor inválido.")
+        if not isinstance(valores, list):
+            raise NotFound("Cursor inválido.")
+        return valores
+
+    def _total_aproximado(self, queryset):
+        """Total da listagem (antes do filtro do cursor): estimativa só para a tabela inteira."""
+        if queryset.query.where:
+            return queryset.order_by().count()
+        conexao = connections[queryset.db]
+        if conexao.vendor == "postgresql":
+            with conexao.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            # reltuples = -1 enquanto a tabela nunca passou por VACUUM/ANALYZE
+            if row and row[0] >= 0:
+                return row[0]
+        return queryset.order_by().count()
@@ -0,0 +1,108 @@
+"""Execução de tarefas em segundo plano sem broker externo.
+
+Um `ThreadPoolExecutor` por processo (tamanho em `BACKGROUND_WORKERS`). As
+tarefas são enviadas só depois do commit da transação corrente, para que o
+worker enxergue os registros criados pela requisição. Com
+`BACKGROUND_TASKS_EAGER = True` (testes/depuração) elas rodam na própria thread.
+
+`Fila` é um executor separado com limite de tarefas pendentes + em execução,
+para trabalho que chega em rajadas (ex.: PDFs): sem vaga, `enfileirar` levanta
+`FilaCheia` e a view responde 503 em vez de acumular trabalho na memória.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, "BACKGROUND_WORKERS", 2),
+                thread_name_prefix="clinica-bg",
+            )
+    return _executor
+
+
+def _executar(func, args, kwargs):
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        logger.exception("Falha na tarefa em segundo plano %s", getattr(func, "__name__", func))
+        raise
+    finally:
+        # Cada thread do pool tem a própria conexão; não deixar abertas entre tarefas
+        connection.close()
+
+
+def enfileirar(func, *args, **kwargs):
+    """Agenda `func(*args, **kwargs)` num worker após o commit da transação atual."""
+    if getattr(settings, "BACKGROUND_TASKS_EAGER", False):
+        transaction.on_commit(lambda: func(*args, **kwargs))
+        return
+    transaction.on_commit(lambda: _get_executor().submit(_executar, func, args, kwargs))
+
+
+class FilaCheia(Exception):
+    """A fila está no limite de tarefas; o chamador deve recusar o trabalho."""
+
+    def __init__(self, fila):
+        super().__init__(f"Fila '{fila.nome}' cheia ({fila.limite} tarefas)")
+        self.fila = fila
+
+
+class Fila:
+    """Executor próprio com no máximo `limite` tarefas pendentes ou em execução.
+
+    A vaga é conferida na chamada e ocupada quando a tarefa é enviada (após o
+    commit); requisições simultâneas podem passar do limite por poucas tarefas,
+    mas nunca por mais que a concorrência do servidor.
+    """
+
+    def __init__(self, nome, workers, limite):
+        self.nome = nome
+        self.workers = workers
+        self.limite = limite
+        self._ocupadas = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def ocupadas(self):
+        return self._ocupadas
+
+    def tem_vaga(self):
+        return self._ocupadas < self.limite
+
+    def enfileirar(self, func, *args, **kwargs):
+        """Agenda `func` após o commit da transação atual; `FilaCheia` se não houver vaga."""
+        if getattr(settings, "BACKGROUND_TASKS_EAGER", False):
+            transaction.on_commit(lambda: func(*args, **kwargs))
+            return
+        if not self.tem_vaga():
+            raise FilaCheia(self)
+        transaction.on_commit(lambda: self._submeter(func, args, kwargs))
+
+    def _submeter(self, func, args, kwargs):
+        with self._lock:
+            self._ocupadas += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"clinica-{self.nome}")
+        self._executor.submit(self._executar, func, args, kwargs)
+
+    def _executar(self, func, args, kwargs):
+        try:
+            return _executar(func, args, kwargs)
+        finally:
+            with self._lock:
+                self._ocupadas -= 1
@@ -0,0 +1,217 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import transaction
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from pacientes.models import Paciente
+
+from .armazenamento import PREFIXO, nome_blob, obter_armazenamento
+from .pagination import KeysetPagination
+from .models import ArquivoConteudo
+
+
+class MidiaTemporariaMixin:
+    """MEDIA_ROOT (e o cache de miniaturas) num diretório temporário, apagado ao fim de cada teste.
+
+    As tarefas de segundo plano (miniaturas) rodam na própria thread: o banco de
+    teste só é visível dentro da transação do teste.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        configuracao = override_settings(
+            MEDIA_ROOT=self.media,
+            MINIATURAS_DIR=os.path.join(self.media, "miniaturas"),
+            BACKGROUND_TASKS_EAGER=True,
+        )
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+
+
+class ArmazenamentoConteudoTests(MidiaTemporariaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.storage = obter_armazenamento()
+
+    def test_mesmo_conteudo_grava_um_blob(self):
+        a = self.storage.save("documentos/a.pdf", ContentFile(b"%PDF-1.4 igual"))
+        b = self.storage.save("documentos/outro.pdf", ContentFile(b"%PDF-1.4 igual"))
+
+        self.assertEqual(a, b)
+        self.assertTrue(a.startswith(PREFIXO + "/"))
+        self.assertTrue(a.endswith(".pdf"))
+        blob = ArquivoConteudo.objects.get()
+        self.assertEqual(blob.referencias, 2)
+        self.assertEqual(blob.tamanho, len(b"%PDF-1.4 igual"))
+        self.assertEqual(a, nome_blob(blob.sha256, ".pdf"))
+        with self.storage.open(a) as arquivo:
+            self.assertEqual(arquivo.read(), b"%PDF-1.4 igual")
+        # Nenhum temporário de upload sobra no diretório dos blobs
+        self.assertEqual([n for n in os.listdir(self.storage.path(PREFIXO)) if n.startswith(".upload-")], [])
+
+    def test_delete_libera_referencia_e_apaga_no_zero(self):
+        nome = self.storage.save("documentos/a.png", ContentFile(b"conteudo"))
+        self.storage.save("documentos/b.png", ContentFile(b"conteudo"))
+
+        self.storage.delete(nome)
+        self.assertEqual(ArquivoConteudo.objects.get().referencias, 1)
+        self.assertTrue(self.storage.exists(nome))
+
+        self.storage.delete(nome)
+        self.assertFalse(ArquivoConteudo.objects.exists())
+        self.assertFalse(self.storage.exists(nome))
+
+    def test_conteudos_diferentes_ficam_separados(self):
+        a = self.storage.save("documentos/a.txt", ContentFile(b"um"))
+        b = self.storage.save("documentos/b.txt", ContentFile(b"dois"))
+
+        self.assertNotEqual(a, b)
+        self.storage.delete(a)
+        self.assertFalse(self.storage.exists(a))
+        self.assertTrue(self.storage.exists(b))
+
+    def test_referencia_desfeita_com_a_transacao(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                self.storage.save("documentos/a.pdf", ContentFile(b"falhou"))
+                raise RuntimeError("INSERT do registro falhou")
+
+        self.assertFalse(ArquivoConteudo.objects.exists())
+
+    def test_delete_de_nome_antigo_apaga_o_arquivo(self):
+        caminho = os.path.join(self.media, "documentos", "2024", "antigo.pdf")
+        os.makedirs(os.path.dirname(caminho))
+        with open(caminho, "wb") as arquivo:
+            arquivo.write(b"legado")
+
+        self.storage.delete("documentos/2024/antigo.pdf")
+        self.assertFalse(os.path.exists(caminho))
+
+
+@override_settings(UPLOAD_ARQUIVO_MAX_MB=10 / 1024)
+class UploadConteudoTests(MidiaTemporariaMixin, TestCase):
+    """Limite de tamanho por arquivo (10 KB aqui) no upload de documentos."""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser("admin", "admin@clinica.test", "senha"))
+        self.paciente = Paciente.objects.create(nome="Ana Souza", cpf="111.111.111-11")
+        agendar = mock.patch("pacientes.miniaturas.agendar")
+        agendar.start()
+        self.addCleanup(agendar.stop)
+
+    def _enviar(self, **arquivos):
+        dados = {"paciente": self.paciente.pk}
+        dados.update({campo: SimpleUploadedFile(f"{campo}.pdf", conteudo) for campo, conteudo in arquivos.items()})
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post("/api/pacientes/documentos/", dados, format="multipart")
+
+    def _temporarios(self):
+        diretorio = obter_armazenamento().path(PREFIXO)
+        return [n for n in os.listdir(diretorio) if n.startswith(".upload-")] if os.path.isdir(diretorio) else []
+
+    def test_arquivo_dentro_do_limite(self):
+        conteudo = b"%PDF-1.4 " + b"x" * (10 * 1024 - 9)
+        resposta = self._enviar(arquivo=conteudo)
+
+        self.assertEqual(resposta.status_code, 201, resposta.data)
+        self.assertEqual(resposta.data["tamanho"], 10 * 1024)
+        self.assertEqual(resposta.data["content_type"], "application/pdf")
+        self.assertEqual(ArquivoConteudo.objects.get().sha256, hashlib.sha256(conteudo).hexdigest())
+
+    def test_arquivo_acima_do_limite(self):
+        resposta = self._enviar(arquivo=b"x" * (10 * 1024 + 1))
+
+        self.assertEqual(resposta.status_code, 413)
+        self.assertFalse(ArquivoConteudo.objects.exists())
+        self.assertEqual(self._temporarios(), [])
+
+    def test_varios_arquivos_dentro_do_limite_somando_mais_que_ele(self):
+        resposta = self._enviar(arquivo=b"a" * 8 * 1024, anexo=b"b" * 8 * 1024)
+
+        self.assertEqual(resposta.status_code, 201, resposta.data)
+        self.assertEqual(resposta.data["tamanho"], 8 * 1024)
+
+    def test_um_dos_arquivos_acima_do_limite(self):
+        resposta = self._enviar(arquivo=b"a" * 1024, anexo=b"b" * (10 * 1024 + 1))
+
+        self.assertEqual(resposta.status_code, 413)
+        self.assertFalse(ArquivoConteudo.objects.exists())
+        self.assertEqual(self._temporarios(), [])
+
+
+class KeysetPaginationTests(TestCase):
+    """Modo cursor (`?paginacao=cursor`) sobre a listagem de pacientes."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser("admin", "admin@clinica.test", "senha"))
+        # Nomes repetidos: o desempate por id precisa manter a ordem estável
+        for i, nome in enumerate(["Ana", "Bia", "Bia", "Bia", "Caio", "Davi", "Davi", "Eva"]):
+            Paciente.objects.create(nome=nome, cpf=f"000.000.000-{i:02d}")
+        tamanho = mock.patch.object(KeysetPagination, "page_size", 3)
+        tamanho.start()
+        self.addCleanup(tamanho.stop)
+
+    def _paginas(self, url):
+        ids = []
+        while url:
+            resposta = self.client.get(url)
+            self.assertEqual(resposta.status_code, 200, resposta.data)
+            ids += [item["id"] for item in resposta.data["results"]]
+            url = resposta.data["next"]
+        return ids
+
+    def test_percorre_tudo_com_empates_na_ordenacao(self):
+        ids = self._paginas("/api/pacientes/?paginacao=cursor")
+
+        esperado = list(Paciente.objects.order_by("nome", "id").values_list("id", flat=True))
+        self.assertEqual(ids, esperado)
+
+    def test_ordenacao_reversa(self):
+        ids = self._paginas("/api/pacientes/?paginacao=cursor&ordering=-nome")
+
+        esperado = list(Paciente.objects.order_by("-nome", "-id").values_list("id", flat=True))
+        self.assertEqual(ids, esperado)
+
+    def test_cursor_estavel_com_insercoes_antes_da_posicao(self):
+        primeira = self.client.get("/api/pacientes/?paginacao=cursor").data
+        vistos = [item["id"] for item in primeira["results"]]
+        # Entra um paciente que ordena antes da página já lida: não desloca as próximas
+        Paciente.objects.create(nome="Aaron", cpf="999.999.999-99")
+
+        vistos += self._paginas(primeira["next"])
+        esperado = list(Paciente.objects.exclude(nome="Aaron").order_by("nome", "id").values_list("id", flat=True))
+        self.assertEqual(vistos, esperado)
+
+    def test_cursor_invalido(self):
+        self.assertEqual(self.client.get("/api/pacientes/?cursor=nao-e-um-cursor").status_code, 404)
+
+    def test_total_da_tabela_e_do_filtro(self):
+        resposta = self.client.get("/api/pacientes/?paginacao=cursor&total=aproximado")
+        self.assertEqual(resposta.data["total_aproximado"], 8)
+        self.assertNotIn("total=", resposta.data["next"])
+
+        resposta = self.client.get("/api/pacientes/?paginacao=cursor&total=aproximado&search=i")
+        self.assertEqual(resposta.data["total_aproximado"], 6)
+
+        # O total não muda ao avançar o cursor
+        proxima = self.client.get(resposta.data["next"] + "&total=aproximado")
+        self.assertEqual(proxima.data["total_aproximado"], 6)
+
+    def test_sem_cursor_continua_por_pagina(self):
+        resposta = self.client.get("/api/pacientes/")
+
+        self.assertEqual(resposta.data["count"], 8)
+        self.assertEqual(len(resposta.data["results"]), 3)
@@ -0,0 +1,125 @@
+"""Upload de arquivos direto para o armazenamento por conteúdo.
+
+`UploadConteudoHandler` substitui os handlers padrão do Django (memória até
+2,5 MB, depois arquivo temporário em /tmp): cada chunk recebido já é gravado
+num temporário dentro do diretório de blobs (`core.armazenamento`), somado ao
+SHA-256 e ao tamanho. O tipo do arquivo vem dos primeiros bytes, não do que o
+navegador informou. Ao salvar, o storage só cria o blob como hard link do
+temporário (nada, se o conteúdo já existir), sem reler nem copiar o arquivo. A
+memória por upload fica limitada ao tamanho do chunk.
+
+O limite `UPLOAD_ARQUIVO_MAX_MB` vale por arquivo: o que passar dele é recusado
+com 413 assim que o excesso chega, sem gravar o resto; uma requisição com vários
+arquivos pode somar mais que o limite. As views ativam o handler com
+`UploadConteudoMixin`.
+"""
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile, UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .armazenamento import PREFIXO, obter_armazenamento
+
+# Assinaturas (offset, bytes) -> content type; a primeira que casar vale
+ASSINATURAS = [
+    (0, b"%PDF-", "application/pdf"),
+    (0, b"\x89PNG\r\n\x1a\n", "image/png"),
+    (0, b"\xff\xd8\xff", "image/jpeg"),
+    (0, b"GIF87a", "image/gif"),
+    (0, b"GIF89a", "image/gif"),
+    (0, b"II*\x00", "image/tiff"),
+    (0, b"MM\x00*", "image/tiff"),
+    (128, b"DICM", "application/dicom"),
+    (0, b"PK\x03\x04", "application/zip"),
+]
+TAMANHO_AMOSTRA = 132
+
+
+class ArquivoGrandeDemais(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_code = "arquivo_grande_demais"
+
+    def __init__(self, limite):
+        super().__init__(f"Arquivo maior que o limite de {limite / (1024 * 1024):.3g} MB.")
+
+
+class UploadConteudo(TemporaryUploadedFile):
+    """Upload já gravado ao lado dos blobs, com `sha256` e tamanho calculados na chegada."""
+
+    def __init__(self, diretorio, name, content_type, size, charset, content_type_extra=None):
+        arquivo = tempfile.NamedTemporaryFile(dir=diretorio, prefix=".upload-")
+        UploadedFile.__init__(self, arquivo, name, content_type, size, charset, content_type_extra)
+        self.sha256 = None
+
+
+class UploadConteudoHandler(FileUploadHandler):
+    chunk_size = 256 * 1024
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.limite = int(getattr(settings, "UPLOAD_ARQUIVO_MAX_MB", 100) * 1024 * 1024)
+        self.upload = None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        storage = obter_armazenamento()
+        diretorio = storage.path(PREFIXO)
+        os.makedirs(diretorio, exist_ok=True)
+        self.hash = hashlib.sha256()
+        self.tamanho = 0
+        self.amostra = b""
+        self.upload = UploadConteudo(diretorio, self.file_name, self.content_type, 0, self.charset, self.content_type_extra)
+
+    def receive_data_chunk(self, raw_data, start):
+        # Tamanho deste arquivo (zerado em new_file), não o da requisição
+        self.tamanho += len(raw_data)
+        if self.tamanho > self.limite:
+            self._descartar()
+            raise ArquivoGrandeDemais(self.limite)
+        if len(self.amostra) < TAMANHO_AMOSTRA:
+            self.amostra += raw_data[:TAMANHO_AMOSTRA - len(self.amostra)]
+        self.hash.update(raw_data)
+        self.upload.write(raw_data)
+
+    def file_complete(self, file_size):
+        upload, self.upload = self.upload, None
+        upload.flush()
+        upload.seek(0)
+        upload.size = file_size
+        upload.sha256 = self.hash.hexdigest()
+        upload.content_type = tipo_conteudo(self.amostra) or upload.content_type
+        return upload
+
+    def upload_interrupted(self):
+        self._descartar()
+
+    # --------- Helpers ---------
+    def _descartar(self):
+        if self.upload is not None:
+            self.upload.close()
+            self.upload = None
+
+
+class UploadConteudoMixin:
+    """Ativa `UploadConteudoHandler` nas actions de `upload_conteudo_acoes`."""
+
+    upload_conteudo_acoes = ("create", "update", "partial_update")
+
+    def initialize_request(self, request, *args, **kwargs):
+        # Precisa vir antes de qualquer acesso a request.POST/FILES (inclusive o do CSRF)
+        if self.action_map.get(request.method.lower()) in self.upload_conteudo_acoes:
+            request.upload_handlers = [UploadConteudoHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
+
+
+def tipo_conteudo(amostra):
+    """Content type pelos primeiros bytes do arquivo, ou None se não reconhecido."""
+    for offset, assinatura, tipo in ASSINATURAS:
+        if amostra[offset:offset + len(assinatura)] == assinatura:
+            return tipo
+    return None
@@ -4,3 +4,10 @@ class FinanceiroConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "financeiro"
     verbose_name = "Financeiro"
+
+    def ready(self):
+        from core.armazenamento import liberar_ao_apagar
+
+        from .models import DebitoDocumento
+
+        liberar_ao_apagar(DebitoDocumento)
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:19
+
+import core.armazenamento
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('financeiro', '0003_rename_financeiro__pacient_9e58ca_idx_financeiro__pacient_6b2e7b_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='debitodocumento',
+            name='arquivo',
+            field=models.FileField(storage=core.armazenamento.obter_armazenamento, upload_to='documentos/debitos/'),
+        ),
+    ]
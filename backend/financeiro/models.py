@@ -3,6 +3,7 @@ from decimal import Decimal
 from django.db import models
 from django.db.models import Sum
 
+from core.armazenamento import obter_armazenamento
 from pacientes.models import Paciente
 
 class Lancamento(models.Model):
@@ -79,7 +80,7 @@ class DebitoItem(models.Model):
 
 class DebitoDocumento(models.Model):
     debito = models.ForeignKey(Debito, on_delete=models.CASCADE, related_name="documentos")
-    arquivo = models.FileField(upload_to="documentos/debitos/")
+    arquivo = models.FileField(upload_to="documentos/debitos/", storage=obter_armazenamento)
     nome = models.CharField(max_length=160, blank=True)
     criado_em = models.DateTimeField(auto_now_add=True)
 
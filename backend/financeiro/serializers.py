@@ -1,5 +1,7 @@
+import os
 from decimal import Decimal
 
+from django.urls import reverse
 from rest_framework import serializers
 
 from .models import Debito, DebitoDocumento, DebitoItem, Lancamento
@@ -17,9 +19,27 @@ class DebitoItemSerializer(serializers.ModelSerializer):
 
 
 class DebitoDocumentoSerializer(serializers.ModelSerializer):
+    download_url = serializers.SerializerMethodField(read_only=True)
+
     class Meta:
         model = DebitoDocumento
-        fields = ("id", "arquivo", "nome", "criado_em")
+        fields = ("id", "arquivo", "nome", "download_url", "criado_em")
+        # O arquivo só sai por `download_url`, que confere a autenticação; o caminho em /media/ não é exposto
+        extra_kwargs = {"arquivo": {"write_only": True}}
+
+    def get_download_url(self, obj):
+        if not obj.arquivo:
+            return None
+        url = reverse("financeiro:debito-download-documento", kwargs={"pk": obj.debito_id, "doc_id": obj.pk})
+        request = self.context.get("request")
+        return request.build_absolute_uri(url) if request is not None else url
+
+    def create(self, validated_data):
+        arquivo = validated_data.get("arquivo")
+        if not validated_data.get("nome") and arquivo is not None:
+            # Sem `arquivo` na resposta, o nome enviado é o que identifica o comprovante
+            validated_data["nome"] = os.path.basename(arquivo.name)[:160]
+        return super().create(validated_data)
 
 
 class DebitoSerializer(serializers.ModelSerializer):
@@ -1,8 +1,14 @@
+import os
+
+from django.db import transaction
 from rest_framework import filters, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import DjangoModelPermissions
 from rest_framework.response import Response
 
+from core.downloads import resposta_arquivo
+from core.uploads import UploadConteudoMixin
+
 from .models import Debito, DebitoDocumento, Lancamento
 from .serializers import (
     DebitoDocumentoSerializer,
@@ -19,13 +25,15 @@ class LancamentoViewSet(viewsets.ModelViewSet):
     ordering_fields = ["data", "valor", "status", "criado_em"]
 
 
-class DebitoViewSet(viewsets.ModelViewSet):
+class DebitoViewSet(UploadConteudoMixin, viewsets.ModelViewSet):
     queryset = Debito.objects.prefetch_related("itens", "documentos").all()
     serializer_class = DebitoSerializer
     permission_classes = [DjangoModelPermissions]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ["paciente__nome", "dentista", "plano", "itens__procedimento"]
     ordering_fields = ["data_vencimento", "valor_total", "status", "criado_em"]
+    # Uploads gravados direto no armazenamento por conteúdo (core.uploads)
+    upload_conteudo_acoes = ("upload_documento",)
 
     def get_queryset(self):
         qs = super().get_queryset()
@@ -42,7 +50,9 @@ class DebitoViewSet(viewsets.ModelViewSet):
         debito = self.get_object()
         serializer = DebitoDocumentoSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        serializer.save(debito=debito)
+        # Arquivo e registro na mesma transação: se o INSERT falhar, a referência ao blob é desfeita
+        with transaction.atomic():
+            serializer.save(debito=debito)
         debito.atualizar_total()
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -55,3 +65,13 @@ class DebitoViewSet(viewsets.ModelViewSet):
             return Response(status=status.HTTP_404_NOT_FOUND)
         documento.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=True, methods=["get"], url_path="documentos/(?P<doc_id>[^/.]+)/download")
+    def download_documento(self, request, pk=None, doc_id=None):
+        """Arquivo do comprovante (ver core.downloads: proxy ou streaming com Range)."""
+        debito = self.get_object()
+        try:
+            documento = debito.documentos.get(pk=doc_id)
+        except DebitoDocumento.DoesNotExist:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        return resposta_arquivo(request, documento.arquivo, nome=os.path.basename(documento.nome or ""))
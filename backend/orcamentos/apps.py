@@ -4,3 +4,7 @@ class OrcamentosConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "orcamentos"
     verbose_name = "Orçamentos"
+
+    def ready(self):
+        # Receivers que invalidam o cache de PDFs quando um orçamento ou item muda
+        from . import pdf  # noqa: F401
@@ -0,0 +1,207 @@
+"""PDF do orçamento com cache em disco e respostas condicionais.
+
+O PDF renderizado fica em `ORCAMENTOS_PDF_CACHE_DIR` como `<id>-<versao>.pdf`.
+A versão é um hash de tudo que aparece no documento (`atualizado_em`, status,
+total, paciente e itens) e vira o ETag da resposta. Não há `Last-Modified`:
+editar um item ou o nome do paciente não muda nenhuma data do orçamento, e o
+ETag já cobre tudo. Se o navegador já tem a versão atual a resposta é 304 sem
+renderizar nada; senão o arquivo em cache é enviado com `FileResponse` e só é
+gerado de novo quando a versão muda. Os receivers abaixo apagam os arquivos de
+um orçamento quando ele ou seus itens são alterados.
+"""
+import functools
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.http import FileResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+
+from .models import Orcamento, OrcamentoItem
+
+try:
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+    from reportlab.lib.units import cm
+    REPORTLAB_AVAILABLE = True
+except Exception:  # pragma: no cover
+    REPORTLAB_AVAILABLE = False
+
+# Incrementar ao mudar o layout, para não servir PDFs antigos do cache
+VERSAO_LAYOUT = 1
+
+
+def resposta_pdf(request, orc):
+    """Resposta do PDF de `orc`: 304 se o cliente já tem a versão atual, senão o arquivo."""
+    itens = list(orc.itens.all())
+    versao = versao_pdf(orc, itens)
+    etag = quote_etag(versao)
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = FileResponse(_abrir_pdf(orc, itens, versao), content_type="application/pdf", filename=f"orcamento_{orc.id}.pdf")
+    response["ETag"] = etag
+    # Dados do paciente: só o navegador guarda, e sempre revalida
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def versao_pdf(orc, itens):
+    h = hashlib.sha256()
+    partes = [
+        VERSAO_LAYOUT,
+        orc.id,
+        orc.atualizado_em.isoformat(),
+        orc.status,
+        str(orc.valor_total),
+        orc.paciente.nome,
+    ]
+    partes += [(it.id, it.dente, it.procedimento, str(it.valor)) for it in itens]
+    h.update(repr(partes).encode("utf-8"))
+    return h.hexdigest()[:32]
+
+
+def arquivo_pdf(orc, itens, versao):
+    """Caminho do PDF desta versão, renderizado e gravado se ainda não estiver em cache."""
+    diretorio = _diretorio_cache()
+    caminho = diretorio / f"{orc.id}-{versao}.pdf"
+    if caminho.exists():
+        return caminho
+
+    diretorio.mkdir(parents=True, exist_ok=True)
+    # Grava num temporário e troca de uma vez: requisições simultâneas nunca leem arquivo pela metade
+    fd, temporario = tempfile.mkstemp(dir=diretorio, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as destino:
+            doc = SimpleDocTemplate(destino, pagesize=A4, leftMargin=2*cm, rightMargin=2*cm, topMargin=1.8*cm, bottomMargin=1.8*cm)
+            doc.build(_build_orcamento_story(orc, itens))
+        os.replace(temporario, caminho)
+    except BaseException:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+    # Versões antigas só saem depois que a nova existe (ex.: o nome do paciente
+    # mudou, o que nenhum receiver daqui vê); quem ainda ia abrir uma delas
+    # renderiza de novo em `_abrir_pdf`
+    limpar_cache(orc.id, manter=caminho)
+    return caminho
+
+
+def limpar_cache(orcamento_id, manter=None):
+    """Apaga os PDFs em cache de um orçamento (todas as versões, menos `manter`)."""
+    for caminho in _diretorio_cache().glob(f"{orcamento_id}-*.pdf"):
+        if caminho == manter:
+            continue
+        try:
+            caminho.unlink()
+        except FileNotFoundError:
+            pass
+
+
+@receiver(post_save, sender=Orcamento)
+@receiver(post_delete, sender=Orcamento)
+def _orcamento_alterado(sender, instance, **kwargs):
+    limpar_cache(instance.pk)
+
+
+@receiver(post_save, sender=OrcamentoItem)
+@receiver(post_delete, sender=OrcamentoItem)
+def _item_alterado(sender, instance, **kwargs):
+    limpar_cache(instance.orcamento_id)
+
+
+# --------- Helpers ---------
+def _abrir_pdf(orc, itens, versao, tentativas=3):
+    # Um save concorrente pode apagar o arquivo entre o exists() e o open(): renderiza de novo
+    for tentativa in range(tentativas):
+        try:
+            return open(arquivo_pdf(orc, itens, versao), "rb")
+        except FileNotFoundError:
+            if tentativa == tentativas - 1:
+                raise
+
+
+def _diretorio_cache():
+    diretorio = Path(settings.ORCAMENTOS_PDF_CACHE_DIR)
+    if not diretorio.is_absolute():
+        diretorio = Path(settings.BASE_DIR) / diretorio
+    return diretorio
+
+
+def _fmt_currency(v):
+    try:
+        return f"R$ {float(v):.2f}"
+    except Exception:
+        return f"R$ {v}"
+
+
+@functools.lru_cache(maxsize=None)
+def _estilos():
+    # A folha de estilos é montada uma vez por processo; os estilos não são alterados depois
+    styles = getSampleStyleSheet()
+
+    title_style = styles['Heading1']
+    title_style.fontName = 'Helvetica-Bold'
+    title_style.fontSize = 16
+    title_style.spaceAfter = 6
+
+    h2 = styles['Heading2']
+    h2.fontName = 'Helvetica-Bold'
+    h2.fontSize = 12
+    h2.spaceBefore = 6
+    h2.spaceAfter = 4
+
+    normal = styles['Normal']
+    normal.fontName = 'Helvetica'
+    normal.fontSize = 10
+    return title_style, h2, normal
+
+
+def _build_orcamento_story(orc, itens):
+    title_style, h2, normal = _estilos()
+    story = []
+
+    # Cabeçalho
+    story.append(Paragraph("Clínica Odontológica", title_style))
+    story.append(Paragraph(f"Orçamento #{orc.id}", h2))
+    story.append(Paragraph(f"Paciente: {orc.paciente.nome}", normal))
+    story.append(Paragraph(f"Status: {orc.get_status_display()}", normal))
+    story.append(Paragraph(f"Criado em: {orc.criado_em:%d/%m/%Y %H:%M}", normal))
+    story.append(Spacer(1, 8))
+
+    # Tabela de itens
+    data = [["Dente", "Procedimento", "Valor (R$)"]]
+    if itens:
+        for it in itens:
+            data.append([str(it.dente or ''), it.procedimento or '', f"{float(it.valor):.2f}"])
+    else:
+        data.append(["—", "Sem itens cadastrados", "—"])
+
+    table = Table(data, colWidths=[3*cm, 10*cm, 3*cm])
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0,0), (-1,0), colors.lightgrey),
+        ('TEXTCOLOR', (0,0), (-1,0), colors.black),
+        ('ALIGN', (0,0), (-1,0), 'CENTER'),
+        ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0,0), (-1,0), 10),
+        ('GRID', (0,0), (-1,-1), 0.25, colors.grey),
+        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+        ('ALIGN', (-1,1), (-1,-1), 'RIGHT'),
+        ('FONTSIZE', (0,1), (-1,-1), 10),
+        ('LEFTPADDING', (0,0), (-1,-1), 6),
+        ('RIGHTPADDING', (0,0), (-1,-1), 6),
+        ('TOPPADDING', (0,0), (-1,-1), 4),
+        ('BOTTOMPADDING', (0,0), (-1,-1), 4),
+    ]))
+    story.append(table)
+
+    story.append(Spacer(1, 6))
+    story.append(Paragraph(f"Total: <b>{_fmt_currency(orc.valor_total)}</b>", h2))
+    return story
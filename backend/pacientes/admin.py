@@ -3,7 +3,9 @@ from .models import (
     Paciente,
     Anamnese,
     Documento,
+    GeracaoDocumento,
     Prescricao,
+    ConviteCampanha,
     ConviteContato,
     ConviteImportacao,
     ConviteMensagem,
@@ -63,6 +65,14 @@ class ConviteContatoAdmin(admin.ModelAdmin):
     ordering = ("nome",)
 
 
+@admin.register(GeracaoDocumento)
+class GeracaoDocumentoAdmin(admin.ModelAdmin):
+    list_display = ("id", "tipo", "paciente", "status", "criado_em", "finalizado_em")
+    search_fields = ("paciente__nome", "tipo")
+    list_filter = ("status", "tipo", "criado_em")
+    ordering = ("-criado_em",)
+
+
 @admin.register(ConviteImportacao)
 class ConviteImportacaoAdmin(admin.ModelAdmin):
     list_display = (
@@ -79,9 +89,17 @@ class ConviteImportacaoAdmin(admin.ModelAdmin):
     ordering = ("-criado_em",)
 
 
+@admin.register(ConviteCampanha)
+class ConviteCampanhaAdmin(admin.ModelAdmin):
+    list_display = ("id", "criado_em", "hash_conteudo")
+    search_fields = ("conteudo",)
+    list_filter = ("criado_em",)
+    ordering = ("-criado_em",)
+
+
 @admin.register(ConviteMensagem)
 class ConviteMensagemAdmin(admin.ModelAdmin):
-    list_display = ("contato", "status", "criado_em")
+    list_display = ("contato", "campanha", "status", "criado_em")
     search_fields = ("contato__nome", "contato__telefone")
     list_filter = ("status", "criado_em")
     ordering = ("-criado_em",)
@@ -1,6 +1,23 @@
+import logging
+
 from django.apps import AppConfig
 
 class PacientesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "pacientes"
     verbose_name = "Pacientes"
+
+    def ready(self):
+        from core.armazenamento import liberar_ao_apagar
+
+        from .models import Documento
+
+        liberar_ao_apagar(Documento)
+
+        from .entrega import transporte_fake_em_producao
+
+        if transporte_fake_em_producao():
+            logging.getLogger("pacientes.entrega").error(
+                "MENSAGENS_TRANSPORTE usa o transporte fake com DEBUG desligado: as mensagens de convite "
+                "ficam na fila sem entrega. Configure pacientes.entrega.TransporteHTTP."
+            )
@@ -0,0 +1,374 @@
+"""Entrega das mensagens de convite em segundo plano.
+
+`enviar` só grava as mensagens como `pendente` e chama `agendar_entrega`, que
+roda `entregar_pendentes` numa fila própria (`core.tarefas.Fila` "mensagens",
+uma thread), separada do executor compartilhado das importações. O entregador
+reserva lotes da fila (`pendente` -> `enviando`, com
+`SELECT ... FOR UPDATE SKIP LOCKED` no PostgreSQL), entrega cada mensagem por
+um `Transporte` num pool de threads de tamanho `MENSAGENS_CONCORRENCIA`,
+respeitando um token bucket de `MENSAGENS_TAXA_POR_SEGUNDO` (rajada de
+`MENSAGENS_RAJADA`). Uma falha temporária não prende a thread esperando: a
+mensagem volta para `pendente` com `proxima_tentativa` no futuro (backoff
+exponencial a partir de `MENSAGENS_BACKOFF_BASE`), até
+`MENSAGENS_MAX_TENTATIVAS`; ao esvaziar a fila, o entregador agenda a própria
+retomada para a primeira tentativa vencida. Os resultados voltam para
+`ConviteMensagem` e `ConviteContato` em lote, um UPDATE por grupo ao final de
+cada lote. O texto de cada mensagem é montado na reserva, a partir da
+`ConviteCampanha`.
+
+Com `DEBUG` desligado o transporte fake é recusado (`ImproperlyConfigured`) e as
+mensagens ficam `pendente` até um transporte real ser configurado.
+
+As threads de envio não tocam no banco; só a thread coordenadora lê e grava.
+O limite de taxa vale por processo.
+"""
+import json
+import logging
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import Min, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from core.tarefas import Fila, FilaCheia
+
+from .models import ConviteCampanha, ConviteContato, ConviteMensagem
+
+logger = logging.getLogger(__name__)
+
+
+class FalhaEnvio(Exception):
+    """Erro de entrega; `temporaria=False` indica que não adianta tentar de novo."""
+
+    def __init__(self, mensagem, temporaria=True):
+        super().__init__(mensagem)
+        self.temporaria = temporaria
+
+
+class Transporte:
+    """Interface dos canais de entrega (gateway de WhatsApp/SMS)."""
+
+    def enviar(self, telefone, texto):
+        """Entrega `texto` para `telefone`; levanta `FalhaEnvio` em caso de erro."""
+        raise NotImplementedError
+
+
+class TransporteFake(Transporte):
+    """Transporte local para desenvolvimento e testes: não envia nada.
+
+    Recusado por `obter_transporte` com `DEBUG` desligado.
+
+    Guarda as últimas `max_registradas` entregas em `enviadas` (só para
+    inspeção; as mais antigas são descartadas). Telefones em `falhar` recusam sempre
+    (falha definitiva); `instaveis` mapeia telefone -> quantas tentativas
+    falham temporariamente antes de a entrega funcionar.
+    """
+
+    def __init__(self, falhar=(), instaveis=None, latencia=0.0, max_registradas=1000):
+        self.falhar = set(falhar)
+        self.instaveis = dict(instaveis or {})
+        self.latencia = latencia
+        self.enviadas = deque(maxlen=max_registradas)
+        self._lock = threading.Lock()
+
+    def enviar(self, telefone, texto):
+        if self.latencia:
+            time.sleep(self.latencia)
+        with self._lock:
+            if telefone in self.falhar:
+                raise FalhaEnvio("Número recusado pelo gateway.", temporaria=False)
+            if self.instaveis.get(telefone, 0) > 0:
+                self.instaveis[telefone] -= 1
+                raise FalhaEnvio("Gateway indisponível.")
+            self.enviadas.append((telefone, texto))
+
+
+class TransporteHTTP(Transporte):
+    """Gateway HTTP genérico: `POST {"telefone", "mensagem"}` em JSON.
+
+    URL e token vêm de `MENSAGENS_GATEWAY_URL` / `MENSAGENS_GATEWAY_TOKEN`.
+    Timeout, 429 e 5xx são falhas temporárias; os demais 4xx, definitivas.
+    """
+
+    def __init__(self, url=None, token=None, timeout=10):
+        self.url = url or getattr(settings, "MENSAGENS_GATEWAY_URL", "")
+        self.token = token or getattr(settings, "MENSAGENS_GATEWAY_TOKEN", "")
+        self.timeout = timeout
+        if not self.url:
+            raise ImproperlyConfigured("MENSAGENS_GATEWAY_URL não configurada.")
+
+    def enviar(self, telefone, texto):
+        corpo = json.dumps({"telefone": telefone, "mensagem": texto}).encode("utf-8")
+        requisicao = urllib.request.Request(self.url, data=corpo, method="POST")
+        requisicao.add_header("Content-Type", "application/json")
+        if self.token:
+            requisicao.add_header("Authorization", f"Bearer {self.token}")
+        try:
+            with urllib.request.urlopen(requisicao, timeout=self.timeout):
+                return
+        except urllib.error.HTTPError as exc:
+            temporaria = exc.code == 429 or exc.code >= 500
+            raise FalhaEnvio(f"Gateway respondeu HTTP {exc.code}.", temporaria=temporaria)
+        except (urllib.error.URLError, TimeoutError, OSError) as exc:
+            raise FalhaEnvio(f"Falha de comunicação com o gateway: {exc}")
+
+
+class TokenBucket:
+    """Limitador de taxa thread-safe: `taxa` fichas por segundo, até `capacidade`."""
+
+    def __init__(self, taxa, capacidade):
+        self.taxa = float(taxa)
+        self.capacidade = float(max(capacidade, 1))
+        self.fichas = self.capacidade
+        self.atualizado = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consumir(self):
+        """Bloqueia até haver uma ficha disponível e a consome."""
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                self.fichas = min(self.capacidade, self.fichas + (agora - self.atualizado) * self.taxa)
+                self.atualizado = agora
+                if self.fichas >= 1:
+                    self.fichas -= 1
+                    return
+                espera = (1 - self.fichas) / self.taxa
+            time.sleep(espera)
+
+
+_transporte = None
+_bucket = None
+_fila = None
+_retomada = None
+_lock = threading.Lock()
+_em_execucao = threading.Lock()
+
+
+def transporte_fake_em_producao():
+    return not settings.DEBUG and issubclass(import_string(settings.MENSAGENS_TRANSPORTE), TransporteFake)
+
+
+def obter_transporte():
+    """Instância (uma por processo) do transporte configurado em `MENSAGENS_TRANSPORTE`.
+
+    Levanta `ImproperlyConfigured` se for o fake com `DEBUG` desligado: marcar as
+    mensagens como enviadas sem enviar nada é pior do que deixá-las na fila.
+    """
+    global _transporte
+    with _lock:
+        if _transporte is None:
+            if transporte_fake_em_producao():
+                raise ImproperlyConfigured(
+                    "MENSAGENS_TRANSPORTE aponta para o transporte fake com DEBUG desligado; "
+                    "configure pacientes.entrega.TransporteHTTP (as mensagens ficam na fila)."
+                )
+            _transporte = import_string(settings.MENSAGENS_TRANSPORTE)()
+    return _transporte
+
+
+def fila_mensagens():
+    """Fila própria da entrega: uma execução em andamento e no máximo uma esperando."""
+    global _fila
+    with _lock:
+        if _fila is None:
+            _fila = Fila("mensagens", workers=1, limite=2)
+    return _fila
+
+
+def agendar_entrega():
+    """Agenda `entregar_pendentes` após o commit da transação atual."""
+    try:
+        fila_mensagens().enfileirar(entregar_pendentes)
+    except FilaCheia:
+        # Já há uma entrega esperando a vez; ela também pega as mensagens novas
+        pass
+
+
+def _obter_bucket():
+    global _bucket
+    with _lock:
+        if _bucket is None:
+            _bucket = TokenBucket(settings.MENSAGENS_TAXA_POR_SEGUNDO, settings.MENSAGENS_RAJADA)
+    return _bucket
+
+
+class Entregador:
+    """Esvazia a fila de `ConviteMensagem` pendentes, lote a lote."""
+
+    def __init__(
+        self,
+        transporte=None,
+        bucket=None,
+        concorrencia=None,
+        max_tentativas=None,
+        backoff_base=None,
+        tamanho_lote=None,
+    ):
+        self.transporte = transporte or obter_transporte()
+        self.bucket = bucket or _obter_bucket()
+        self.concorrencia = concorrencia or settings.MENSAGENS_CONCORRENCIA
+        self.max_tentativas = max_tentativas or settings.MENSAGENS_MAX_TENTATIVAS
+        self.backoff_base = settings.MENSAGENS_BACKOFF_BASE if backoff_base is None else backoff_base
+        self.tamanho_lote = tamanho_lote or settings.MENSAGENS_LOTE
+        self.stats = {"enviados": 0, "falhas": 0, "reagendadas": 0}
+
+    def executar(self):
+        """Entrega tudo o que estiver vencido na fila; retorna as estatísticas."""
+        with ThreadPoolExecutor(max_workers=self.concorrencia, thread_name_prefix="clinica-envio") as pool:
+            while True:
+                lote = self._reservar_lote()
+                if not lote:
+                    return self.stats
+                futuros = [pool.submit(self._entregar, *item) for item in lote]
+                self._gravar_resultados([futuro.result() for futuro in as_completed(futuros)])
+
+    # --------- Helpers ---------
+    def _reservar_lote(self):
+        with transaction.atomic():
+            ids = list(
+                ConviteMensagem.objects.filter(vencidas())
+                .order_by("criado_em", "id")
+                .select_for_update(skip_locked=True)
+                .values_list("id", flat=True)[: self.tamanho_lote]
+            )
+            if not ids:
+                return []
+            ConviteMensagem.objects.filter(id__in=ids).update(status=ConviteMensagem.Status.ENVIANDO)
+        linhas = list(
+            ConviteMensagem.objects.filter(id__in=ids)
+            .order_by()
+            .values_list("id", "contato_id", "contato__telefone", "contato__nome", "campanha_id", "tentativas")
+        )
+        # O texto de cada campanha vem uma vez por lote; os marcadores são preenchidos aqui
+        campanhas = ConviteCampanha.objects.in_bulk({linha[4] for linha in linhas})
+        return [
+            (mensagem_id, contato_id, telefone, campanhas[campanha_id].renderizar(nome), tentativas)
+            for mensagem_id, contato_id, telefone, nome, campanha_id, tentativas in linhas
+        ]
+
+    def _entregar(self, mensagem_id, contato_id, telefone, texto, tentativas):
+        """Roda numa thread do pool: uma tentativa; devolve `(id, contato_id, status, erro, tentativas)`."""
+        self.bucket.consumir()
+        tentativas += 1
+        try:
+            self.transporte.enviar(telefone, texto)
+            return mensagem_id, contato_id, ConviteMensagem.Status.ENVIADO, "", tentativas
+        except FalhaEnvio as exc:
+            erro, temporaria = str(exc), exc.temporaria
+        except Exception as exc:  # transporte com bug não derruba o lote
+            logger.exception("Erro inesperado no transporte ao enviar a mensagem %s", mensagem_id)
+            erro, temporaria = f"Erro inesperado: {exc}", True
+        if temporaria and tentativas < self.max_tentativas:
+            return mensagem_id, contato_id, ConviteMensagem.Status.PENDENTE, erro, tentativas
+        return mensagem_id, contato_id, ConviteMensagem.Status.FALHA, erro, tentativas
+
+    def _espera(self, tentativas):
+        # 1x, 2x, 4x... a base, com jitter para as repetições não saírem todas juntas
+        segundos = self.backoff_base * (2 ** (tentativas - 1))
+        return timedelta(seconds=segundos * random.uniform(1.0, 1.25))
+
+    def _gravar_resultados(self, resultados):
+        agora = timezone.now()
+        mensagens = []
+        contatos_ok = set()
+        contatos_falha = set()
+        for mensagem_id, contato_id, status, erro, tentativas in resultados:
+            repetir = status == ConviteMensagem.Status.PENDENTE
+            mensagens.append(
+                ConviteMensagem(
+                    pk=mensagem_id,
+                    status=status,
+                    erro=erro,
+                    tentativas=tentativas,
+                    enviado_em=agora if status == ConviteMensagem.Status.ENVIADO else None,
+                    proxima_tentativa=agora + self._espera(tentativas) if repetir else None,
+                )
+            )
+            if status == ConviteMensagem.Status.ENVIADO:
+                contatos_ok.add(contato_id)
+            elif status == ConviteMensagem.Status.FALHA:
+                contatos_falha.add(contato_id)
+        # Contato com uma entrega bem-sucedida no lote fica como enviado
+        contatos_falha -= contatos_ok
+
+        with transaction.atomic():
+            ConviteMensagem.objects.bulk_update(
+                mensagens, ["status", "erro", "tentativas", "enviado_em", "proxima_tentativa"], batch_size=500
+            )
+            if contatos_ok:
+                ConviteContato.objects.filter(id__in=contatos_ok).update(
+                    status=ConviteContato.Status.ENVIADO, ultima_mensagem_em=agora, atualizado_em=agora
+                )
+            if contatos_falha:
+                ConviteContato.objects.filter(id__in=contatos_falha).update(
+                    status=ConviteContato.Status.FALHA, atualizado_em=agora
+                )
+        for _, _, status, _, _ in resultados:
+            if status == ConviteMensagem.Status.ENVIADO:
+                self.stats["enviados"] += 1
+            elif status == ConviteMensagem.Status.FALHA:
+                self.stats["falhas"] += 1
+            else:
+                self.stats["reagendadas"] += 1
+
+
+def vencidas():
+    """Mensagens pendentes que já podem ser entregues (sem tentativa adiada para o futuro)."""
+    return Q(status=ConviteMensagem.Status.PENDENTE) & (
+        Q(proxima_tentativa__isnull=True) | Q(proxima_tentativa__lte=timezone.now())
+    )
+
+
+def _agendar_retomada():
+    """Agenda uma nova entrega para quando vencer a primeira tentativa adiada.
+
+    Um `threading.Timer` só agenda (não ocupa thread de envio enquanto espera).
+    Se o processo terminar antes, as mensagens continuam `pendente` e a próxima
+    entrega (ou `manage.py entregar_mensagens`) as pega.
+    """
+    global _retomada
+    proxima = ConviteMensagem.objects.filter(
+        status=ConviteMensagem.Status.PENDENTE, proxima_tentativa__isnull=False
+    ).aggregate(proxima=Min("proxima_tentativa"))["proxima"]
+    if proxima is None:
+        return None
+    espera = max((proxima - timezone.now()).total_seconds(), 0)
+    with _lock:
+        if _retomada is not None and _retomada.is_alive():
+            _retomada.cancel()
+        _retomada = threading.Timer(espera, agendar_entrega)
+        _retomada.daemon = True
+        _retomada.start()
+    return proxima
+
+
+def entregar_pendentes():
+    """Tarefa de segundo plano: entrega tudo o que estiver na fila.
+
+    Só um entregador por processo; uma chamada concorrente retorna na hora,
+    já que a execução em andamento continua até a fila esvaziar.
+    """
+    total = None
+    while True:
+        if not _em_execucao.acquire(blocking=False):
+            return total
+        try:
+            stats = Entregador().executar()
+        finally:
+            _em_execucao.release()
+        total = stats if total is None else {chave: total[chave] + stats[chave] for chave in total}
+        # Mensagens enfileiradas enquanto a execução terminava e a trava era liberada
+        if not ConviteMensagem.objects.filter(vencidas()).exists():
+            _agendar_retomada()
+            return total
@@ -0,0 +1,52 @@
+"""Enfileiramento de envios de convite para muitos contatos.
+
+Em vez de um INSERT + um UPDATE por contato dentro de uma única transação, os
+contatos são processados em lotes de `ENVIO_CHUNK_SIZE`: cada lote grava as
+mensagens como `pendente` com um `bulk_create`, na sua própria transação. O
+texto fica uma única vez em `ConviteCampanha`; as mensagens só apontam para
+ela. A entrega de fato (e a atualização de `ConviteContato.status`) fica com
+`pacientes.entrega`, em segundo plano. Como os ids são consumidos sob demanda,
+uma campanha por filtro pode passar direto o `.iterator()` do queryset (cursor
+no servidor, no PostgreSQL).
+"""
+from django.db import transaction
+
+from .models import ConviteCampanha, ConviteMensagem
+
+ENVIO_CHUNK_SIZE = 1000
+
+
+def _lotes(ids, tamanho):
+    lote = []
+    for contato_id in ids:
+        lote.append(contato_id)
+        if len(lote) >= tamanho:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def registrar_envio(contato_ids, mensagem, chunk_size=ENVIO_CHUNK_SIZE):
+    """Cria a campanha com `mensagem` e coloca um envio na fila para cada contato.
+
+    `contato_ids` pode ser qualquer iterável de ids (lista ou gerador).
+    Retorna `(campanha, enfileirados)`; sem destinatários a campanha é
+    descartada e volta `None`.
+    """
+    campanha = ConviteCampanha.objects.create(conteudo=mensagem)
+    enfileirados = 0
+    for lote in _lotes(contato_ids, chunk_size):
+        with transaction.atomic():
+            ConviteMensagem.objects.bulk_create(
+                [
+                    ConviteMensagem(contato_id=contato_id, campanha=campanha, status=ConviteMensagem.Status.PENDENTE)
+                    for contato_id in lote
+                ],
+                batch_size=chunk_size,
+            )
+        enfileirados += len(lote)
+    if not enfileirados:
+        campanha.delete()
+        return None, 0
+    return campanha, enfileirados
@@ -0,0 +1,84 @@
+import re
+
+from django.db import connections
+from django.db.models import Case, IntegerField, Q, Value, When
+from rest_framework import filters
+
+from .models import _somente_digitos, normalizar_busca
+
+# Termos como "123.456.789-00" ou "(11) 9999-0000" são buscados só pelos dígitos
+_TERMO_NUMERICO = re.compile(r"^[\d\s().\-/+]+$")
+
+
+class PacienteSearchFilter(filters.SearchFilter):
+    """Busca de pacientes sobre a coluna normalizada `Paciente.busca`.
+
+    Como no SearchFilter padrão, cada palavra do termo precisa aparecer (AND),
+    mas numa única coluna (nome, CPF, telefone e e-mail normalizados) em vez de
+    quatro `ILIKE '%x%'`. No PostgreSQL os LIKE são atendidos pelo índice GIN
+    `gin_trgm_ops` e o resultado é ordenado pela similaridade de trigramas com
+    o termo inteiro; nos demais bancos (SQLite local), com os prefixos primeiro.
+    """
+
+    def normalizar_termo(self, termo):
+        termo = (termo or "").strip()
+        if _TERMO_NUMERICO.match(termo):
+            return "".join(ch for ch in termo if ch.isdigit())
+        return normalizar_busca(termo)
+
+    def filter_queryset(self, request, queryset, view):
+        termo = self.normalizar_termo(request.query_params.get(self.search_param, ""))
+        if not termo:
+            return queryset
+
+        filtro = Q()
+        for palavra in termo.split():
+            filtro &= Q(busca__contains=palavra)
+        queryset = queryset.filter(filtro)
+
+        if connections[queryset.db].vendor == "postgresql":
+            from django.contrib.postgres.search import TrigramWordSimilarity
+
+            return (
+                queryset.annotate(similaridade=TrigramWordSimilarity(termo, "busca"))
+                .order_by("-similaridade", "nome")
+            )
+
+        return (
+            queryset.annotate(
+                similaridade=Case(
+                    When(busca__startswith=termo, then=Value(1)),
+                    default=Value(0),
+                    output_field=IntegerField(),
+                )
+            )
+            .order_by("-similaridade", "nome")
+        )
+
+
+def buscar_contatos(queryset, termo):
+    """Filtra contatos de convite pelo nome ou pelo início do CPF/telefone normalizados.
+
+    No PostgreSQL o `UPPER(nome) LIKE '%x%'` usa o índice GIN trigram e os
+    prefixos os índices `varchar_pattern_ops` das colunas normalizadas, combinados
+    num BitmapOr.
+    """
+    termo = (termo or "").strip()
+    if not termo:
+        return queryset
+    filtro = Q(nome__icontains=termo)
+    digitos = _somente_digitos(termo)
+    if digitos:
+        filtro |= Q(cpf_normalizado__startswith=digitos) | Q(telefone_normalizado__startswith=digitos)
+    return queryset.filter(filtro)
+
+
+class ConviteContatoSearchFilter(filters.SearchFilter):
+    """`?search=` da listagem de contatos de convite (ver `buscar_contatos`).
+
+    Substitui o SearchFilter padrão, cujo `icontains` sobre cpf/telefone crus não
+    tem índice e levava toda busca a um seq scan.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        return buscar_contatos(queryset, request.query_params.get(self.search_param, ""))
@@ -0,0 +1,142 @@
+"""Geração em lote de documentos de modelo (ver gerador_documentos) para muitos pacientes.
+
+A renderização, que é CPU pura do ReportLab, vai para um `ProcessPoolExecutor`
+próprio do processo (`DOCUMENTOS_LOTE_PROCESSOS`), criado com `spawn` e aquecido
+na inicialização (`gerador_documentos.aquecer`: modelos compilados, logo
+carregado e métricas das fontes em memória). Os workers não acessam o banco;
+recebem só id/nome/CPF em blocos e devolvem os bytes. Os arquivos são gravados
+no storage e os `Documento` criados com `bulk_create` no processo que chamou.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import repeat
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import models, transaction
+
+from . import miniaturas
+from .gerador_documentos import DadosPaciente, aquecer, nome_arquivo_pdf, renderizar_lote
+from .models import Anamnese, Documento, Paciente
+
+# Pacientes por tarefa enviada ao pool: amortiza o custo de IPC sem prender um worker por muito tempo
+TAMANHO_BLOCO = 25
+
+
+class ResultadoLote:
+    def __init__(self, documentos, processos, segundos, segundos_gravacao):
+        self.documentos = documentos
+        self.processos = processos
+        self.segundos = segundos
+        self.segundos_gravacao = segundos_gravacao
+
+    @property
+    def por_segundo(self):
+        return len(self.documentos) / self.segundos if self.segundos else 0.0
+
+
+def condicoes_anamnese():
+    """Condições (booleans da anamnese) aceitas como filtro de pacientes."""
+    return [f.name for f in Anamnese._meta.get_fields() if isinstance(f, models.BooleanField)]
+
+
+def filtrar_pacientes(pacientes=None, condicao=None):
+    """Pacientes por ids e/ou por condição marcada na anamnese (ex.: possui_hipertensao)."""
+    qs = Paciente.objects.order_by("id")
+    if pacientes:
+        qs = qs.filter(id__in=pacientes)
+    if condicao:
+        if condicao not in condicoes_anamnese():
+            raise ValueError(f"Condição desconhecida: {condicao}")
+        qs = qs.filter(**{f"anamnese__{condicao}": True})
+    return qs
+
+
+def gerar_lote(modelo, pacientes, processos=None):
+    """Gera `modelo` para cada paciente, grava os arquivos e cria os Documentos.
+
+    `processos` <= 1 renderiza no próprio processo; mais processos que CPUs só
+    somariam custo de IPC. Se a gravação no banco falhar, os arquivos já salvos
+    são removidos.
+    """
+    if processos is None:
+        processos = getattr(settings, "DOCUMENTOS_LOTE_PROCESSOS", 2)
+    processos = min(processos, os.cpu_count() or 1)
+    inicio = time.perf_counter()
+    dados = [DadosPaciente(p.id, p.nome, p.cpf) for p in pacientes]
+    blocos = [dados[i:i + TAMANHO_BLOCO] for i in range(0, len(dados), TAMANHO_BLOCO)]
+    if processos > 1 and len(blocos) > 1:
+        resultados = _mapear_no_pool(processos, modelo.tipo, blocos)
+    else:
+        resultados = (renderizar_lote(modelo.tipo, bloco) for bloco in blocos)
+
+    campo = Documento._meta.get_field("arquivo")
+    documentos = []
+    gravacao = 0.0
+    try:
+        # Os blocos chegam em ordem, conforme ficam prontos: grava enquanto os workers renderizam
+        for bloco in resultados:
+            t = time.perf_counter()
+            for paciente, pdf_bytes in bloco:
+                nome = campo.generate_filename(None, nome_arquivo_pdf(modelo, paciente.nome))
+                nome = campo.storage.save(nome, ContentFile(pdf_bytes), max_length=campo.max_length)
+                documentos.append(Documento(
+                    paciente_id=paciente.id,
+                    arquivo=nome,
+                    nome=modelo.nome_arquivo,
+                    content_type="application/pdf",
+                    tamanho=len(pdf_bytes),
+                ))
+            gravacao += time.perf_counter() - t
+        t = time.perf_counter()
+        with transaction.atomic():
+            Documento.objects.bulk_create(documentos, batch_size=500)
+        gravacao += time.perf_counter() - t
+    except Exception:
+        for doc in documentos:
+            campo.storage.delete(doc.arquivo.name)
+        raise
+    # bulk_create não passa por perform_create: as miniaturas são agendadas aqui, numa tarefa só
+    miniaturas.agendar_varios(documentos)
+    return ResultadoLote(documentos, processos, time.perf_counter() - inicio, gravacao)
+
+
+# --------- Helpers ---------
+_pool = None
+_pool_processos = 0
+_pool_lock = threading.Lock()
+
+
+def _obter_pool(processos):
+    global _pool, _pool_processos
+    with _pool_lock:
+        if _pool is None or _pool_processos != processos:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            # spawn: fork de um processo com threads (servidor web, pool de tarefas) pode
+            # herdar locks presos. Os workers importam só gerador_documentos
+            _pool = ProcessPoolExecutor(
+                max_workers=processos,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=aquecer,
+            )
+            _pool_processos = processos
+        return _pool
+
+
+def _mapear_no_pool(processos, tipo, blocos):
+    global _pool
+    pool = _obter_pool(processos)
+    try:
+        yield from pool.map(renderizar_lote, repeat(tipo), blocos)
+    except BrokenProcessPool:
+        # Worker morto (ex.: OOM): o próximo lote cria um pool novo
+        with _pool_lock:
+            if _pool is pool:
+                _pool = None
+        raise
+
@@ -0,0 +1,172 @@
+"""Gravação dos PDFs gerados como Documento do paciente, na hora ou em segundo plano.
+
+`exportar_prescricao` e `gerar_modelo` renderizam e salvam o Documento; é o
+caminho síncrono das views. Com `assincrono=1` as views chamam `agendar`, que cria
+uma `GeracaoDocumento` pendente e a envia para a fila de PDFs: `core.tarefas.Fila`
+com `PDF_ASSINCRONO_WORKERS` threads e no máximo `PDF_ASSINCRONO_FILA_MAX`
+gerações pendentes ou em andamento por processo. Sem vaga, `agendar` levanta
+`FilaCheia` sem criar nada e a view responde 503. O cliente acompanha a geração
+por `GET /documentos/geracoes/{id}/`.
+
+`agendar_lote` faz o mesmo para muitos pacientes de uma vez (`documentos/gerar-lote/`):
+uma geração por paciente, todas processadas por uma única tarefa da fila, que
+ocupa uma vaga só.
+"""
+import logging
+import threading
+from datetime import datetime
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+
+from core.tarefas import Fila, FilaCheia
+
+from .geracao_lote import gerar_lote
+from .gerador_documentos import gerar_pdf, nome_arquivo_pdf, obter_modelos
+from .miniaturas import agendar as agendar_miniatura
+from .models import Documento, GeracaoDocumento
+from .pdf_prescricao import gerar_pdf_prescricao
+
+logger = logging.getLogger(__name__)
+
+_fila = None
+_lock = threading.Lock()
+
+
+def fila_pdf():
+    global _fila
+    with _lock:
+        if _fila is None:
+            _fila = Fila(
+                "pdf",
+                workers=getattr(settings, "PDF_ASSINCRONO_WORKERS", 2),
+                limite=getattr(settings, "PDF_ASSINCRONO_FILA_MAX", 20),
+            )
+    return _fila
+
+
+def salvar_documento(paciente, pdf_bytes, filename, nome):
+    doc = Documento(paciente=paciente, nome=nome, content_type="application/pdf", tamanho=len(pdf_bytes))
+    with transaction.atomic():
+        doc.arquivo.save(filename, ContentFile(pdf_bytes, name=filename), save=True)
+    agendar_miniatura(doc)
+    return doc
+
+
+def exportar_prescricao(prescricao):
+    pdf_bytes = gerar_pdf_prescricao(prescricao)
+    hoje = datetime.now().strftime("%Y-%m-%d")
+    filename = f"prescricao_{prescricao.paciente.nome}_{prescricao.id}_{hoje}.pdf".replace(" ", "_")
+    return salvar_documento(prescricao.paciente, pdf_bytes, filename, f"Prescrição #{prescricao.id}")
+
+
+def gerar_modelo(paciente, modelo):
+    pdf_bytes = gerar_pdf(modelo, paciente)
+    return salvar_documento(paciente, pdf_bytes, nome_arquivo_pdf(modelo, paciente.nome), modelo.nome_arquivo)
+
+
+def agendar(paciente, tipo, prescricao=None):
+    """Cria a geração pendente e a envia para a fila; `FilaCheia` se não houver vaga."""
+    fila = fila_pdf()
+    if not fila.tem_vaga():
+        raise FilaCheia(fila)
+    geracao = GeracaoDocumento.objects.create(paciente=paciente, tipo=tipo, prescricao=prescricao)
+    try:
+        fila.enfileirar(processar_geracao, geracao.pk)
+    except FilaCheia:
+        # Outra requisição ocupou a última vaga entre a conferência e o envio
+        geracao.delete()
+        raise
+    return geracao
+
+
+def processar_geracao(geracao_id):
+    """Renderiza e salva o documento de uma `GeracaoDocumento` pendente.
+
+    Roda na fila de PDFs (ou via `manage.py processar_geracoes_documentos`).
+    """
+    geracao = GeracaoDocumento.objects.select_related("paciente", "prescricao__paciente").get(pk=geracao_id)
+    if geracao.status not in (GeracaoDocumento.Status.PENDENTE, GeracaoDocumento.Status.PROCESSANDO):
+        return geracao
+
+    geracao.status = GeracaoDocumento.Status.PROCESSANDO
+    geracao.iniciado_em = timezone.now()
+    geracao.save(update_fields=["status", "iniciado_em"])
+
+    try:
+        if geracao.tipo == GeracaoDocumento.TIPO_PRESCRICAO:
+            geracao.documento = exportar_prescricao(geracao.prescricao)
+        else:
+            modelo = obter_modelos().get(geracao.tipo)
+            if modelo is None:
+                raise ValueError(f"Modelo '{geracao.tipo}' não está mais disponível.")
+            geracao.documento = gerar_modelo(geracao.paciente, modelo)
+        geracao.status = GeracaoDocumento.Status.CONCLUIDO
+    except Exception as exc:
+        logger.exception("Falha na geração de documento %s", geracao.pk)
+        geracao.status = GeracaoDocumento.Status.FALHA
+        geracao.log = f"Erro inesperado: {exc}"
+
+    geracao.finalizado_em = timezone.now()
+    geracao.save(update_fields=["status", "documento", "log", "finalizado_em"])
+    return geracao
+
+
+def agendar_lote(pacientes, tipo):
+    """Cria uma geração pendente por paciente e envia o lote para a fila; `FilaCheia` se não houver vaga."""
+    fila = fila_pdf()
+    if not fila.tem_vaga():
+        raise FilaCheia(fila)
+    geracoes = GeracaoDocumento.objects.bulk_create(
+        [GeracaoDocumento(paciente=paciente, tipo=tipo) for paciente in pacientes]
+    )
+    ids = [geracao.pk for geracao in geracoes]
+    try:
+        fila.enfileirar(processar_lote, ids)
+    except FilaCheia:
+        GeracaoDocumento.objects.filter(pk__in=ids).delete()
+        raise
+    return geracoes
+
+
+def processar_lote(geracao_ids):
+    """Renderiza e salva numa tarefa só as gerações pendentes de um lote (`agendar_lote`).
+
+    Renderiza na própria thread da fila: o pool de processos de `geracao_lote`
+    fica para o comando `gerar_documentos_lote`, fora do servidor web. Gerações
+    que sobrarem pendentes (reinício) saem uma a uma em `processar_geracoes_documentos`.
+    """
+    geracoes = list(
+        GeracaoDocumento.objects.select_related("paciente")
+        .filter(pk__in=geracao_ids, status=GeracaoDocumento.Status.PENDENTE)
+        .order_by("pk")
+    )
+    if not geracoes:
+        return geracoes
+    ids = [geracao.pk for geracao in geracoes]
+    GeracaoDocumento.objects.filter(pk__in=ids).update(
+        status=GeracaoDocumento.Status.PROCESSANDO, iniciado_em=timezone.now()
+    )
+
+    try:
+        modelo = obter_modelos().get(geracoes[0].tipo)
+        if modelo is None:
+            raise ValueError(f"Modelo '{geracoes[0].tipo}' não está mais disponível.")
+        resultado = gerar_lote(modelo, [geracao.paciente for geracao in geracoes], processos=1)
+    except Exception as exc:
+        logger.exception("Falha na geração em lote %s", ids)
+        GeracaoDocumento.objects.filter(pk__in=ids).update(
+            status=GeracaoDocumento.Status.FALHA, log=f"Erro inesperado: {exc}", finalizado_em=timezone.now()
+        )
+        return geracoes
+
+    # gerar_lote devolve os documentos na ordem dos pacientes
+    agora = timezone.now()
+    for geracao, documento in zip(geracoes, resultado.documentos):
+        geracao.documento = documento
+        geracao.status = GeracaoDocumento.Status.CONCLUIDO
+        geracao.finalizado_em = agora
+    GeracaoDocumento.objects.bulk_update(geracoes, ["documento", "status", "finalizado_em"])
+    return geracoes
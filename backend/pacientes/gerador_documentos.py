@@ -0,0 +1,332 @@
+"""Modelos prontos de documentos (receitas, orientações e termos) descritos em JSON.
+
+Cada arquivo `<tipo>.json` em `pacientes/modelos_documentos/` (ou no diretório
+`DOCUMENTOS_MODELOS_DIR`, que tem precedência para o mesmo tipo) descreve título,
+blocos de texto e assinaturas. Os arquivos são lidos e compilados uma vez por
+processo: fontes, espaçamentos e quebras de linha viram uma lista de operações de
+desenho, e por documento só os campos do paciente são preenchidos e as posições
+verticais acumuladas. O cache é refeito quando algum arquivo muda, conferido no
+máximo a cada `PDF_RECURSOS_VERIFICACAO_SEGUNDOS`. Os modelos vêm só de arquivos:
+os workers da geração em lote importam este módulo sem `django.setup()`.
+
+Formato (medidas em cm, fontes do ReportLab)::
+
+    {
+      "titulo": "Termo de Consentimento — Implante Dentário",
+      "nome_arquivo": "Termo_Implante",
+      "topo": 4.6,
+      "blocos": [
+        {"paragrafo": "Paciente: {paciente}\\nData: {data}", "tamanho": 12, "depois": 0.6, "largura": 17},
+        {"texto": "Informações e riscos:", "fonte": "Helvetica-Bold", "tamanho": 12, "depois": 0.6},
+        {"lista": ["• item", "• item"], "x": 2.2, "entrelinhas": 0.7},
+        {"assinaturas": [{"de": 2, "ate": 9, "rotulo": "Assinatura do(a) paciente"}], "antes": 2.0}
+      ]
+    }
+
+Campos disponíveis nos textos: `{paciente}`, `{cpf}` e `{data}`. Os parágrafos são
+quebrados pela largura real do texto na fonte (`largura` em cm; padrão: até 2 cm da
+borda direita). Os sem campos já saem quebrados da compilação; os com campos são
+quebrados por documento, depois do preenchimento, e o que vem abaixo acompanha a
+altura deles.
+"""
+import io
+import json
+import logging
+import re
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import cm
+from reportlab.pdfbase.pdfmetrics import getFont, stringWidth
+from reportlab.pdfgen import canvas
+
+from .pdf_recursos import desenhar_cabecalho
+
+logger = logging.getLogger(__name__)
+
+DIRETORIO_PADRAO = Path(__file__).resolve().parent / "modelos_documentos"
+CAMPOS = ("paciente", "cpf", "data")
+MARGEM_INFERIOR = 2 * cm
+
+# Dados do paciente usados nos campos; os workers da geração em lote recebem só isso
+DadosPaciente = namedtuple("DadosPaciente", ["id", "nome", "cpf"])
+
+# re.split com grupo alterna literal e nome do campo: "Paciente: {paciente}" -> ["Paciente: ", "paciente", ""]
+_CAMPO = re.compile(r"\{(\w+)\}")
+
+
+class ModeloDocumento:
+    """Modelo compilado: operações de desenho percorridas com a posição vertical atual."""
+
+    def __init__(self, tipo, titulo, nome_arquivo, topo, operacoes):
+        self.tipo = tipo
+        self.titulo = titulo
+        self.nome_arquivo = nome_arquivo
+        self.topo = topo
+        self.operacoes = operacoes
+
+    def desenhar(self, c, campos):
+        desenhar_cabecalho(c, self.titulo)
+        y = self.topo
+        fonte = None
+
+        def reservar(altura):
+            # Quebra de página quando o próximo elemento passaria da margem inferior
+            nonlocal y
+            if y - altura < MARGEM_INFERIOR and y < self.topo:
+                c.showPage()
+                desenhar_cabecalho(c, self.titulo)
+                if fonte is not None:
+                    c.setFont(*fonte)
+                y = self.topo
+
+        def escrever(x, entrelinha, linhas):
+            nonlocal y
+            while linhas:
+                reservar(entrelinha)
+                cabem = max(1, int((y - MARGEM_INFERIOR) // entrelinha) + 1)
+                trecho, linhas = linhas[:cabem], linhas[cabem:]
+                textobj = c.beginText()
+                textobj.setTextOrigin(x, y)
+                textobj.setLeading(entrelinha)
+                for linha in trecho:
+                    textobj.textLine(linha)
+                c.drawText(textobj)
+                y -= entrelinha * len(trecho)
+
+        for op in self.operacoes:
+            if op[0] == "fonte":
+                fonte = op[1:]
+                c.setFont(*fonte)
+            elif op[0] == "espaco":
+                y -= op[1]
+            elif op[0] == "texto":
+                reservar(0)
+                c.drawString(op[1], y, _preencher(op[2], campos))
+            elif op[0] == "linhas":
+                escrever(op[1], op[2], op[3])
+            elif op[0] == "paragrafo":
+                escrever(op[1], op[2], _quebrar(_preencher(op[4], campos), *fonte, op[3]))
+            elif op[0] == "assinaturas":
+                reservar(op[1])
+                for de, ate, rotulo in op[2]:
+                    c.line(de, y, ate, y)
+                    c.drawString(de, y - op[1], _preencher(rotulo, campos))
+
+
+_modelos = None
+_chave = None
+_verificado_em = 0.0
+_lock = threading.Lock()
+
+
+def obter_modelos():
+    """Modelos do processo por tipo, recompilados só se algum arquivo mudar."""
+    global _modelos, _chave, _verificado_em
+    intervalo = getattr(settings, "PDF_RECURSOS_VERIFICACAO_SEGUNDOS", 10)
+    with _lock:
+        agora = time.monotonic()
+        if _modelos is not None and agora - _verificado_em < intervalo:
+            return _modelos
+        arquivos = _listar_arquivos()
+        chave = tuple((str(caminho), mtime) for caminho, mtime in arquivos.values())
+        if chave != _chave:
+            _modelos = _compilar_todos(arquivos)
+            _chave = chave
+        _verificado_em = agora
+        return _modelos
+
+
+def limpar_cache():
+    global _modelos, _chave
+    with _lock:
+        _modelos = _chave = None
+
+
+@receiver(setting_changed)
+def _setting_alterado(sender, setting, **kwargs):
+    if setting in ("DOCUMENTOS_MODELOS_DIR", "PDF_RECURSOS_VERIFICACAO_SEGUNDOS"):
+        limpar_cache()
+
+
+def gerar_pdf(modelo, paciente):
+    """Gera o PDF do `modelo` para o paciente; retorna os bytes."""
+    campos = {
+        "paciente": paciente.nome,
+        "cpf": paciente.cpf,
+        "data": datetime.now().strftime("%d/%m/%Y"),
+    }
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=A4)
+    modelo.desenhar(c, campos)
+    c.showPage(); c.save()
+    return buf.getvalue()
+
+
+def nome_arquivo_pdf(modelo, nome_paciente):
+    hoje = datetime.now().strftime("%Y-%m-%d")
+    return f"{modelo.nome_arquivo}_{nome_paciente}_{hoje}.pdf".replace(" ", "_")
+
+
+def aquecer():
+    """Compila os modelos e renderiza cada um uma vez, deixando logo, cabeçalho e fontes em memória.
+
+    Usado na inicialização dos workers da geração em lote, que importam só este
+    módulo (não depende dos models, então dispensa `django.setup()`).
+    """
+    for modelo in obter_modelos().values():
+        gerar_pdf(modelo, DadosPaciente(0, "Aquecimento", ""))
+
+
+def renderizar_lote(tipo, pacientes):
+    """Renderiza o modelo `tipo` para uma lista de DadosPaciente: `[(paciente, bytes)]`."""
+    modelo = obter_modelos()[tipo]
+    return [(paciente, gerar_pdf(modelo, paciente)) for paciente in pacientes]
+
+
+def compilar(tipo, definicao):
+    """Compila a definição (dict do JSON). ValueError se ela for inválida."""
+    w, h = A4
+    ops = []
+    fonte_atual = None
+
+    def usar_fonte(bloco):
+        nonlocal fonte_atual
+        fonte = (bloco.get("fonte", "Helvetica"), float(bloco.get("tamanho", 11)))
+        if fonte != fonte_atual:
+            try:
+                getFont(fonte[0])
+            except KeyError:
+                raise ValueError(f"Fonte desconhecida: {fonte[0]}") from None
+            ops.append(("fonte", *fonte))
+            fonte_atual = fonte
+        return fonte
+
+    def espaco(medida):
+        if medida:
+            ops.append(("espaco", float(medida) * cm))
+
+    for bloco in definicao.get("blocos", []):
+        x = float(bloco.get("x", 2)) * cm
+        if "espaco" in bloco:
+            espaco(bloco["espaco"])
+        elif "texto" in bloco:
+            usar_fonte(bloco)
+            ops.append(("texto", x, _compilar_texto(bloco["texto"])))
+        elif "lista" in bloco:
+            usar_fonte(bloco)
+            for item in bloco["lista"]:
+                ops.append(("texto", x, _compilar_texto(item)))
+                espaco(bloco.get("entrelinhas", 0.7))
+        elif "paragrafo" in bloco:
+            fonte = usar_fonte(bloco)
+            entrelinha = float(bloco.get("entrelinha", 14))
+            largura = float(bloco["largura"]) * cm if "largura" in bloco else w - 2 * cm - x
+            texto = _compilar_texto(bloco["paragrafo"])
+            if isinstance(texto, str):
+                ops.append(("linhas", x, entrelinha, _quebrar(texto, *fonte, largura)))
+            else:
+                ops.append(("paragrafo", x, entrelinha, largura, texto))
+        elif "assinaturas" in bloco:
+            espaco(bloco.get("antes", 2.0))
+            usar_fonte(bloco)
+            assinaturas = [
+                (
+                    float(assinatura.get("de", 2)) * cm,
+                    float(assinatura.get("ate", w / cm - 2)) * cm,
+                    _compilar_texto(assinatura.get("rotulo", "")),
+                )
+                for assinatura in bloco["assinaturas"]
+            ]
+            ops.append(("assinaturas", float(bloco.get("rotulo_abaixo", 0.5)) * cm, assinaturas))
+        else:
+            raise ValueError(f"Bloco sem tipo conhecido: {sorted(bloco)}")
+        espaco(bloco.get("depois", 0))
+
+    return ModeloDocumento(
+        tipo=tipo,
+        titulo=definicao["titulo"],
+        nome_arquivo=definicao.get("nome_arquivo") or tipo,
+        topo=h - float(definicao.get("topo", 4.6)) * cm,
+        operacoes=ops,
+    )
+
+
+# --------- Helpers ---------
+def _listar_arquivos():
+    """Arquivos de modelo por tipo: `{tipo: (caminho, mtime)}`; o diretório extra sobrepõe o padrão."""
+    diretorios = [DIRETORIO_PADRAO]
+    extra = getattr(settings, "DOCUMENTOS_MODELOS_DIR", "") or ""
+    if extra:
+        extra = Path(extra)
+        diretorios.append(extra if extra.is_absolute() else Path(settings.BASE_DIR) / extra)
+    arquivos = {}
+    for diretorio in diretorios:
+        try:
+            caminhos = sorted(diretorio.glob("*.json"))
+        except OSError:
+            continue
+        for caminho in caminhos:
+            try:
+                arquivos[caminho.stem] = (caminho, caminho.stat().st_mtime_ns)
+            except OSError:
+                continue
+    return arquivos
+
+
+def _compilar_todos(arquivos):
+    modelos = {}
+    for tipo, (caminho, _) in arquivos.items():
+        try:
+            with open(caminho, encoding="utf-8") as arquivo:
+                modelos[tipo] = compilar(tipo, json.load(arquivo))
+        except Exception:
+            # Um modelo inválido não derruba os demais; ele só deixa de ser oferecido
+            logger.warning("Modelo de documento inválido ignorado: %s", caminho, exc_info=True)
+    return modelos
+
+
+def _compilar_texto(texto):
+    partes = _CAMPO.split(texto)
+    if len(partes) == 1:
+        return texto
+    desconhecidos = set(partes[1::2]) - set(CAMPOS)
+    if desconhecidos:
+        raise ValueError(f"Campos desconhecidos: {', '.join(sorted(desconhecidos))}")
+    return tuple(partes)
+
+
+def _preencher(texto, campos):
+    if isinstance(texto, str):
+        return texto
+    return "".join(parte if i % 2 == 0 else campos[parte] for i, parte in enumerate(texto))
+
+
+def _quebrar(texto, fonte, tamanho, largura):
+    """Linhas de `texto` que cabem em `largura` pontos; `\\n` força a quebra."""
+    linhas = []
+    for para in texto.split("\n"):
+        atual = ""
+        for palavra in para.split():
+            candidata = f"{atual} {palavra}" if atual else palavra
+            if stringWidth(candidata, fonte, tamanho) <= largura:
+                atual = candidata
+                continue
+            if atual:
+                linhas.append(atual)
+            # Palavra maior que a linha inteira (um nome sem espaços, por exemplo) é cortada onde couber
+            atual = ""
+            for letra in palavra:
+                if atual and stringWidth(atual + letra, fonte, tamanho) > largura:
+                    linhas.append(atual)
+                    atual = ""
+                atual += letra
+        linhas.append(atual)
+    return linhas
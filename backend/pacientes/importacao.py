@@ -0,0 +1,734 @@
+"""Importação de contatos (CSV) para convites em massa.
+
+O arquivo é lido em streaming (`abrir_csv`): os bytes passam por um decoder
+incremental e só um prefixo limitado é usado para detectar dialeto e
+cabeçalho, então a memória não cresce com o tamanho do arquivo. As linhas são
+normalizadas uma a uma e gravadas em lotes: para cada lote de
+`IMPORT_CHUNK_SIZE` linhas os contatos já existentes são resolvidos com uma
+única query (`cpf_normalizado__in` / `telefone_normalizado__in`) e as escritas
+saem em um `bulk_update` e um `bulk_create`.
+
+No PostgreSQL (`IMPORTACAO_COPY_POSTGRES`, ligado por padrão) os lotes são
+maiores e vão por `COPY` para uma tabela temporária (não registrada no WAL),
+sendo mesclados em `pacientes_convitecontato` com um único
+`INSERT ... ON CONFLICT (telefone_normalizado) DO UPDATE`; veja
+`ImportadorContatosCopy`.
+"""
+import codecs
+import csv
+import io
+import itertools
+import logging
+import re
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ConviteContato, ConviteImportacao
+
+logger = logging.getLogger(__name__)
+
+CSV_EXPECTED_COLUMNS = {"nome", "cpf", "telefone", "data_nascimento", "idade", "origem"}
+CSV_REQUIRED_COLUMNS = {"nome", "telefone"}
+IMPORT_MAX_LOG = 50
+IMPORT_CHUNK_SIZE = 1000
+IMPORT_COPY_CHUNK_SIZE = 20000
+CSV_SNIFF_BYTES = 64 * 1024
+CSV_EXPECTED_ORDER = ["nome", "cpf", "telefone", "data_nascimento", "idade", "origem"]
+
+CAMPOS_ATUALIZAVEIS = [
+    "nome",
+    "cpf",
+    "cpf_normalizado",
+    "telefone",
+    "telefone_normalizado",
+    "data_nascimento",
+    "idade",
+    "origem",
+    "atualizado_em",
+]
+
+
+def _normalizar_digitos(valor: str) -> str:
+    return "".join(ch for ch in (valor or "") if ch.isdigit())
+
+
+def _parse_data(value: str):
+    if not value:
+        return None
+    value = value.strip()
+    if not value:
+        return None
+    formatos = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y")
+    for fmt in formatos:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _calcular_idade(data_nascimento):
+    if not data_nascimento:
+        return None
+    hoje = timezone.localdate()
+    anos = hoje.year - data_nascimento.year - (
+        (hoje.month, hoje.day) < (data_nascimento.month, data_nascimento.day)
+    )
+    return max(anos, 0)
+
+
+def _normalize_header_text(text: str) -> str:
+    return "".join(ch for ch in (text or "").lower() if ch.isalnum())
+
+
+def _strip_decimal_tail(value: str) -> str:
+    value = (value or "").strip()
+    if not value:
+        return value
+    if "." in value:
+        left, _, right = value.partition(".")
+        if right.strip("0") == "":
+            return left
+    return value
+
+
+class CSVInvalido(Exception):
+    """Arquivo recusado antes da importação; `payload` vai no corpo do 400."""
+
+    def __init__(self, payload):
+        super().__init__(payload.get("detail"))
+        self.payload = payload
+
+
+def _decodificar(chunks):
+    """Decodifica os blocos de bytes como UTF-8 (com BOM), caindo para latin-1.
+
+    A troca acontece no primeiro bloco inválido e vale para o restante do
+    arquivo; o que já foi lido como UTF-8 puro é idêntico em latin-1 no caso
+    comum (cabeçalho e linhas ASCII antes do primeiro acento).
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    latin1 = False
+    for chunk in chunks:
+        if latin1:
+            yield chunk.decode("latin-1")
+            continue
+        pendente, _ = decoder.getstate()
+        try:
+            yield decoder.decode(chunk)
+        except UnicodeDecodeError:
+            latin1 = True
+            yield (pendente + chunk).decode("latin-1")
+    if not latin1:
+        yield decoder.decode(b"", final=True)
+
+
+def _linhas(textos):
+    """Quebra os blocos de texto em linhas (mantendo o '\n'), como o csv espera."""
+    resto = ""
+    for texto in textos:
+        if not texto:
+            continue
+        partes = (resto + texto).split("\n")
+        resto = partes.pop()
+        for parte in partes:
+            yield parte + "\n"
+    if resto:
+        yield resto
+
+
+def mapear_colunas(headers):
+    """Associa as colunas esperadas aos índices do cabeçalho (por nome ou posição)."""
+    if len(headers) == 1:
+        inline_headers = re.split(r"[;,]", headers[0])
+        if len(inline_headers) > 1:
+            headers = [parte.strip().strip(".") for parte in inline_headers if parte.strip().strip(".")]
+
+    index_by_name = {}
+    for idx, header in enumerate(headers):
+        normalized = _normalize_header_text(header)
+        if not normalized:
+            continue
+        for expected in CSV_EXPECTED_ORDER:
+            key = expected.replace("_", "")
+            if normalized == key or key in normalized:
+                index_by_name[expected] = idx
+
+    for idx, expected in enumerate(CSV_EXPECTED_ORDER):
+        if expected not in index_by_name and idx < len(headers):
+            index_by_name[expected] = idx
+    return headers, index_by_name
+
+
+def abrir_csv(chunks):
+    """Prepara a leitura em streaming de um CSV de contatos.
+
+    `chunks` é um iterável de blocos de bytes (ex.: `UploadedFile.chunks()`).
+    Retorna `(headers, index_by_name, colunas_desconhecidas, linhas)`, onde
+    `linhas` é um gerador de `(numero_da_linha, row)` a partir da linha 2.
+    Levanta `CSVInvalido` para arquivo vazio, sem cabeçalho ou sem as colunas
+    obrigatórias.
+    """
+    linhas = _linhas(_decodificar(chunks))
+    prefixo = []
+    tamanho = 0
+    for linha in linhas:
+        prefixo.append(linha)
+        tamanho += len(linha)
+        if tamanho >= CSV_SNIFF_BYTES:
+            break
+
+    amostra = "".join(prefixo)
+    if not amostra.strip():
+        raise CSVInvalido({"detail": "O arquivo CSV está vazio."})
+
+    todas = itertools.chain(prefixo, linhas)
+    try:
+        dialect = csv.Sniffer().sniff(amostra, delimiters=",\t;|")
+        reader = csv.reader(todas, dialect)
+    except csv.Error:
+        reader = csv.reader(todas, delimiter=";")
+
+    headers = next(reader, None)
+    if headers is None:
+        raise CSVInvalido({"detail": "O arquivo CSV não possui cabeçalho."})
+
+    headers, index_by_name = mapear_colunas(headers)
+
+    missing_required = [col for col in CSV_REQUIRED_COLUMNS if col not in index_by_name]
+    if missing_required:
+        raise CSVInvalido(
+            {
+                "detail": "Colunas obrigatórias ausentes no cabeçalho do CSV.",
+                "colunas_obrigatorias": sorted(CSV_REQUIRED_COLUMNS),
+                "colunas_ausentes": sorted(missing_required),
+            }
+        )
+
+    matched_indexes = set(index_by_name.values())
+    colunas_desconhecidas = [
+        headers[idx]
+        for idx in range(len(headers))
+        if headers[idx] and idx not in matched_indexes
+    ]
+    return headers, index_by_name, colunas_desconhecidas, enumerate(reader, start=2)
+
+
+class ImportadorContatos:
+    """Upsert em lotes das linhas de um CSV de contatos.
+
+    Mantém as mesmas regras (e as mesmas estatísticas) do processamento linha a
+    linha: dentro de um lote os contatos ficam num índice em memória por CPF e
+    telefone normalizados, então linhas repetidas no próprio arquivo atualizam o
+    contato criado/alterado pela linha anterior em vez de gerar um INSERT
+    duplicado. Uma linha que tentaria mover CPF/telefone para um valor que já
+    pertence a outro contato é registrada como erro.
+    """
+
+    def __init__(self, origem, index_by_name, total_colunas, chunk_size=IMPORT_CHUNK_SIZE, ao_progresso=None):
+        self.origem = origem
+        self.index_by_name = index_by_name
+        self.total_colunas = total_colunas
+        self.chunk_size = chunk_size
+        self.ao_progresso = ao_progresso
+        self.stats = {
+            "total": 0,
+            "importados": 0,
+            "atualizados": 0,
+            "ignorados": 0,
+            "erros": 0,
+        }
+        self._erros = []
+
+    @property
+    def erros(self):
+        return [mensagem for _, mensagem in sorted(self._erros, key=lambda item: item[0])]
+
+    def importar(self, linhas):
+        """Processa um iterável de `(numero_da_linha, row)`.
+
+        Cada lote é gravado na sua própria transação (savepoint quando já existe
+        uma externa) e, ao final dele, `ao_progresso(importador)` é chamado.
+        """
+        lote = []
+        for linha, row in linhas:
+            registro = self._ler_registro(linha, row)
+            if registro is None:
+                continue
+            lote.append(registro)
+            if len(lote) >= self.chunk_size:
+                self._gravar_lote(lote)
+                lote = []
+        if lote:
+            self._gravar_lote(lote)
+        return self.stats
+
+    # --------- Helpers ---------
+    def _gravar_lote(self, lote):
+        with transaction.atomic():
+            self._processar_lote(lote)
+        if self.ao_progresso is not None:
+            self.ao_progresso(self)
+
+    def _erro(self, linha, mensagem):
+        self.stats["erros"] += 1
+        if len(self._erros) < IMPORT_MAX_LOG:
+            self._erros.append((linha, f"Linha {linha}: {mensagem}"))
+
+    def _campo(self, row, chave):
+        idx = self.index_by_name.get(chave)
+        if idx is None or idx >= len(row):
+            return ""
+        return (row[idx] or "").strip()
+
+    def _ler_registro(self, linha, row):
+        if not row or not any((valor or "").strip() for valor in row):
+            return None
+        if len(row) < self.total_colunas:
+            row = row + [""] * (self.total_colunas - len(row))
+        self.stats["total"] += 1
+        nome = self._campo(row, "nome")
+        telefone_original = _strip_decimal_tail(self._campo(row, "telefone"))
+        cpf_original = _strip_decimal_tail(self._campo(row, "cpf"))
+        data_nascimento_raw = self._campo(row, "data_nascimento")
+        idade_raw = _strip_decimal_tail(self._campo(row, "idade"))
+        origem_csv = self._campo(row, "origem")
+
+        if not nome and not telefone_original and not cpf_original:
+            self.stats["ignorados"] += 1
+            return None
+
+        if not nome:
+            self._erro(linha, "campo 'nome' vazio.")
+            return None
+
+        if not telefone_original:
+            self._erro(linha, "campo 'telefone' vazio.")
+            return None
+
+        telefone_normalizado = _normalizar_digitos(telefone_original)
+        if not telefone_normalizado:
+            self._erro(linha, f"telefone inválido '{telefone_original}'.")
+            return None
+
+        data_nascimento = _parse_data(data_nascimento_raw)
+        idade = None
+        if idade_raw:
+            try:
+                idade = int(float(idade_raw))
+            except ValueError:
+                idade = None
+        if idade is None and data_nascimento:
+            idade = _calcular_idade(data_nascimento)
+
+        return {
+            "linha": linha,
+            "nome": nome,
+            "cpf": cpf_original,
+            "cpf_normalizado": _normalizar_digitos(cpf_original),
+            "telefone": telefone_original,
+            "telefone_normalizado": telefone_normalizado,
+            "data_nascimento": data_nascimento,
+            "idade": idade,
+            "origem_csv": origem_csv,
+        }
+
+    def _processar_lote(self, lote):
+        cpfs = {r["cpf_normalizado"] for r in lote if r["cpf_normalizado"]}
+        telefones = {r["telefone_normalizado"] for r in lote}
+        filtro = Q(telefone_normalizado__in=telefones)
+        if cpfs:
+            filtro |= Q(cpf_normalizado__in=cpfs)
+
+        por_cpf = {}
+        por_telefone = {}
+        chaves_originais = {}
+        for contato in ConviteContato.objects.filter(filtro):
+            self._indexar(contato, por_cpf, por_telefone)
+            chaves_originais[contato.pk] = (contato.cpf_normalizado, contato.telefone_normalizado)
+
+        novos = []
+        alterados = {}
+        for registro in lote:
+            candidatos = []
+            if registro["cpf_normalizado"] and registro["cpf_normalizado"] in por_cpf:
+                candidatos.append(por_cpf[registro["cpf_normalizado"]])
+            if registro["telefone_normalizado"] in por_telefone:
+                candidatos.append(por_telefone[registro["telefone_normalizado"]])
+
+            if not candidatos:
+                contato = ConviteContato(
+                    nome=registro["nome"],
+                    cpf=registro["cpf"],
+                    telefone=registro["telefone"],
+                    data_nascimento=registro["data_nascimento"],
+                    idade=registro["idade"],
+                    origem=registro["origem_csv"] or self.origem,
+                )
+                contato.preencher_derivados()
+                self._indexar(contato, por_cpf, por_telefone)
+                novos.append(contato)
+                self.stats["importados"] += 1
+                continue
+
+            # Mesma escolha do antigo `.filter(cpf | telefone).first()` (ordering = nome)
+            contato = min(candidatos, key=lambda c: c.nome)
+            if self._em_conflito(registro, contato, por_cpf, por_telefone):
+                continue
+            if self._aplicar(registro, contato):
+                self._desindexar(contato, por_cpf, por_telefone)
+                contato.preencher_derivados()
+                self._indexar(contato, por_cpf, por_telefone)
+                if contato.pk is not None:
+                    alterados[contato.pk] = contato
+                self.stats["atualizados"] += 1
+            else:
+                self.stats["ignorados"] += 1
+
+        agora = timezone.now()
+        if alterados:
+            for contato in alterados.values():
+                contato.atualizado_em = agora
+            self._liberar_chaves(alterados.values(), chaves_originais)
+            ConviteContato.objects.bulk_update(alterados.values(), CAMPOS_ATUALIZAVEIS, batch_size=500)
+        if novos:
+            ConviteContato.objects.bulk_create(novos, batch_size=500)
+
+    @staticmethod
+    def _liberar_chaves(contatos, chaves_originais):
+        """Zera CPF/telefone normalizados dos contatos cujas chaves mudaram no lote.
+
+        O UPDATE em lote verifica os índices únicos linha a linha, então uma
+        troca de telefone/CPF entre dois contatos falharia no meio do comando.
+        Os índices parciais ignoram "", e o `bulk_update` seguinte grava os
+        valores finais (que o índice em memória já garante serem únicos).
+        """
+        mudaram = [
+            ConviteContato(pk=contato.pk, cpf_normalizado="", telefone_normalizado="")
+            for contato in contatos
+            if chaves_originais.get(contato.pk) != (contato.cpf_normalizado, contato.telefone_normalizado)
+        ]
+        if mudaram:
+            ConviteContato.objects.bulk_update(mudaram, ["cpf_normalizado", "telefone_normalizado"], batch_size=500)
+
+    def _em_conflito(self, registro, contato, por_cpf, por_telefone):
+        telefone = registro["telefone_normalizado"]
+        dono = por_telefone.get(telefone)
+        if dono is not None and dono is not contato:
+            self._erro(registro["linha"], f"telefone '{registro['telefone']}' já pertence a outro contato.")
+            return True
+        cpf = registro["cpf_normalizado"]
+        dono = por_cpf.get(cpf) if cpf else None
+        if dono is not None and dono is not contato:
+            self._erro(registro["linha"], f"CPF '{registro['cpf']}' já pertence a outro contato.")
+            return True
+        return False
+
+    def _aplicar(self, registro, contato):
+        atualizado = False
+        if contato.nome != registro["nome"]:
+            contato.nome = registro["nome"]
+            atualizado = True
+        if registro["cpf"] and contato.cpf != registro["cpf"]:
+            contato.cpf = registro["cpf"]
+            atualizado = True
+        if registro["telefone"] and contato.telefone != registro["telefone"]:
+            contato.telefone = registro["telefone"]
+            atualizado = True
+        if registro["data_nascimento"] and contato.data_nascimento != registro["data_nascimento"]:
+            contato.data_nascimento = registro["data_nascimento"]
+            atualizado = True
+        if registro["idade"] is not None and contato.idade != registro["idade"]:
+            contato.idade = registro["idade"]
+            atualizado = True
+        origem_csv = registro["origem_csv"]
+        if origem_csv and contato.origem != origem_csv:
+            contato.origem = origem_csv
+            atualizado = True
+        elif not contato.origem and self.origem and contato.origem != self.origem:
+            contato.origem = self.origem
+            atualizado = True
+        return atualizado
+
+    @staticmethod
+    def _indexar(contato, por_cpf, por_telefone):
+        if contato.cpf_normalizado:
+            por_cpf[contato.cpf_normalizado] = contato
+        if contato.telefone_normalizado:
+            por_telefone[contato.telefone_normalizado] = contato
+
+    @staticmethod
+    def _desindexar(contato, por_cpf, por_telefone):
+        if por_cpf.get(contato.cpf_normalizado) is contato:
+            del por_cpf[contato.cpf_normalizado]
+        if por_telefone.get(contato.telefone_normalizado) is contato:
+            del por_telefone[contato.telefone_normalizado]
+
+
+class ImportadorContatosCopy(ImportadorContatos):
+    """Caminho rápido do PostgreSQL: `COPY` para staging + um upsert set-based.
+
+    A normalização continua em Python (`_ler_registro`). Cada lote é copiado
+    para uma tabela temporária e cruzado com os contatos existentes; as linhas
+    "simples" — telefone e CPF únicos no lote, CPF que não pertence a outro
+    contato e nenhum contato existente disputado por duas linhas — são mescladas
+    com `INSERT ... ON CONFLICT (telefone_normalizado) DO UPDATE ... WHERE <mudou>`,
+    seguindo as mesmas regras de `_aplicar`. Como essas linhas não compartilham
+    contato nem chave, a ordem entre elas não importa e as estatísticas saem
+    exatas do `RETURNING`. As demais (duplicadas no arquivo, casadas só pelo
+    CPF, em conflito) seguem pelo processamento em lote do ORM, que respeita a
+    ordem das linhas.
+    """
+
+    tabela_staging = "convite_importacao_staging"
+    colunas_staging = [
+        "linha",
+        "nome",
+        "cpf",
+        "cpf_normalizado",
+        "telefone",
+        "telefone_normalizado",
+        "data_nascimento",
+        "idade",
+        "origem",
+    ]
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("chunk_size", IMPORT_COPY_CHUNK_SIZE)
+        super().__init__(*args, **kwargs)
+
+    # --------- Helpers ---------
+    def _processar_lote(self, lote):
+        self._copiar(lote)
+        simples, ordenados = self._separar(lote)
+        self._mesclados = 0
+        if simples:
+            for usar_origem_csv in (True, False):
+                if any(bool(r["origem_csv"]) == usar_origem_csv for r in simples):
+                    self._mesclar(usar_origem_csv)
+            self.stats["ignorados"] += len(simples) - self._mesclados
+        if ordenados:
+            super()._processar_lote(ordenados)
+
+    def _copiar(self, registros):
+        buffer = io.StringIO()
+        # Textos vão entre aspas ("" = string vazia); FORCE_NULL converte "" em NULL
+        # apenas nas colunas anuláveis (data_nascimento, idade)
+        writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC, lineterminator="\n")
+        for registro in registros:
+            writer.writerow(
+                [
+                    registro["linha"],
+                    registro["nome"],
+                    registro["cpf"],
+                    registro["cpf_normalizado"],
+                    registro["telefone"],
+                    registro["telefone_normalizado"],
+                    registro["data_nascimento"].isoformat() if registro["data_nascimento"] else None,
+                    registro["idade"],
+                    registro["origem_csv"],
+                ]
+            )
+        buffer.seek(0)
+
+        colunas = ", ".join(self.colunas_staging)
+        copy_sql = (
+            f"COPY {self.tabela_staging} ({colunas}) FROM STDIN "
+            "WITH (FORMAT csv, FORCE_NULL (data_nascimento, idade))"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TEMP TABLE IF NOT EXISTS {self.tabela_staging} ("
+                "linha integer PRIMARY KEY, nome text, cpf text, cpf_normalizado text, telefone text, "
+                "telefone_normalizado text, data_nascimento date, idade integer, origem text)"
+            )
+            cursor.execute(f"TRUNCATE {self.tabela_staging}")
+            bruto = cursor.cursor
+            if hasattr(bruto, "copy_expert"):  # psycopg2
+                bruto.copy_expert(copy_sql, buffer)
+            else:  # psycopg 3
+                with bruto.copy(copy_sql) as copy:
+                    copy.write(buffer.getvalue())
+            # Tabela temporária não passa pelo autovacuum; sem estatísticas o join abaixo vira nested loop
+            cursor.execute(f"ANALYZE {self.tabela_staging}")
+
+    def _separar(self, lote):
+        """Divide o lote entre linhas mescláveis via SQL e linhas que exigem ordem.
+
+        As linhas que ficam para o ORM são removidas da staging.
+        """
+        tabela = ConviteContato._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT s.linha, t.id, c.id
+                FROM {self.tabela_staging} s
+                LEFT JOIN {tabela} t ON t.telefone_normalizado = s.telefone_normalizado
+                LEFT JOIN {tabela} c ON s.cpf_normalizado <> '' AND c.cpf_normalizado = s.cpf_normalizado
+                """
+            )
+            existentes = {linha: (pk_telefone, pk_cpf) for linha, pk_telefone, pk_cpf in cursor.fetchall()}
+
+        contagem_telefone = {}
+        contagem_cpf = {}
+        contagem_contato = {}
+        for registro in lote:
+            telefone = registro["telefone_normalizado"]
+            cpf = registro["cpf_normalizado"]
+            contagem_telefone[telefone] = contagem_telefone.get(telefone, 0) + 1
+            if cpf:
+                contagem_cpf[cpf] = contagem_cpf.get(cpf, 0) + 1
+            for pk in set(existentes[registro["linha"]]) - {None}:
+                contagem_contato[pk] = contagem_contato.get(pk, 0) + 1
+
+        simples = []
+        ordenados = []
+        for registro in lote:
+            telefone = registro["telefone_normalizado"]
+            cpf = registro["cpf_normalizado"]
+            pk_telefone, pk_cpf = existentes[registro["linha"]]
+            complexo = (
+                contagem_telefone[telefone] > 1
+                or (cpf and contagem_cpf[cpf] > 1)
+                or (pk_cpf is not None and pk_cpf != pk_telefone)
+                or (pk_telefone is not None and contagem_contato[pk_telefone] > 1)
+                # idade 0 com data de nascimento é recalculada no save(); fica no ORM
+                or (registro["idade"] == 0 and registro["data_nascimento"])
+            )
+            (ordenados if complexo else simples).append(registro)
+
+        if ordenados:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM {self.tabela_staging} WHERE linha = ANY(%s)",
+                    [[registro["linha"] for registro in ordenados]],
+                )
+        return simples, ordenados
+
+    def _mesclar(self, usar_origem_csv):
+        tabela = ConviteContato._meta.db_table
+        # O predicado do ON CONFLICT repete o do índice parcial único de telefone_normalizado
+        sql = f"""
+            INSERT INTO {tabela} AS c (
+                nome, cpf, cpf_normalizado, telefone, telefone_normalizado,
+                data_nascimento, idade, origem, status, criado_em, atualizado_em
+            )
+            SELECT s.nome, s.cpf, s.cpf_normalizado, s.telefone, s.telefone_normalizado,
+                   s.data_nascimento, s.idade,
+                   CASE WHEN %(usar_origem_csv)s THEN s.origem ELSE %(origem)s END,
+                   %(status)s, %(agora)s, %(agora)s
+            FROM {self.tabela_staging} s
+            WHERE (s.origem <> '') = %(usar_origem_csv)s
+            ON CONFLICT (telefone_normalizado)
+                WHERE (telefone_normalizado IS NOT NULL AND NOT (telefone_normalizado = ''))
+            DO UPDATE SET
+                nome = EXCLUDED.nome,
+                cpf = CASE WHEN EXCLUDED.cpf <> '' THEN EXCLUDED.cpf ELSE c.cpf END,
+                cpf_normalizado = CASE WHEN EXCLUDED.cpf <> '' THEN EXCLUDED.cpf_normalizado
+                                       ELSE c.cpf_normalizado END,
+                telefone = EXCLUDED.telefone,
+                data_nascimento = COALESCE(EXCLUDED.data_nascimento, c.data_nascimento),
+                idade = CASE
+                    WHEN COALESCE(EXCLUDED.idade, c.idade, 0) = 0
+                         AND COALESCE(EXCLUDED.data_nascimento, c.data_nascimento) IS NOT NULL
+                    THEN GREATEST(date_part('year', age(
+                        %(hoje)s::date, COALESCE(EXCLUDED.data_nascimento, c.data_nascimento)
+                    ))::integer, 0)
+                    ELSE COALESCE(EXCLUDED.idade, c.idade)
+                END,
+                origem = CASE
+                    WHEN %(usar_origem_csv)s OR c.origem = '' THEN EXCLUDED.origem
+                    ELSE c.origem
+                END,
+                atualizado_em = EXCLUDED.atualizado_em
+            WHERE c.nome <> EXCLUDED.nome
+               OR (EXCLUDED.cpf <> '' AND c.cpf <> EXCLUDED.cpf)
+               OR c.telefone <> EXCLUDED.telefone
+               OR (EXCLUDED.data_nascimento IS NOT NULL
+                   AND c.data_nascimento IS DISTINCT FROM EXCLUDED.data_nascimento)
+               OR (EXCLUDED.idade IS NOT NULL AND c.idade IS DISTINCT FROM EXCLUDED.idade)
+               OR (%(usar_origem_csv)s AND c.origem <> EXCLUDED.origem)
+               OR (NOT %(usar_origem_csv)s AND c.origem = '' AND EXCLUDED.origem <> '')
+            RETURNING (xmax = 0) AS inserido
+        """
+        parametros = {
+            "usar_origem_csv": usar_origem_csv,
+            "origem": self.origem,
+            "status": ConviteContato.Status.NOVO,
+            "agora": timezone.now(),
+            "hoje": timezone.localdate(),
+        }
+        with connection.cursor() as cursor:
+            cursor.execute(sql, parametros)
+            for (inserido,) in cursor.fetchall():
+                self.stats["importados" if inserido else "atualizados"] += 1
+                self._mesclados += 1
+
+
+def criar_importador(origem, index_by_name, total_colunas, ao_progresso=None):
+    """Escolhe o importador conforme o banco: `COPY` no PostgreSQL, ORM nos demais."""
+    classe = ImportadorContatos
+    if connection.vendor == "postgresql" and getattr(settings, "IMPORTACAO_COPY_POSTGRES", True):
+        classe = ImportadorContatosCopy
+    return classe(origem, index_by_name, total_colunas, ao_progresso=ao_progresso)
+
+
+def processar_importacao(importacao_id):
+    """Processa uma `ConviteImportacao` pendente a partir do CSV guardado.
+
+    Roda no worker de segundo plano (ou via `manage.py processar_importacoes`).
+    Os contadores são atualizados a cada lote para o frontend acompanhar por
+    `GET /convites/importacoes/{id}/`; o arquivo é removido ao final.
+    """
+    importacao = ConviteImportacao.objects.get(pk=importacao_id)
+    if importacao.status not in (ConviteImportacao.Status.PENDENTE, ConviteImportacao.Status.PROCESSANDO):
+        return importacao
+
+    importacao.status = ConviteImportacao.Status.PROCESSANDO
+    importacao.iniciado_em = timezone.now()
+    importacao.save(update_fields=["status", "iniciado_em"])
+
+    def progresso(importador):
+        ConviteImportacao.objects.filter(pk=importacao.pk).update(
+            total_linhas=importador.stats["total"],
+            importados=importador.stats["importados"],
+            atualizados=importador.stats["atualizados"],
+            ignorados=importador.stats["ignorados"],
+            erros=importador.stats["erros"],
+        )
+
+    importador = None
+    try:
+        with importacao.arquivo.open("rb") as arquivo:
+            headers, index_by_name, colunas_desconhecidas, linhas = abrir_csv(arquivo.chunks())
+            importacao.colunas_desconhecidas = colunas_desconhecidas
+            importador = criar_importador(
+                importacao.origem, index_by_name, len(headers), ao_progresso=progresso
+            )
+            importador.importar(linhas)
+        importacao.status = ConviteImportacao.Status.CONCLUIDO
+        importacao.log = "\n".join(importador.erros)
+    except CSVInvalido as exc:
+        importacao.status = ConviteImportacao.Status.FALHA
+        importacao.log = exc.payload.get("detail", "")
+    except Exception as exc:
+        logger.exception("Falha ao processar a importação %s", importacao.pk)
+        importacao.status = ConviteImportacao.Status.FALHA
+        erros = importador.erros if importador is not None else []
+        importacao.log = "\n".join(erros + [f"Erro inesperado: {exc}"])
+
+    if importador is not None:
+        importacao.total_linhas = importador.stats["total"]
+        importacao.importados = importador.stats["importados"]
+        importacao.atualizados = importador.stats["atualizados"]
+        importacao.ignorados = importador.stats["ignorados"]
+        importacao.erros = importador.stats["erros"]
+    importacao.finalizado_em = timezone.now()
+    if importacao.arquivo:
+        importacao.arquivo.delete(save=False)
+    importacao.save()
+    return importacao
@@ -0,0 +1,102 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from pacientes.envio import ENVIO_CHUNK_SIZE, registrar_envio
+from pacientes.models import ConviteCampanha, ConviteContato, ConviteMensagem
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara o envio de convites linha a linha com o envio em lotes "
+        "(statements por contato e tempo). Cada medição usa contatos próprios, "
+        "criados só para ela e apagados ao final, mesmo em caso de erro."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--contatos", type=int, default=2000, help="Quantidade de contatos sintéticos.")
+        parser.add_argument("--chunk", type=int, default=ENVIO_CHUNK_SIZE, help="Tamanho do lote do envio em lotes.")
+
+    def handle(self, *args, **options):
+        total = options["contatos"]
+        # Marca desta execução: nenhum contato ou campanha que já exista no banco entra na medição
+        self.marca = f"benchmark-{uuid.uuid4().hex[:12]}"
+        self.campanhas = []
+        self.stdout.write(f"{self._banco()}: {total} contatos, lote de {options['chunk']}")
+        try:
+            ids = self._criar_contatos(total, "a")
+            self._medir("linha a linha", total, lambda: self._envio_linha_a_linha(ids))
+            ids = self._criar_contatos(total, "b")
+            self._medir("em lotes", total, lambda: self._envio_em_lotes(ids, options["chunk"]))
+        finally:
+            self._limpar()
+
+    # --------- Helpers ---------
+    @staticmethod
+    def _banco():
+        connection.ensure_connection()
+        if connection.vendor == "postgresql":
+            return f"PostgreSQL {connection.pg_version // 10000}.{connection.pg_version % 10000}"
+        if connection.vendor == "sqlite":
+            return f"SQLite {connection.Database.sqlite_version}"
+        return connection.vendor
+
+    def _criar_contatos(self, total, conjunto):
+        origem = f"{self.marca}-{conjunto}"
+        # Telefones começando em "000" não são números válidos: não colidem com contatos reais
+        prefixo = f"000{uuid.uuid4().int % 10 ** 6:06d}"
+        ConviteContato.objects.bulk_create(
+            [
+                ConviteContato(
+                    nome=f"Benchmark {i}",
+                    telefone=f"{prefixo}{i:08d}",
+                    telefone_normalizado=f"{prefixo}{i:08d}",
+                    origem=origem,
+                )
+                for i in range(total)
+            ],
+            batch_size=1000,
+        )
+        return list(ConviteContato.objects.filter(origem=origem).values_list("id", flat=True))
+
+    def _envio_linha_a_linha(self, ids):
+        # Implementação anterior de ConviteContatoViewSet.enviar, mantida só para comparação
+        agora = timezone.now()
+        campanha = ConviteCampanha.objects.create(conteudo=self.marca)
+        self.campanhas.append(campanha.pk)
+        for contato in ConviteContato.objects.filter(id__in=ids):
+            ConviteMensagem.objects.create(contato=contato, campanha=campanha, status=ConviteMensagem.Status.ENVIADO)
+            contato.status = ConviteContato.Status.ENVIADO
+            contato.ultima_mensagem_em = agora
+            contato.save(update_fields=["status", "ultima_mensagem_em", "atualizado_em"])
+
+    def _envio_em_lotes(self, ids, chunk):
+        campanha, _ = registrar_envio(ids, self.marca, chunk_size=chunk)
+        if campanha is not None:
+            self.campanhas.append(campanha.pk)
+
+    def _limpar(self):
+        contatos = ConviteContato.objects.filter(origem__startswith=self.marca)
+        ConviteMensagem.objects.filter(contato__in=contatos).delete()
+        ConviteCampanha.objects.filter(pk__in=self.campanhas).delete()
+        contatos.delete()
+
+    def _medir(self, nome, total, func):
+        contador = {"statements": 0}
+
+        def contar(execute, sql, params, many, context):
+            contador["statements"] += 1
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(contar):
+            inicio = time.perf_counter()
+            func()
+            duracao = time.perf_counter() - inicio
+        statements = contador["statements"]
+        self.stdout.write(
+            f"{nome:>14}: {statements} statements ({statements / total:.3f} por contato), "
+            f"{duracao:.2f}s ({total / duracao:.0f} contatos/s)"
+        )
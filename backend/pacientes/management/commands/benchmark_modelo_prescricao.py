@@ -0,0 +1,92 @@
+import copy
+import io
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from pacientes import pdf_recursos
+from pacientes.models import Paciente, Prescricao
+from pacientes.pdf_prescricao import montar_pdf_prescricao
+
+
+class Command(BaseCommand):
+    help = (
+        "Mede a exportação de prescrições com o papel timbrado: implementação anterior "
+        "(modelo relido a cada PDF), cache frio e cache quente. Não grava nada no banco."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--modelo",
+            default=settings.PRESCRIPTION_TEMPLATE_PATH,
+            help="PDF do papel timbrado (padrão: PRESCRIPTION_TEMPLATE_PATH).",
+        )
+        parser.add_argument("--repeticoes", type=int, default=20, help="Exportações medidas em cada modo.")
+        parser.add_argument("--itens", type=int, default=10, help="Medicamentos por prescrição (define o número de páginas).")
+        parser.add_argument("--mmap", action="store_true", help="Carrega o modelo com mmap.")
+
+    def handle(self, *args, **options):
+        if not options["modelo"]:
+            raise CommandError("Informe --modelo ou configure PRESCRIPTION_TEMPLATE_PATH.")
+        repeticoes = options["repeticoes"]
+        paciente = Paciente(nome="Paciente Benchmark", cpf="000.000.000-00")
+        prescricao = Prescricao(
+            paciente=paciente,
+            itens=[
+                {"nome": f"Medicamento {i}", "dose": "1 comprimido", "orientacoes": "Tomar após as refeições. " * 8}
+                for i in range(options["itens"])
+            ],
+        )
+
+        with override_settings(
+            PRESCRIPTION_TEMPLATE_PATH=options["modelo"],
+            PRESCRIPTION_TEMPLATE_MMAP=options["mmap"],
+        ):
+            if pdf_recursos.obter_modelo_prescricao() is None:
+                raise CommandError(f"Não foi possível carregar o modelo {options['modelo']}.")
+
+            def exportar(aplicar):
+                return aplicar(montar_pdf_prescricao(prescricao))
+
+            def frio(pdf_bytes):
+                pdf_recursos.limpar_cache_modelo()
+                return pdf_recursos.aplicar_modelo_prescricao(pdf_bytes)
+
+            self._medir("anterior", repeticoes, lambda: exportar(self._aplicar_anterior))
+            self._medir("cache frio", repeticoes, lambda: exportar(frio))
+            pdf_recursos.obter_modelo_prescricao()
+            self._medir("cache quente", repeticoes, lambda: exportar(pdf_recursos.aplicar_modelo_prescricao))
+        pdf_recursos.limpar_cache_modelo()
+
+    # --------- Helpers ---------
+    def _aplicar_anterior(self, pdf_bytes):
+        # Implementação anterior da aplicação do modelo (PrescricaoViewSet._apply_template), mantida só para comparação
+        from PyPDF2 import PdfReader, PdfWriter
+
+        with open(pdf_recursos._caminho_setting("PRESCRIPTION_TEMPLATE_PATH"), "rb") as template_file:
+            template_reader = PdfReader(template_file)
+            overlay_reader = PdfReader(io.BytesIO(pdf_bytes))
+            writer = PdfWriter()
+            total_template = len(template_reader.pages)
+            for idx, overlay_page in enumerate(overlay_reader.pages):
+                base_index = idx if idx < total_template else total_template - 1
+                base_page = copy.copy(template_reader.pages[base_index])
+                base_page.merge_page(overlay_page)
+                writer.add_page(base_page)
+            out_stream = io.BytesIO()
+            writer.write(out_stream)
+            return out_stream.getvalue()
+
+    def _medir(self, nome, repeticoes, func):
+        tempos = []
+        for _ in range(repeticoes):
+            inicio = time.perf_counter()
+            pdf_bytes = func()
+            tempos.append(time.perf_counter() - inicio)
+        tempos.sort()
+        self.stdout.write(
+            f"{nome:>12}: mediana {tempos[len(tempos) // 2] * 1000:.1f} ms, "
+            f"máx {tempos[-1] * 1000:.1f} ms ({len(pdf_bytes) // 1024} KB)"
+        )
@@ -0,0 +1,141 @@
+import hashlib
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from core.armazenamento import PREFIXO, obter_armazenamento
+from core.models import ArquivoConteudo
+from financeiro.models import DebitoDocumento
+from pacientes.models import Documento
+
+# Campos que usam o armazenamento por conteúdo
+CAMPOS = [(Documento, "arquivo"), (DebitoDocumento, "arquivo")]
+# Temporários de upload mais novos que isto (s) não contam como órfãos
+UPLOAD_EM_ANDAMENTO = 3600
+
+
+class Command(BaseCommand):
+    help = (
+        "Move os arquivos de media/documentos para o armazenamento por conteúdo (um arquivo por "
+        "SHA-256), aponta os registros para os blobs, apaga as cópias repetidas e recalcula as referências."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--simular", action="store_true", help="Só calcula o que seria economizado, sem alterar nada.")
+        parser.add_argument(
+            "--remover-orfaos",
+            action="store_true",
+            help="Apaga também arquivos em media/documentos que nenhum registro usa.",
+        )
+
+    def handle(self, *args, **options):
+        storage = obter_armazenamento()
+        simular = options["simular"]
+
+        legados = set()
+        for modelo, campo in CAMPOS:
+            legados.update(
+                modelo.objects.exclude(**{campo: ""})
+                .exclude(**{f"{campo}__startswith": PREFIXO + "/"})
+                .values_list(campo, flat=True)
+                .distinct()
+            )
+
+        vistos = set(ArquivoConteudo.objects.values_list("sha256", flat=True))
+        movidos = repetidos = faltando = economia = 0
+        for nome in sorted(legados):
+            caminho = storage.path(nome)
+            if not os.path.exists(caminho):
+                faltando += 1
+                self.stderr.write(f"Arquivo ausente: {nome}")
+                continue
+            sha256, tamanho = _sha256(caminho)
+            if sha256 in vistos:
+                repetidos += 1
+                economia += tamanho
+            vistos.add(sha256)
+            if simular:
+                continue
+
+            # Referência e registros mudam juntos; o arquivo antigo só sai depois do commit,
+            # para que nenhum registro fique apontando para um arquivo já apagado
+            with transaction.atomic():
+                blob = storage.registrar(caminho, sha256, tamanho, nome)
+                for modelo, campo in CAMPOS:
+                    modelo.objects.filter(**{campo: nome}).update(**{campo: blob})
+            # O blob é um link deste arquivo ou uma cópia anterior do mesmo conteúdo
+            os.remove(caminho)
+            movidos += 1
+
+        if not simular:
+            self._recontar(storage)
+        orfaos, orfaos_bytes = self._orfaos(storage, remover=options["remover_orfaos"] and not simular)
+
+        verbo = "seriam" if simular else "foram"
+        self.stdout.write(
+            f"{len(legados)} arquivo(s) com nome antigo: {repetidos} cópia(s) repetida(s) "
+            f"({economia / 1024 / 1024:.1f} MB) {verbo} eliminada(s); {faltando} ausente(s)."
+        )
+        self.stdout.write(
+            f"{orfaos} arquivo(s) sem registro em {PREFIXO.split('/')[0]}/ ({orfaos_bytes / 1024 / 1024:.1f} MB)"
+            + (" removido(s)." if options["remover_orfaos"] and not simular else "; use --remover-orfaos para apagar.")
+        )
+        if not simular:
+            self.stdout.write(self.style.SUCCESS(f"{movidos} arquivo(s) movido(s) para {PREFIXO}/."))
+
+    # --------- Helpers ---------
+    def _recontar(self, storage):
+        """Acerta `referencias` pelo número real de registros; blobs sem registro são apagados."""
+        contagem = {}
+        for modelo, campo in CAMPOS:
+            linhas = (
+                modelo.objects.filter(**{f"{campo}__startswith": PREFIXO + "/"})
+                .values(campo)
+                .annotate(total=Count("pk"))
+                .order_by()
+            )
+            for linha in linhas:
+                contagem[linha[campo]] = contagem.get(linha[campo], 0) + linha["total"]
+
+        for blob in ArquivoConteudo.objects.iterator():
+            referencias = contagem.get(blob.nome, 0)
+            if referencias == 0:
+                blob.delete()
+                storage.delete(blob.nome)
+            elif referencias != blob.referencias:
+                ArquivoConteudo.objects.filter(pk=blob.pk).update(referencias=referencias)
+
+    def _orfaos(self, storage, remover):
+        usados = set(ArquivoConteudo.objects.values_list("nome", flat=True))
+        for modelo, campo in CAMPOS:
+            usados.update(modelo.objects.exclude(**{campo: ""}).values_list(campo, flat=True))
+
+        raiz = storage.path(PREFIXO.split("/")[0])
+        total = total_bytes = 0
+        for diretorio, _, arquivos in os.walk(raiz):
+            for arquivo in arquivos:
+                caminho = os.path.join(diretorio, arquivo)
+                nome = os.path.relpath(caminho, storage.location).replace(os.sep, "/")
+                if nome in usados:
+                    continue
+                if arquivo.startswith(".upload-") and time.time() - os.path.getmtime(caminho) < UPLOAD_EM_ANDAMENTO:
+                    # Temporário de um upload que pode estar em andamento
+                    continue
+                total += 1
+                total_bytes += os.path.getsize(caminho)
+                if remover:
+                    os.remove(caminho)
+        return total, total_bytes
+
+
+def _sha256(caminho):
+    h = hashlib.sha256()
+    tamanho = 0
+    with open(caminho, "rb") as arquivo:
+        for bloco in iter(lambda: arquivo.read(1024 * 1024), b""):
+            h.update(bloco)
+            tamanho += len(bloco)
+    return h.hexdigest(), tamanho
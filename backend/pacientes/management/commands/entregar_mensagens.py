@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from pacientes.entrega import entregar_pendentes
+from pacientes.models import ConviteMensagem
+
+
+class Command(BaseCommand):
+    help = "Entrega as mensagens de convite que estão na fila (status 'pendente')"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--reprocessar-enviando",
+            action="store_true",
+            help="Devolve para a fila as mensagens presas em 'enviando' (worker morto no meio).",
+        )
+
+    def handle(self, *args, **options):
+        if options["reprocessar_enviando"]:
+            devolvidas = ConviteMensagem.objects.filter(status=ConviteMensagem.Status.ENVIANDO).update(
+                status=ConviteMensagem.Status.PENDENTE
+            )
+            self.stdout.write(f"{devolvidas} mensagem(ns) devolvida(s) para a fila.")
+
+        stats = entregar_pendentes()
+        if stats is None:
+            self.stdout.write(self.style.WARNING("Já existe uma entrega em andamento neste processo."))
+            return
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{stats['enviados']} mensagem(ns) entregue(s), {stats['falhas']} falha(s), "
+                f"{stats['reagendadas']} reagendada(s) após falha temporária."
+            )
+        )
@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from pacientes.geracao_lote import condicoes_anamnese, filtrar_pacientes, gerar_lote
+from pacientes.gerador_documentos import obter_modelos
+
+
+class Command(BaseCommand):
+    help = (
+        "Gera um documento de modelo (ex.: termo-hipertensao) para vários pacientes de uma vez, "
+        "renderizando num pool de processos, e informa a vazão."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tipo", required=True, help="Modelo a gerar (ver pacientes/modelos_documentos).")
+        parser.add_argument("--pacientes", type=int, nargs="+", help="IDs dos pacientes.")
+        parser.add_argument(
+            "--condicao",
+            help=f"Condição marcada na anamnese, uma de: {', '.join(condicoes_anamnese())}.",
+        )
+        parser.add_argument(
+            "--processos",
+            type=int,
+            default=settings.DOCUMENTOS_LOTE_PROCESSOS,
+            help="Processos de renderização (<= 1 = no próprio processo; limitado ao número de CPUs).",
+        )
+
+    def handle(self, *args, **options):
+        modelo = obter_modelos().get(options["tipo"])
+        if modelo is None:
+            raise CommandError(f"Tipo inválido. Suportados: {', '.join(sorted(obter_modelos()))}.")
+        if not options["pacientes"] and not options["condicao"]:
+            raise CommandError("Informe --pacientes e/ou --condicao.")
+        try:
+            pacientes = filtrar_pacientes(options["pacientes"], options["condicao"]).only("id", "nome", "cpf")
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        resultado = gerar_lote(modelo, pacientes, processos=options["processos"])
+        total = len(resultado.documentos)
+        self.stdout.write(
+            f"{total} documento(s) em {resultado.segundos:.2f}s ({resultado.por_segundo:.0f} documentos/s, "
+            f"{resultado.segundos_gravacao:.2f}s gravando arquivos e registros; {resultado.processos} processo(s))"
+        )
+        self.stdout.write(self.style.SUCCESS(f"{total} documento(s) '{options['tipo']}' gerado(s)."))
@@ -0,0 +1,79 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from pacientes import particoes
+
+
+class Command(BaseCommand):
+    help = (
+        "Manutenção do particionamento mensal de mensagens de convite (PostgreSQL): cria as "
+        "partições dos próximos meses e desanexa as anteriores à janela de retenção. "
+        "Rodar periodicamente (ex.: cron diário)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--converter",
+            action="store_true",
+            help="Converte a tabela atual em particionada (bloqueia envios durante a cópia dos dados).",
+        )
+        parser.add_argument(
+            "--meses-futuros",
+            type=int,
+            default=settings.MENSAGENS_PARTICOES_FUTURAS,
+            help="Quantos meses à frente devem ter partição pronta.",
+        )
+        parser.add_argument(
+            "--retencao-meses",
+            type=int,
+            default=settings.MENSAGENS_RETENCAO_MESES,
+            help="Meses completos mantidos além do atual; os anteriores são desanexados (0 = manter tudo).",
+        )
+        parser.add_argument(
+            "--exportar",
+            metavar="DIRETORIO",
+            help="Exporta as partições desanexadas para CSV neste diretório e as remove do banco.",
+        )
+        parser.add_argument(
+            "--remover",
+            action="store_true",
+            help="Remove do banco as partições desanexadas, sem exportar.",
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            self.stdout.write("Particionamento disponível apenas no PostgreSQL.")
+            return
+        if options["exportar"] and options["remover"]:
+            raise CommandError("Use --exportar ou --remover, não os dois.")
+
+        if not particoes.esta_particionada():
+            if not options["converter"]:
+                self.stdout.write(
+                    f"{particoes.TABELA} não é particionada; use --converter para ativar o particionamento."
+                )
+                return
+            particoes.converter(options["meses_futuros"])
+            self.stdout.write(self.style.SUCCESS(f"{particoes.TABELA} convertida para particionamento mensal."))
+
+        for nome in particoes.criar_particoes_futuras(options["meses_futuros"]):
+            self.stdout.write(f"Partição criada: {nome}")
+
+        if options["retencao_meses"] > 0:
+            for nome in particoes.desanexar_antigas(options["retencao_meses"]):
+                self.stdout.write(f"Partição desanexada: {nome}")
+
+        if options["exportar"]:
+            os.makedirs(options["exportar"], exist_ok=True)
+            for nome in particoes.listar_arquivadas():
+                caminho = particoes.exportar_arquivada(nome, options["exportar"])
+                self.stdout.write(f"Partição exportada para {caminho} e removida: {nome}")
+        elif options["remover"]:
+            for nome in particoes.listar_arquivadas():
+                particoes.remover_arquivada(nome)
+                self.stdout.write(f"Partição removida: {nome}")
+
+        self.stdout.write(self.style.SUCCESS(f"{len(particoes.listar_particoes())} partição(ões) mensal(is) ativa(s)."))
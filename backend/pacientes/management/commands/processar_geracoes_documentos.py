@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from pacientes.geracoes import processar_geracao
+from pacientes.models import GeracaoDocumento
+
+
+class Command(BaseCommand):
+    help = "Processa gerações de PDF pendentes (ex.: interrompidas por reinício do servidor)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--incluir-processando",
+            action="store_true",
+            help="Reprocessa também as que ficaram em 'processando' (worker morto no meio).",
+        )
+
+    def handle(self, *args, **options):
+        status = [GeracaoDocumento.Status.PENDENTE]
+        if options["incluir_processando"]:
+            status.append(GeracaoDocumento.Status.PROCESSANDO)
+
+        ids = list(
+            GeracaoDocumento.objects.filter(status__in=status).order_by("criado_em").values_list("id", flat=True)
+        )
+        for geracao_id in ids:
+            geracao = processar_geracao(geracao_id)
+            self.stdout.write(f"#{geracao.pk} {geracao.tipo} (paciente {geracao.paciente_id}): {geracao.get_status_display()}")
+        self.stdout.write(self.style.SUCCESS(f"{len(ids)} geração(ões) processada(s)."))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from pacientes.importacao import processar_importacao
+from pacientes.models import ConviteImportacao
+
+
+class Command(BaseCommand):
+    help = "Processa importações de contatos pendentes (ex.: interrompidas por reinício do servidor)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--incluir-processando",
+            action="store_true",
+            help="Reprocessa também as que ficaram em 'processando' (worker morto no meio).",
+        )
+
+    def handle(self, *args, **options):
+        status = [ConviteImportacao.Status.PENDENTE]
+        if options["incluir_processando"]:
+            status.append(ConviteImportacao.Status.PROCESSANDO)
+
+        ids = list(
+            ConviteImportacao.objects.filter(status__in=status).order_by("criado_em").values_list("id", flat=True)
+        )
+        for importacao_id in ids:
+            importacao = processar_importacao(importacao_id)
+            self.stdout.write(
+                f"#{importacao.pk} {importacao.arquivo_nome}: {importacao.get_status_display()} "
+                f"({importacao.importados} importados, {importacao.atualizados} atualizados, {importacao.erros} erros)"
+            )
+        self.stdout.write(self.style.SUCCESS(f"{len(ids)} importação(ões) processada(s)."))
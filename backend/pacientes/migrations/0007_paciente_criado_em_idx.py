@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pacientes', '0006_convitecontato_conviteimportacao_convitemensagem_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='paciente',
+            index=models.Index(fields=['criado_em'], name='pacientes_p_criado__c1c03a_idx'),
+        ),
+    ]
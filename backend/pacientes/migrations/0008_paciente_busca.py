@@ -0,0 +1,66 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:36
+
+import unicodedata
+
+from django.db import migrations, models
+
+
+def _normalizar(valor):
+    decomposto = unicodedata.normalize("NFKD", valor or "")
+    return "".join(ch for ch in decomposto if not unicodedata.combining(ch)).lower().strip()
+
+
+def _digitos(valor):
+    return "".join(ch for ch in (valor or "") if ch.isdigit())
+
+
+def preencher_busca(apps, schema_editor):
+    Paciente = apps.get_model("pacientes", "Paciente")
+    lote = []
+    for paciente in Paciente.objects.only("id", "nome", "cpf", "telefone", "email").iterator(chunk_size=2000):
+        partes = [
+            _normalizar(paciente.nome),
+            _digitos(paciente.cpf),
+            _digitos(paciente.telefone),
+            _normalizar(paciente.email),
+        ]
+        paciente.busca = " ".join(p for p in partes if p)
+        lote.append(paciente)
+        if len(lote) >= 2000:
+            Paciente.objects.bulk_update(lote, ["busca"])
+            lote = []
+    if lote:
+        Paciente.objects.bulk_update(lote, ["busca"])
+
+
+def criar_indice_trigram(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS pacientes_paciente_busca_trgm "
+        "ON pacientes_paciente USING gin (busca gin_trgm_ops)"
+    )
+
+
+def remover_indice_trigram(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS pacientes_paciente_busca_trgm")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pacientes', '0007_paciente_criado_em_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paciente',
+            name='busca',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.RunPython(preencher_busca, migrations.RunPython.noop),
+        migrations.RunPython(criar_indice_trigram, remover_indice_trigram),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pacientes', '0008_paciente_busca'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conviteimportacao',
+            name='arquivo',
+            field=models.FileField(blank=True, upload_to='importacoes/%Y/%m/%d'),
+        ),
+        migrations.AddField(
+            model_name='conviteimportacao',
+            name='colunas_desconhecidas',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='conviteimportacao',
+            name='finalizado_em',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conviteimportacao',
+            name='iniciado_em',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        # Importações existentes foram processadas de forma síncrona: ficam como concluídas
+        migrations.AddField(
+            model_name='conviteimportacao',
+            name='status',
+            field=models.CharField(choices=[('pendente', 'Pendente'), ('processando', 'Processando'), ('concluido', 'Concluído'), ('falha', 'Falha')], default='concluido', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='conviteimportacao',
+            name='status',
+            field=models.CharField(choices=[('pendente', 'Pendente'), ('processando', 'Processando'), ('concluido', 'Concluído'), ('falha', 'Falha')], default='pendente', max_length=20),
+        ),
+    ]
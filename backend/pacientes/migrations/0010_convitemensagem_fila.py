@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:43
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def preencher_enviado_em(apps, schema_editor):
+    ConviteMensagem = apps.get_model("pacientes", "ConviteMensagem")
+    ConviteMensagem.objects.filter(status="enviado").update(enviado_em=F("criado_em"), tentativas=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pacientes', '0009_conviteimportacao_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='convitemensagem',
+            name='enviado_em',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='convitemensagem',
+            name='tentativas',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='convitemensagem',
+            name='status',
+            field=models.CharField(choices=[('pendente', 'Na fila'), ('enviando', 'Enviando'), ('enviado', 'Enviado'), ('falha', 'Falhou')], default='pendente', max_length=20),
+        ),
+        migrations.RunPython(preencher_enviado_em, migrations.RunPython.noop),
+    ]
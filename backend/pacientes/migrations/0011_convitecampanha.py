@@ -0,0 +1,78 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:45
+
+import hashlib
+from collections import defaultdict
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+LOTE = 2000
+
+
+def agrupar_por_conteudo(apps, schema_editor):
+    """Cria uma campanha por texto distinto (sha256) e liga as mensagens a ela."""
+    ConviteCampanha = apps.get_model("pacientes", "ConviteCampanha")
+    ConviteMensagem = apps.get_model("pacientes", "ConviteMensagem")
+    campanhas = {}
+    ultimo_id = 0
+    while True:
+        lote = list(
+            ConviteMensagem.objects.filter(id__gt=ultimo_id)
+            .order_by("id")
+            .values_list("id", "conteudo", "criado_em")[:LOTE]
+        )
+        if not lote:
+            break
+        ultimo_id = lote[-1][0]
+        por_campanha = defaultdict(list)
+        for mensagem_id, conteudo, criado_em in lote:
+            chave = hashlib.sha256(conteudo.encode("utf-8")).hexdigest()
+            if chave not in campanhas:
+                campanha = ConviteCampanha.objects.create(conteudo=conteudo, hash_conteudo=chave)
+                # auto_now_add: a data da campanha é a da primeira mensagem com esse texto
+                ConviteCampanha.objects.filter(pk=campanha.pk).update(criado_em=criado_em)
+                campanhas[chave] = campanha.pk
+            por_campanha[campanhas[chave]].append(mensagem_id)
+        for campanha_id, ids in por_campanha.items():
+            ConviteMensagem.objects.filter(id__in=ids).update(campanha_id=campanha_id)
+
+
+def restaurar_conteudo(apps, schema_editor):
+    ConviteCampanha = apps.get_model("pacientes", "ConviteCampanha")
+    ConviteMensagem = apps.get_model("pacientes", "ConviteMensagem")
+    for campanha in ConviteCampanha.objects.iterator():
+        ConviteMensagem.objects.filter(campanha_id=campanha.pk).update(conteudo=campanha.conteudo)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pacientes', '0010_convitemensagem_fila'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConviteCampanha',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('conteudo', models.TextField()),
+                ('hash_conteudo', models.CharField(db_index=True, editable=False, max_length=64)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-criado_em'],
+            },
+        ),
+        migrations.AddField(
+            model_name='convitemensagem',
+            name='campanha',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='mensagens', to='pacientes.convitecampanha'),
+        ),
+        migrations.RunPython(agrupar_por_conteudo, restaurar_conteudo),
+        # blank=True só no estado: ao desfazer a 0012 a coluna volta com default ''
+        migrations.AlterField(
+            model_name='convitemensagem',
+            name='conteudo',
+            field=models.TextField(blank=True),
+        ),
+    ]
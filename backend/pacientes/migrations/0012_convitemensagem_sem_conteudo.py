@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    # Separada da 0011: no PostgreSQL o ALTER TABLE não pode rodar na mesma
+    # transação dos UPDATEs que disparam as triggers da FK recém-criada.
+
+    dependencies = [
+        ('pacientes', '0011_convitecampanha'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='convitemensagem',
+            name='campanha',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mensagens', to='pacientes.convitecampanha'),
+        ),
+        migrations.RemoveField(
+            model_name='convitemensagem',
+            name='conteudo',
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:20
+
+from django.db import migrations
+
+
+def criar_indice_trigram(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    # `nome__icontains` vira `UPPER("nome"::text) LIKE UPPER(...)`; o índice
+    # precisa ser sobre a mesma expressão para o planner usá-lo. Os prefixos de
+    # cpf/telefone já têm os índices `varchar_pattern_ops` (`*_like`) que o
+    # Django cria para `db_index=True`; sem este, o OR da busca cai em seq scan.
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS pacientes_convitecontato_nome_trgm "
+        "ON pacientes_convitecontato USING gin (UPPER(nome::text) gin_trgm_ops)"
+    )
+
+
+def remover_indice_trigram(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS pacientes_convitecontato_nome_trgm")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pacientes', '0012_convitemensagem_sem_conteudo'),
+    ]
+
+    operations = [
+        migrations.RunPython(criar_indice_trigram, remover_indice_trigram),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:19
+
+import core.armazenamento
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pacientes', '0014_geracaodocumento'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='documento',
+            name='arquivo',
+            field=models.FileField(storage=core.armazenamento.obter_armazenamento, upload_to='documentos/%Y/%m/%d'),
+        ),
+    ]
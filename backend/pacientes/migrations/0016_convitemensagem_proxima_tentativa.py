@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pacientes', '0015_documento_armazenamento'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='convitemensagem',
+            name='proxima_tentativa',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
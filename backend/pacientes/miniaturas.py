@@ -0,0 +1,177 @@
+"""Miniaturas das imagens dos documentos do paciente (fotos e radiografias).
+
+Imagens que o Pillow abre viram uma miniatura WebP (JPEG se o Pillow não tiver
+WebP) de no máximo `MINIATURAS_TAMANHO` px. PDFs e demais tipos ficam sem
+miniatura (o Pillow não rasteriza PDF) e `suporta` responde False para eles,
+para que a API não anuncie uma `thumb_url` que daria 404.
+
+As miniaturas são geradas em segundo plano logo após o upload
+(`agendar`) e, se faltarem, na primeira vez que forem pedidas. Ficam em
+`MINIATURAS_DIR`, uma por arquivo: documentos com o mesmo conteúdo (ver
+core.armazenamento) compartilham a miniatura. O diretório é limitado a
+`MINIATURAS_MAX_MB`; ao passar do limite saem as menos usadas (cada acesso
+atualiza o mtime do arquivo).
+"""
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from PIL import Image, ImageOps, features
+
+from core.tarefas import enfileirar
+
+from .models import Documento
+
+logger = logging.getLogger(__name__)
+
+# Intervalo mínimo (s) entre duas podas do diretório
+PODA_INTERVALO = 30
+
+_podado_em = 0.0
+_lock = threading.Lock()
+
+
+def suporta(doc):
+    """Se o tipo do documento tem miniatura (imagens)."""
+    return bool(doc.arquivo) and (doc.content_type or "").lower().startswith("image/")
+
+
+def versao(doc):
+    """Chave da miniatura: muda quando o arquivo do documento muda."""
+    return hashlib.sha1(doc.arquivo.name.encode("utf-8")).hexdigest()
+
+
+def agendar(doc):
+    """Gera a miniatura em segundo plano (após o commit)."""
+    if suporta(doc):
+        enfileirar(gerar_miniatura, doc.pk)
+
+
+def agendar_varios(documentos):
+    """Uma tarefa para as miniaturas de vários documentos (ex.: geração em lote)."""
+    ids = [doc.pk for doc in documentos if doc.pk is not None and suporta(doc)]
+    if ids:
+        enfileirar(gerar_miniaturas, ids)
+
+
+def gerar_miniaturas(documento_ids):
+    for documento_id in documento_ids:
+        gerar_miniatura(documento_id)
+
+
+def gerar_miniatura(documento_id):
+    doc = Documento.objects.filter(pk=documento_id).first()
+    if doc is None or not suporta(doc):
+        return None
+    return obter_miniatura(doc)
+
+
+def obter_miniatura(doc):
+    """Caminho da miniatura de `doc`, gerada agora se ainda não existir; None se não for possível."""
+    caminho = _caminho(doc)
+    if caminho.exists():
+        # Marca como usada para a poda (LRU pelo mtime)
+        try:
+            os.utime(caminho)
+        except FileNotFoundError:
+            pass
+        else:
+            return caminho
+
+    try:
+        with doc.arquivo.open("rb") as arquivo:
+            imagem = _abrir_imagem(arquivo)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logger.warning("Não foi possível gerar a miniatura do documento %s", doc.pk, exc_info=True)
+        return None
+
+    _gravar(imagem, caminho)
+    _podar()
+    return caminho
+
+
+def content_type(caminho):
+    return {".webp": "image/webp", ".jpg": "image/jpeg"}[Path(caminho).suffix]
+
+
+# --------- Helpers ---------
+def _diretorio():
+    diretorio = Path(settings.MINIATURAS_DIR)
+    if not diretorio.is_absolute():
+        diretorio = Path(settings.BASE_DIR) / diretorio
+    return diretorio
+
+
+def _caminho(doc):
+    chave = versao(doc)
+    extensao = ".webp" if features.check("webp") else ".jpg"
+    return _diretorio() / chave[:2] / f"{chave}{extensao}"
+
+
+def _tamanho():
+    return getattr(settings, "MINIATURAS_TAMANHO", 320)
+
+
+def _abrir_imagem(arquivo):
+    imagem = Image.open(arquivo)
+    # JPEG: decodifica já reduzido (1/2, 1/4, 1/8), bem mais rápido para fotos grandes
+    imagem.draft("RGB", (_tamanho(), _tamanho()))
+    imagem = ImageOps.exif_transpose(imagem)
+    imagem.thumbnail((_tamanho(), _tamanho()))
+    return imagem
+
+
+def _gravar(imagem, caminho):
+    caminho.parent.mkdir(parents=True, exist_ok=True)
+    buffer = io.BytesIO()
+    if imagem.mode not in ("RGB", "L"):
+        imagem = imagem.convert("RGB")
+    formato = "WEBP" if caminho.suffix == ".webp" else "JPEG"
+    imagem.save(buffer, formato, quality=80)
+    # Temporário + troca: quem pede a miniatura nunca vê arquivo pela metade
+    fd, temporario = tempfile.mkstemp(dir=caminho.parent, suffix=".tmp")
+    with os.fdopen(fd, "wb") as destino:
+        destino.write(buffer.getvalue())
+    os.replace(temporario, caminho)
+
+
+def _podar():
+    """Apaga as miniaturas menos usadas enquanto o diretório passar de MINIATURAS_MAX_MB."""
+    global _podado_em
+    with _lock:
+        agora = time.monotonic()
+        if agora - _podado_em < PODA_INTERVALO:
+            return
+        _podado_em = agora
+
+    limite = getattr(settings, "MINIATURAS_MAX_MB", 500) * 1024 * 1024
+    arquivos = []
+    total = 0
+    for caminho in _diretorio().glob("*/*.*"):
+        if caminho.suffix == ".tmp":
+            continue
+        try:
+            info = caminho.stat()
+        except FileNotFoundError:
+            continue
+        arquivos.append((info.st_mtime, info.st_size, caminho))
+        total += info.st_size
+    if total <= limite:
+        return
+    # Poda até 90% do limite, para não repetir a cada miniatura nova
+    for _, tamanho, caminho in sorted(arquivos):
+        if total <= limite * 0.9:
+            break
+        try:
+            caminho.unlink()
+        except FileNotFoundError:
+            pass
+        total -= tamanho
@@ -1,7 +1,27 @@
+import hashlib
+import re
+import unicodedata
+
 from django.db import models
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from core.armazenamento import obter_armazenamento
+
+# Marcadores aceitos no texto de uma campanha de convites
+_MARCADOR_CAMPANHA = re.compile(r"\{(nome|primeiro_nome)\}")
+
+
+def normalizar_busca(valor: str) -> str:
+    """Minúsculas e sem acentos (equivalente a lower(unaccent(valor)))."""
+    decomposto = unicodedata.normalize("NFKD", valor or "")
+    return "".join(ch for ch in decomposto if not unicodedata.combining(ch)).lower().strip()
+
+
+def _somente_digitos(valor: str) -> str:
+    return "".join(ch for ch in (valor or "") if ch.isdigit())
+
+
 class Paciente(models.Model):
     nome = models.CharField(max_length=120)
     cpf = models.CharField(max_length=14, unique=True)
@@ -10,16 +30,38 @@ class Paciente(models.Model):
     email = models.EmailField(blank=True)
     endereco = models.TextField(blank=True)
     observacoes = models.TextField(blank=True)
+    # Nome/CPF/telefone/e-mail normalizados; coberto por índice GIN pg_trgm no PostgreSQL
+    busca = models.TextField(blank=True, editable=False)
     criado_em = models.DateTimeField(auto_now_add=True)
     atualizado_em = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ["nome"]
-        indexes = [models.Index(fields=["cpf"]), models.Index(fields=["nome"])]
+        indexes = [
+            models.Index(fields=["cpf"]),
+            models.Index(fields=["nome"]),
+            models.Index(fields=["criado_em"]),
+        ]
 
     def __str__(self) -> str:
         return f"{self.nome} ({self.cpf})"
 
+    def atualizar_busca(self) -> None:
+        partes = [
+            normalizar_busca(self.nome),
+            _somente_digitos(self.cpf),
+            _somente_digitos(self.telefone),
+            normalizar_busca(self.email),
+        ]
+        self.busca = " ".join(p for p in partes if p)
+
+    def save(self, *args, **kwargs):
+        self.atualizar_busca()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"nome", "cpf", "telefone", "email"} & set(update_fields):
+            kwargs["update_fields"] = set(update_fields) | {"busca"}
+        super().save(*args, **kwargs)
+
 
 class Anamnese(models.Model):
     paciente = models.OneToOneField(Paciente, on_delete=models.CASCADE, related_name="anamnese")
@@ -62,7 +104,8 @@ class Anamnese(models.Model):
 class Documento(models.Model):
     """Documentos anexados ao cadastro do paciente."""
     paciente = models.ForeignKey(Paciente, on_delete=models.CASCADE, related_name="documentos")
-    arquivo = models.FileField(upload_to="documentos/%Y/%m/%d")
+    # Conteúdo deduplicado: registros com o mesmo arquivo apontam para o mesmo blob
+    arquivo = models.FileField(upload_to="documentos/%Y/%m/%d", storage=obter_armazenamento)
     nome = models.CharField(max_length=255, blank=True)
     content_type = models.CharField(max_length=120, blank=True)
     tamanho = models.PositiveIntegerField(default=0)
@@ -98,18 +141,64 @@ class Prescricao(models.Model):
         return f"Prescrição #{self.id} de {self.paciente.nome}"
 
 
+class GeracaoDocumento(models.Model):
+    """Geração de PDF em segundo plano (prescrição exportada ou modelo pronto)."""
+
+    class Status(models.TextChoices):
+        PENDENTE = "pendente", "Pendente"
+        PROCESSANDO = "processando", "Processando"
+        CONCLUIDO = "concluido", "Concluído"
+        FALHA = "falha", "Falha"
+
+    TIPO_PRESCRICAO = "prescricao"
+
+    paciente = models.ForeignKey(Paciente, on_delete=models.CASCADE, related_name="geracoes_documento")
+    # "prescricao" ou o tipo de um modelo pronto (pacientes/modelos_documentos)
+    tipo = models.CharField(max_length=60)
+    prescricao = models.ForeignKey(
+        Prescricao, on_delete=models.CASCADE, null=True, blank=True, related_name="geracoes_documento"
+    )
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDENTE)
+    documento = models.ForeignKey(Documento, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    log = models.TextField(blank=True)
+    criado_em = models.DateTimeField(auto_now_add=True)
+    iniciado_em = models.DateTimeField(null=True, blank=True)
+    finalizado_em = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-criado_em"]
+        indexes = [
+            models.Index(fields=["status", "criado_em"]),
+        ]
+
+    def __str__(self) -> str:  # pragma: no cover
+        return f"Geração {self.tipo} de {self.paciente.nome} ({self.get_status_display()})"
+
+
 class ConviteImportacao(models.Model):
     """Histórico de importações de contatos externos."""
 
+    class Status(models.TextChoices):
+        PENDENTE = "pendente", "Pendente"
+        PROCESSANDO = "processando", "Processando"
+        CONCLUIDO = "concluido", "Concluído"
+        FALHA = "falha", "Falha"
+
     arquivo_nome = models.CharField(max_length=255)
+    # CSV guardado só enquanto a importação em segundo plano não termina
+    arquivo = models.FileField(upload_to="importacoes/%Y/%m/%d", blank=True)
     origem = models.CharField(max_length=120, blank=True)
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDENTE)
     total_linhas = models.PositiveIntegerField(default=0)
     importados = models.PositiveIntegerField(default=0)
     atualizados = models.PositiveIntegerField(default=0)
     ignorados = models.PositiveIntegerField(default=0)
     erros = models.PositiveIntegerField(default=0)
+    colunas_desconhecidas = models.JSONField(default=list, blank=True)
     log = models.TextField(blank=True)
     criado_em = models.DateTimeField(auto_now_add=True)
+    iniciado_em = models.DateTimeField(null=True, blank=True)
+    finalizado_em = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         ordering = ["-criado_em"]
@@ -168,7 +257,8 @@ class ConviteContato(models.Model):
         self.cpf_normalizado = self._normalizar_digitos(self.cpf)
         self.telefone_normalizado = self._normalizar_digitos(self.telefone)
 
-    def save(self, *args, **kwargs):  # pragma: no cover - simples
+    def preencher_derivados(self) -> None:
+        """Campos calculados no save(); chamado também antes de bulk_create/bulk_update."""
         self.atualizar_normalizados()
         if not self.idade and self.data_nascimento:
             hoje = timezone.localdate()
@@ -176,6 +266,42 @@ class ConviteContato(models.Model):
                 (hoje.month, hoje.day) < (self.data_nascimento.month, self.data_nascimento.day)
             )
             self.idade = max(anos, 0)
+
+    def save(self, *args, **kwargs):  # pragma: no cover - simples
+        self.preencher_derivados()
+        super().save(*args, **kwargs)
+
+
+class ConviteCampanha(models.Model):
+    """Conteúdo de um envio de convites, gravado uma vez para todos os destinatários.
+
+    O texto pode ter marcadores por contato (`{nome}`, `{primeiro_nome}`), que só
+    são preenchidos na hora da entrega (`renderizar`).
+    """
+
+    conteudo = models.TextField()
+    hash_conteudo = models.CharField(max_length=64, db_index=True, editable=False)
+    criado_em = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["-criado_em"]
+
+    def __str__(self) -> str:  # pragma: no cover
+        return f"Campanha #{self.pk} ({self.criado_em:%d/%m/%Y})"
+
+    @staticmethod
+    def calcular_hash(conteudo: str) -> str:
+        return hashlib.sha256((conteudo or "").encode("utf-8")).hexdigest()
+
+    def renderizar(self, nome: str) -> str:
+        """Texto final para um destinatário com o `nome` informado."""
+        nome = (nome or "").strip()
+        valores = {"nome": nome, "primeiro_nome": nome.split(" ")[0] if nome else ""}
+        # Chaves desconhecidas (ou chaves literais no texto) ficam como estão
+        return _MARCADOR_CAMPANHA.sub(lambda m: valores[m.group(1)], self.conteudo)
+
+    def save(self, *args, **kwargs):
+        self.hash_conteudo = self.calcular_hash(self.conteudo)
         super().save(*args, **kwargs)
 
 
@@ -183,14 +309,20 @@ class ConviteMensagem(models.Model):
     """Registro de mensagens enviadas para um contato importado."""
 
     class Status(models.TextChoices):
+        PENDENTE = "pendente", "Na fila"
+        ENVIANDO = "enviando", "Enviando"
         ENVIADO = "enviado", "Enviado"
         FALHA = "falha", "Falhou"
 
     contato = models.ForeignKey(ConviteContato, on_delete=models.CASCADE, related_name="mensagens")
-    conteudo = models.TextField()
-    status = models.CharField(max_length=20, choices=Status.choices, default=Status.ENVIADO)
+    campanha = models.ForeignKey(ConviteCampanha, on_delete=models.CASCADE, related_name="mensagens")
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDENTE)
     erro = models.TextField(blank=True)
+    tentativas = models.PositiveSmallIntegerField(default=0)
+    # Falha temporária: a mensagem volta para a fila e só é reservada de novo a partir daqui
+    proxima_tentativa = models.DateTimeField(null=True, blank=True)
     criado_em = models.DateTimeField(auto_now_add=True)
+    enviado_em = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         ordering = ["-criado_em"]
@@ -200,3 +332,7 @@ class ConviteMensagem(models.Model):
 
     def __str__(self) -> str:  # pragma: no cover
         return f"Mensagem para {self.contato.nome} ({self.status})"
+
+    @property
+    def conteudo(self) -> str:
+        return self.campanha.renderizar(self.contato.nome)
@@ -0,0 +1,229 @@
+"""Particionamento mensal opcional de `ConviteMensagem` (só PostgreSQL).
+
+`converter()` troca a tabela comum por uma tabela particionada por faixa de
+`criado_em`: uma partição por mês mais uma partição padrão, que recebe o que
+cair fora das faixas criadas (assim um INSERT nunca falha por falta de
+partição). O PostgreSQL exige a chave de partição em toda restrição única, então
+a chave primária no banco passa a ser `(id, criado_em)`; o Django continua
+tratando `id` como pk, e a sequência garante que ele segue único. Migrações que
+criem restrições únicas sem `criado_em` nessa tabela deixam de funcionar.
+
+`criar_particoes_futuras()` e `desanexar_antigas()` fazem a manutenção periódica
+(comando `manter_particoes_mensagens`). Uma partição desanexada continua no banco
+como tabela comum (arquivo), sem as FKs, até ser exportada ou removida.
+"""
+import os
+import re
+from datetime import datetime
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import ConviteMensagem
+
+TABELA = ConviteMensagem._meta.db_table
+PARTICAO_PADRAO = f"{TABELA}_padrao"
+_NOME_PARTICAO = re.compile(rf"^{TABELA}_p(\d{{4}})(\d{{2}})$")
+
+
+def esta_particionada():
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [TABELA])
+        linha = cursor.fetchone()
+    return bool(linha) and linha[0] == "p"
+
+
+def inicio_do_mes(momento=None):
+    """Meia-noite do dia 1º do mês de `momento`, no fuso do projeto."""
+    local = timezone.localtime(momento or timezone.now())
+    return timezone.make_aware(datetime(local.year, local.month, 1))
+
+
+def somar_meses(inicio, meses):
+    indice = inicio.year * 12 + inicio.month - 1 + meses
+    return timezone.make_aware(datetime(indice // 12, indice % 12 + 1, 1))
+
+
+def nome_particao(inicio):
+    return f"{TABELA}_p{inicio:%Y%m}"
+
+
+def listar_particoes():
+    """Partições mensais anexadas: lista de `(nome, início do mês)` em ordem."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(%s)",
+            [TABELA],
+        )
+        nomes = [linha[0] for linha in cursor.fetchall()]
+    return sorted(
+        (nome, timezone.make_aware(datetime(int(m.group(1)), int(m.group(2)), 1)))
+        for nome in nomes
+        if (m := _NOME_PARTICAO.match(nome))
+    )
+
+
+def listar_arquivadas():
+    """Partições já desanexadas que continuam no banco como tabelas comuns."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT relname FROM pg_class WHERE relkind = 'r' AND NOT relispartition "
+            "AND relnamespace = current_schema()::regnamespace AND relname LIKE %s",
+            [f"{TABELA}_p%"],
+        )
+        return sorted(linha[0] for linha in cursor.fetchall() if _NOME_PARTICAO.match(linha[0]))
+
+
+def converter(meses_futuros=3):
+    """Converte a tabela comum em particionada, copiando os dados existentes.
+
+    Roda numa única transação com a tabela bloqueada (ACCESS EXCLUSIVE): envios
+    e entregas ficam parados enquanto os dados são copiados.
+    """
+    q = connection.ops.quote_name
+    legado = f"{TABELA}_legado"
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {q(TABELA)} IN ACCESS EXCLUSIVE MODE")
+        cursor.execute(
+            "SELECT conname FROM pg_constraint WHERE confrelid = to_regclass(%s) AND contype = 'f'",
+            [TABELA],
+        )
+        dependentes = [linha[0] for linha in cursor.fetchall()]
+        if dependentes:
+            raise RuntimeError(f"Há FKs apontando para {TABELA}: {', '.join(dependentes)}.")
+
+        # Definições guardadas antes de renomear: o SQL já cita o nome final da tabela
+        cursor.execute(
+            "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'p'", [TABELA]
+        )
+        nome_pk = cursor.fetchone()[0]
+        cursor.execute(
+            "SELECT indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s "
+            "AND indexname <> %s",
+            [TABELA, nome_pk],
+        )
+        indices = [linha[0] for linha in cursor.fetchall()]
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = to_regclass(%s) AND contype = 'f'",
+            [TABELA],
+        )
+        fks = cursor.fetchall()
+        cursor.execute(f"SELECT min(criado_em) FROM {q(TABELA)}")
+        mais_antiga = cursor.fetchone()[0]
+
+        cursor.execute(f"ALTER TABLE {q(TABELA)} RENAME TO {q(legado)}")
+        cursor.execute(
+            f"CREATE TABLE {q(TABELA)} (LIKE {q(legado)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+            "PARTITION BY RANGE (criado_em)"
+        )
+        cursor.execute(f"CREATE TABLE {q(PARTICAO_PADRAO)} PARTITION OF {q(TABELA)} DEFAULT")
+        inicio = inicio_do_mes(mais_antiga)
+        fim = somar_meses(inicio_do_mes(), meses_futuros)
+        while inicio <= fim:
+            _criar_particao_vazia(cursor, inicio)
+            inicio = somar_meses(inicio, 1)
+        cursor.execute(f"INSERT INTO {q(TABELA)} SELECT * FROM {q(legado)}")
+        cursor.execute(f"DROP TABLE {q(legado)}")
+
+        cursor.execute(f"ALTER TABLE {q(TABELA)} ADD CONSTRAINT {q(nome_pk)} PRIMARY KEY (id, criado_em)")
+        for definicao in indices:
+            cursor.execute(definicao)
+        for nome, definicao in fks:
+            cursor.execute(f"ALTER TABLE {q(TABELA)} ADD CONSTRAINT {q(nome)} {definicao}")
+        # Coluna identity não é aceita em tabela particionada (PostgreSQL < 17)
+        sequencia = f"{TABELA}_id_seq"
+        cursor.execute(f"CREATE SEQUENCE {q(sequencia)} OWNED BY {q(TABELA)}.id")
+        cursor.execute(f"SELECT setval(%s, COALESCE((SELECT max(id) FROM {q(TABELA)}), 0) + 1, false)", [sequencia])
+        cursor.execute(f"ALTER TABLE {q(TABELA)} ALTER COLUMN id SET DEFAULT nextval(%s::regclass)", [sequencia])
+        cursor.execute(f"ANALYZE {q(TABELA)}")
+
+
+def criar_particoes_futuras(meses):
+    """Garante partições do mês atual até `meses` à frente; retorna as criadas."""
+    existentes = {inicio for _, inicio in listar_particoes()}
+    criadas = []
+    inicio = inicio_do_mes()
+    for _ in range(meses + 1):
+        if inicio not in existentes:
+            criar_particao(inicio)
+            criadas.append(nome_particao(inicio))
+        inicio = somar_meses(inicio, 1)
+    return criadas
+
+
+def criar_particao(inicio):
+    """Cria a partição do mês, movendo para ela o que já estiver na partição padrão."""
+    q = connection.ops.quote_name
+    fim = somar_meses(inicio, 1)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT EXISTS (SELECT 1 FROM {q(PARTICAO_PADRAO)} WHERE criado_em >= %s AND criado_em < %s)",
+            [inicio, fim],
+        )
+        if not cursor.fetchone()[0]:
+            _criar_particao_vazia(cursor, inicio)
+            return
+        # O PostgreSQL recusa a nova faixa enquanto houver linhas dela na partição padrão
+        cursor.execute(f"CREATE TEMP TABLE mensagens_movidas (LIKE {q(TABELA)}) ON COMMIT DROP")
+        cursor.execute(
+            f"WITH movidas AS (DELETE FROM {q(PARTICAO_PADRAO)} WHERE criado_em >= %s AND criado_em < %s "
+            "RETURNING *) INSERT INTO mensagens_movidas SELECT * FROM movidas",
+            [inicio, fim],
+        )
+        _criar_particao_vazia(cursor, inicio)
+        cursor.execute(f"INSERT INTO {q(TABELA)} SELECT * FROM mensagens_movidas")
+
+
+def desanexar_antigas(retencao_meses):
+    """Desanexa as partições anteriores à janela de retenção; retorna os nomes."""
+    q = connection.ops.quote_name
+    limite = somar_meses(inicio_do_mes(), -retencao_meses)
+    desanexadas = []
+    for nome, inicio in listar_particoes():
+        if inicio >= limite:
+            break
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE {q(TABELA)} DETACH PARTITION {q(nome)}")
+            # Sem isso o arquivo impediria excluir contatos/campanhas (FK sem cascade no banco)
+            cursor.execute(
+                "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'f'", [nome]
+            )
+            for (fk,) in cursor.fetchall():
+                cursor.execute(f"ALTER TABLE {q(nome)} DROP CONSTRAINT {q(fk)}")
+        desanexadas.append(nome)
+    return desanexadas
+
+
+def exportar_arquivada(nome, diretorio):
+    """Grava a tabela arquivada `nome` em `diretorio/nome.csv` e a remove do banco."""
+    q = connection.ops.quote_name
+    caminho = os.path.join(diretorio, f"{nome}.csv")
+    copy_sql = f"COPY {q(nome)} TO STDOUT WITH (FORMAT csv, HEADER)"
+    with transaction.atomic(), connection.cursor() as cursor, open(caminho, "wb") as destino:
+        bruto = cursor.cursor
+        if hasattr(bruto, "copy_expert"):  # psycopg2
+            bruto.copy_expert(copy_sql, destino)
+        else:  # psycopg 3
+            with bruto.copy(copy_sql) as copy:
+                for bloco in copy:
+                    destino.write(bloco)
+        cursor.execute(f"DROP TABLE {q(nome)}")
+    return caminho
+
+
+def remover_arquivada(nome):
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE {connection.ops.quote_name(nome)}")
+
+
+# --------- Helpers ---------
+def _criar_particao_vazia(cursor, inicio):
+    q = connection.ops.quote_name
+    cursor.execute(
+        f"CREATE TABLE {q(nome_particao(inicio))} PARTITION OF {q(TABELA)} FOR VALUES FROM (%s) TO (%s)",
+        [inicio, somar_meses(inicio, 1)],
+    )
@@ -0,0 +1,119 @@
+"""PDF das prescrições (exportar), com o papel timbrado de `PRESCRIPTION_TEMPLATE_PATH`.
+
+Usado pela view (síncrono) e pelas gerações em segundo plano (pacientes.geracoes).
+"""
+import io
+import textwrap
+from datetime import datetime
+
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import cm
+from reportlab.pdfgen import canvas
+
+from .pdf_recursos import aplicar_modelo_prescricao, desenhar_cabecalho
+
+TITULO = "Prescrição Odontológica"
+
+
+def gerar_pdf_prescricao(prescricao):
+    """PDF final da prescrição: conteúdo sobre o papel timbrado (se configurado)."""
+    return aplicar_modelo_prescricao(montar_pdf_prescricao(prescricao))
+
+
+def montar_pdf_prescricao(prescricao):
+    """PDF da prescrição, sem o papel timbrado."""
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=A4)
+    w, h = A4
+    desenhar_cabecalho(c, TITULO)
+
+    y = h - 4.5 * cm
+    data_txt = datetime.now().strftime("%d/%m/%Y")
+    paciente = prescricao.paciente
+
+    c.setFont("Helvetica", 12)
+    c.drawString(2 * cm, y, f"Paciente: {paciente.nome}")
+    y -= 0.7 * cm
+    if paciente.cpf:
+        c.drawString(2 * cm, y, f"CPF: {paciente.cpf}")
+        y -= 0.7 * cm
+    if paciente.data_nascimento:
+        c.drawString(2 * cm, y, f"Data de nascimento: {paciente.data_nascimento.strftime('%d/%m/%Y')}")
+        y -= 0.7 * cm
+    c.drawString(2 * cm, y, f"Data da prescrição: {data_txt}")
+    y -= 1.0 * cm
+
+    c.setFont("Helvetica-Bold", 12)
+    c.drawString(2 * cm, y, "Medicamentos prescritos:")
+    y -= 0.8 * cm
+
+    c.setFont("Helvetica", 11)
+    for idx, item in enumerate(prescricao.itens or [], start=1):
+        if y < 4 * cm:
+            c.showPage()
+            desenhar_cabecalho(c, TITULO)
+            y = h - 4.5 * cm
+            c.setFont("Helvetica", 11)
+        c.drawString(2.1 * cm, y, f"{idx}. {item.get('nome', '—')}")
+        y -= 0.6 * cm
+        campos = [
+            ("Classe", item.get("classe_nome")),
+            ("Dose", item.get("dose")),
+            ("Frequência", item.get("frequencia")),
+            ("Duração", item.get("duracao")),
+        ]
+        for label, value in campos:
+            if value:
+                c.drawString(2.4 * cm, y, f"{label}: {value}")
+                y -= 0.5 * cm
+        orient = item.get("orientacoes")
+        if orient:
+            c.drawString(2.4 * cm, y, "Orientações:")
+            y -= 0.5 * cm
+            c.setFont("Helvetica", 10)
+            wrapper = _bloco_texto(c, orient, 2.6 * cm, y + 0.3 * cm, font="Helvetica", size=10, leading=13, max_chars=90)
+            y = wrapper - 0.2 * cm
+            c.setFont("Helvetica", 11)
+        y -= 0.4 * cm
+
+    if prescricao.observacoes:
+        if y < 5 * cm:
+            c.showPage()
+            desenhar_cabecalho(c, TITULO)
+            y = h - 4.5 * cm
+        c.setFont("Helvetica-Bold", 11)
+        c.drawString(2 * cm, y, "Observações adicionais:")
+        y -= 0.6 * cm
+        c.setFont("Helvetica", 10)
+        y = _bloco_texto(c, prescricao.observacoes, 2.2 * cm, y + 0.3 * cm, font="Helvetica", size=10, leading=13, max_chars=95) - 0.3 * cm
+
+    y -= 1.2 * cm
+    c.setFont("Helvetica", 11)
+    responsavel = prescricao.profissional or getattr(settings, "CLINIC_RESPONSAVEL_PADRAO", "")
+    cro = prescricao.cro or getattr(settings, "CLINIC_CRO", "")
+    if responsavel:
+        c.drawString(2 * cm, y, f"Profissional responsável: {responsavel}")
+        y -= 0.6 * cm
+    if cro:
+        c.drawString(2 * cm, y, f"CRO: {cro}")
+        y -= 0.8 * cm
+
+    # Assinatura
+    c.line(2 * cm, y, 10 * cm, y)
+    c.drawString(2 * cm, y - 0.5 * cm, "Assinatura do profissional")
+
+    c.showPage(); c.save()
+    return buf.getvalue()
+
+
+# --------- Helpers ---------
+def _bloco_texto(c, text, x, y, font="Helvetica", size=11, leading=14, max_chars=95):
+    c.setFont(font, size)
+    lines = []
+    for part in str(text).split("\n"):
+        lines.extend(textwrap.wrap(part, max_chars) or [""])
+    for line in lines:
+        c.drawString(x, y, line)
+        y -= leading / 10 * cm
+    return y
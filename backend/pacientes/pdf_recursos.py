@@ -0,0 +1,259 @@
+"""Recursos compartilhados dos PDFs da clínica: cabeçalho, logotipo e papel timbrado.
+
+O logo (`CLINIC_LOGO_PATH`) é lido e decodificado uma única vez por processo
+(um `ImageReader`), junto com os textos `CLINIC_*`. O cache é refeito quando o
+mtime do arquivo muda (conferido no máximo a cada `PDF_RECURSOS_VERIFICACAO_SEGUNDOS`)
+ou quando um desses settings é alterado (`override_settings`). Dentro de cada PDF
+o cabeçalho vira um form XObject (`beginForm`/`doForm`): desenhado uma vez e
+referenciado em todas as páginas; só o título é escrito por página.
+
+O modelo das prescrições (`PRESCRIPTION_TEMPLATE_PATH`) segue a mesma regra de
+cache: o processo guarda só os bytes do arquivo (ou o arquivo mapeado, com
+`PRESCRIPTION_TEMPLATE_MMAP`), que nunca mudam. Cada thread mantém o seu próprio
+`PdfReader` sobre eles, lido uma vez; por requisição o `PdfWriter` copia a página
+do modelo e o PDF gerado é mesclado na cópia (`merge_page`), sem alterar o leitor.
+"""
+import io
+import logging
+import mmap
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import cm
+from reportlab.lib.utils import ImageReader
+
+logger = logging.getLogger(__name__)
+
+FORM_CABECALHO = "CabecalhoClinica"
+
+
+class RecursosClinica:
+    """Retrato dos settings da clínica e do logo já pronto para embutir."""
+
+    def __init__(self, nome, linha_contato, logo_caminho="", logo_mtime=None, logo=None):
+        self.nome = nome
+        self.linha_contato = linha_contato
+        self.logo_caminho = logo_caminho
+        self.logo_mtime = logo_mtime
+        # ImageReader com os pixels já decodificados: os PDFs só leem dele
+        self.logo = logo
+
+
+_recursos = None
+_verificado_em = 0.0
+_lock = threading.Lock()
+
+
+def obter_recursos():
+    """Recursos do processo, recarregados só se o logo ou os settings mudarem."""
+    global _recursos, _verificado_em
+    intervalo = getattr(settings, "PDF_RECURSOS_VERIFICACAO_SEGUNDOS", 10)
+    with _lock:
+        agora = time.monotonic()
+        if _recursos is not None and agora - _verificado_em < intervalo:
+            return _recursos
+        if _recursos is None or _mtime(_recursos.logo_caminho) != _recursos.logo_mtime:
+            _recursos = _carregar()
+        _verificado_em = agora
+        return _recursos
+
+
+def limpar_cache():
+    global _recursos
+    with _lock:
+        _recursos = None
+
+
+@receiver(setting_changed)
+def _setting_alterado(sender, setting, **kwargs):
+    if setting.startswith("CLINIC_") or setting in ("BASE_DIR", "PDF_RECURSOS_VERIFICACAO_SEGUNDOS"):
+        limpar_cache()
+    if setting.startswith("PRESCRIPTION_TEMPLATE_") or setting in ("BASE_DIR", "PDF_RECURSOS_VERIFICACAO_SEGUNDOS"):
+        limpar_cache_modelo()
+
+
+def desenhar_cabecalho(c, titulo):
+    """Desenha o cabeçalho da clínica e o `titulo` na página atual do canvas."""
+    w, h = A4
+    if not c.hasForm(FORM_CABECALHO):
+        _definir_form(c, obter_recursos())
+    c.doForm(FORM_CABECALHO)
+    c.setFont("Helvetica-Bold", 14)
+    c.drawString(2*cm, h - 3.4*cm, titulo)
+
+
+class ModeloPrescricao:
+    """Papel timbrado carregado: bytes imutáveis do processo e um leitor por thread."""
+
+    def __init__(self, caminho, mtime, dados=None, arquivo=None):
+        self.caminho = caminho
+        self.mtime = mtime
+        # Conteúdo do arquivo em memória ou, com mmap, o arquivo aberto (mapeado por thread)
+        self.dados = dados
+        self.arquivo = arquivo
+        self._local = threading.local()
+
+    def leitor(self):
+        """`PdfReader` desta thread; a posição do stream e os objetos lidos não são compartilhados."""
+        leitor = getattr(self._local, "leitor", None)
+        if leitor is None:
+            from PyPDF2 import PdfReader
+
+            leitor = self._local.leitor = PdfReader(self._abrir())
+        return leitor
+
+    def _abrir(self):
+        if self.arquivo is not None:
+            # Cada mapa tem a própria posição; as páginas do arquivo ficam no cache do SO
+            return mmap.mmap(self.arquivo.fileno(), 0, access=mmap.ACCESS_READ)
+        return io.BytesIO(self.dados)
+
+
+_modelo = None
+_modelo_chave = None
+_modelo_verificado_em = 0.0
+_modelo_lock = threading.Lock()
+
+
+def obter_modelo_prescricao():
+    """Modelo do processo (ou None), recarregado só se o arquivo ou os settings mudarem."""
+    global _modelo, _modelo_chave, _modelo_verificado_em
+    intervalo = getattr(settings, "PDF_RECURSOS_VERIFICACAO_SEGUNDOS", 10)
+    with _modelo_lock:
+        agora = time.monotonic()
+        if _modelo_chave is not None and agora - _modelo_verificado_em < intervalo:
+            return _modelo
+        caminho = _caminho_setting("PRESCRIPTION_TEMPLATE_PATH")
+        chave = (caminho, _mtime(caminho))
+        if chave != _modelo_chave:
+            _modelo = _carregar_modelo(caminho, chave[1]) if chave[1] is not None else None
+            _modelo_chave = chave
+        _modelo_verificado_em = agora
+        return _modelo
+
+
+def limpar_cache_modelo():
+    global _modelo, _modelo_chave
+    with _modelo_lock:
+        _modelo = _modelo_chave = None
+
+
+def aplicar_modelo_prescricao(pdf_bytes):
+    """Sobrepõe cada página de `pdf_bytes` à página correspondente do modelo.
+
+    Páginas além das do modelo usam a última. Sem modelo, ou se algo falhar,
+    devolve `pdf_bytes` como está.
+    """
+    modelo = obter_modelo_prescricao()
+    if modelo is None:
+        return pdf_bytes
+    try:
+        return _sobrepor(modelo, pdf_bytes)
+    except Exception:
+        logger.warning("Não foi possível aplicar o modelo de prescrição %s", modelo.caminho, exc_info=True)
+        return pdf_bytes
+
+
+# --------- Helpers ---------
+def _caminho_setting(nome):
+    caminho = getattr(settings, nome, "") or ""
+    if caminho and not os.path.isabs(caminho):
+        caminho = os.path.join(settings.BASE_DIR, caminho)
+    return caminho
+
+
+def _mtime(caminho):
+    if not caminho:
+        return None
+    try:
+        return os.stat(caminho).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _carregar():
+    address = getattr(settings, "CLINIC_ADDRESS", "Endereço: —")
+    phone = getattr(settings, "CLINIC_PHONE", "Telefone: —")
+    cro = getattr(settings, "CLINIC_CRO", "CRO: —")
+    recursos = RecursosClinica(
+        nome=getattr(settings, "CLINIC_NAME", "Clínica Odontológica"),
+        linha_contato=f"{address} | {phone} | {cro}",
+    )
+    caminho = _caminho_setting("CLINIC_LOGO_PATH")
+    mtime = _mtime(caminho)
+    recursos.logo_caminho, recursos.logo_mtime = caminho, mtime
+    if mtime is not None:
+        try:
+            recursos.logo = _preparar_logo(caminho)
+        except Exception:
+            # Logo inválido não impede a geração do PDF; fica só sem a imagem
+            logger.warning("Não foi possível carregar o logo da clínica em %s", caminho, exc_info=True)
+    return recursos
+
+
+def _preparar_logo(caminho):
+    logo = ImageReader(caminho)
+    # Decodifica agora (pixels e transparência ficam guardados no leitor): as
+    # requisições, em qualquer thread, só leem o que já está pronto
+    logo.getSize()
+    logo.getRGBData()
+    return logo
+
+
+def _definir_form(c, recursos):
+    w, h = A4
+    c.beginForm(FORM_CABECALHO)
+    if recursos.logo is not None:
+        # desenha no topo direito
+        c.drawImage(recursos.logo, w - 5*cm, h - 3*cm, width=3*cm, height=3*cm, preserveAspectRatio=True, mask='auto')
+    c.setFont("Helvetica-Bold", 16)
+    c.drawString(2*cm, h - 2*cm, recursos.nome)
+    c.setFont("Helvetica", 10)
+    c.drawString(2*cm, h - 2.6*cm, recursos.linha_contato)
+    c.line(2*cm, h - 3.6*cm, w - 2*cm, h - 3.6*cm)
+    c.endForm()
+
+
+def _carregar_modelo(caminho, mtime):
+    try:
+        from PyPDF2 import PdfReader
+    except ImportError:
+        return None
+    arquivo = None
+    try:
+        if getattr(settings, "PRESCRIPTION_TEMPLATE_MMAP", False):
+            # O arquivo fica aberto enquanto o modelo existir; trocá-lo com mv não afeta o mapa
+            arquivo = open(caminho, "rb")
+            modelo = ModeloPrescricao(caminho, mtime, arquivo=arquivo)
+        else:
+            with open(caminho, "rb") as origem:
+                modelo = ModeloPrescricao(caminho, mtime, dados=origem.read())
+        # Valida já na carga; o leitor fica para as requisições desta thread
+        leitor = modelo._local.leitor = PdfReader(modelo._abrir())
+        paginas = len(leitor.pages)
+    except Exception:
+        logger.warning("Não foi possível carregar o modelo de prescrição em %s", caminho, exc_info=True)
+        if arquivo is not None:
+            arquivo.close()
+        return None
+    return modelo if paginas else None
+
+
+def _sobrepor(modelo, pdf_bytes):
+    from PyPDF2 import PdfReader, PdfWriter
+
+    paginas_modelo = modelo.leitor().pages
+    sobreposicao = PdfReader(io.BytesIO(pdf_bytes))
+    writer = PdfWriter()
+    for idx, pagina in enumerate(sobreposicao.pages):
+        # add_page copia a página do modelo para o writer: o merge altera só a cópia
+        nova = writer.add_page(paginas_modelo[min(idx, len(paginas_modelo) - 1)])
+        nova.merge_page(pagina)
+    saida = io.BytesIO()
+    writer.write(saida)
+    return saida.getvalue()
@@ -1,9 +1,14 @@
+from django.urls import reverse
 from rest_framework import serializers
+
+from . import miniaturas
 from .models import (
     Paciente,
     Anamnese,
     Documento,
+    GeracaoDocumento,
     Prescricao,
+    ConviteCampanha,
     ConviteContato,
     ConviteImportacao,
     ConviteMensagem,
@@ -12,7 +17,7 @@ from .models import (
 class PacienteSerializer(serializers.ModelSerializer):
     class Meta:
         model = Paciente
-        fields = "__all__"
+        exclude = ["busca"]
 
 
 class AnamneseSerializer(serializers.ModelSerializer):
@@ -44,7 +49,8 @@ class AnamneseSerializer(serializers.ModelSerializer):
 
 
 class DocumentoSerializer(serializers.ModelSerializer):
-    url = serializers.SerializerMethodField(read_only=True)
+    download_url = serializers.SerializerMethodField(read_only=True)
+    thumb_url = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = Documento
@@ -55,36 +61,47 @@ class DocumentoSerializer(serializers.ModelSerializer):
             "nome",
             "content_type",
             "tamanho",
-            "url",
+            "download_url",
+            "thumb_url",
             "criado_em",
         ]
-        read_only_fields = ["id", "nome", "content_type", "tamanho", "url", "criado_em"]
-
-    def get_url(self, obj):  # pragma: no cover
-        try:
-            request = self.context.get("request")
-            if request is not None and obj.arquivo:
-                return request.build_absolute_uri(obj.arquivo.url)
-            return obj.arquivo.url if obj.arquivo else None
-        except Exception:
+        read_only_fields = ["id", "nome", "content_type", "tamanho", "download_url", "thumb_url", "criado_em"]
+        # O arquivo só sai por `download_url`, que confere a autenticação; o caminho em /media/ não é exposto
+        extra_kwargs = {"arquivo": {"write_only": True}}
+
+    def get_download_url(self, obj):
+        if not obj.arquivo:
+            return None
+        url = reverse("pacientes:documento-download", args=[obj.pk])
+        request = self.context.get("request")
+        return request.build_absolute_uri(url) if request is not None else url
+
+    def get_thumb_url(self, obj):
+        if not miniaturas.suporta(obj):
             return None
+        # A versão na URL deixa o navegador guardar a miniatura até o arquivo mudar
+        url = reverse("pacientes:documento-miniatura", args=[obj.pk]) + f"?v={miniaturas.versao(obj)[:12]}"
+        request = self.context.get("request")
+        return request.build_absolute_uri(url) if request is not None else url
 
     def create(self, validated_data):
         doc = Documento(**validated_data)
-        f = validated_data.get("arquivo")
-        if f is not None:
-            doc.nome = getattr(f, "name", doc.nome)
-            doc.content_type = getattr(f, "content_type", "")
-            try:
-                size = getattr(f, "size", None)
-                if size is None and hasattr(f, "seek") and hasattr(f, "tell"):
-                    pos = f.tell(); f.seek(0, 2); size = f.tell(); f.seek(pos)
-                doc.tamanho = size or 0
-            except Exception:
-                doc.tamanho = 0
+        self._dados_arquivo(doc, validated_data.get("arquivo"))
         doc.save()
         return doc
 
+    def update(self, instance, validated_data):
+        # Arquivo novo: o antigo é liberado no save (core.armazenamento.liberar_substituidos)
+        self._dados_arquivo(instance, validated_data.get("arquivo"))
+        return super().update(instance, validated_data)
+
+    def _dados_arquivo(self, doc, f):
+        if f is not None:
+            doc.nome = getattr(f, "name", doc.nome)
+            # Tamanho e tipo já vêm do upload (core.uploads calcula enquanto recebe)
+            doc.content_type = getattr(f, "content_type", "") or ""
+            doc.tamanho = getattr(f, "size", 0) or 0
+
 
 class PrescricaoItemSerializer(serializers.Serializer):
     classe_nome = serializers.CharField(required=False, allow_blank=True)
@@ -160,6 +177,26 @@ class ConviteContatoSerializer(serializers.ModelSerializer):
         ]
 
 
+class GeracaoDocumentoSerializer(serializers.ModelSerializer):
+    documento = DocumentoSerializer(read_only=True)
+
+    class Meta:
+        model = GeracaoDocumento
+        fields = [
+            "id",
+            "paciente",
+            "tipo",
+            "prescricao",
+            "status",
+            "documento",
+            "log",
+            "criado_em",
+            "iniciado_em",
+            "finalizado_em",
+        ]
+        read_only_fields = fields
+
+
 class ConviteImportacaoSerializer(serializers.ModelSerializer):
     class Meta:
         model = ConviteImportacao
@@ -167,19 +204,37 @@ class ConviteImportacaoSerializer(serializers.ModelSerializer):
             "id",
             "arquivo_nome",
             "origem",
+            "status",
             "total_linhas",
             "importados",
             "atualizados",
             "ignorados",
             "erros",
+            "colunas_desconhecidas",
             "log",
             "criado_em",
+            "iniciado_em",
+            "finalizado_em",
         ]
         read_only_fields = fields
 
 
+class ConviteCampanhaSerializer(serializers.ModelSerializer):
+    total = serializers.IntegerField(read_only=True)
+    pendentes = serializers.IntegerField(read_only=True)
+    enviados = serializers.IntegerField(read_only=True)
+    falhas = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = ConviteCampanha
+        fields = ["id", "conteudo", "criado_em", "total", "pendentes", "enviados", "falhas"]
+        read_only_fields = fields
+
+
 class ConviteMensagemSerializer(serializers.ModelSerializer):
     contato_nome = serializers.CharField(source="contato.nome", read_only=True)
+    # Texto da campanha com os marcadores já preenchidos para o contato
+    conteudo = serializers.CharField(read_only=True)
 
     class Meta:
         model = ConviteMensagem
@@ -188,20 +243,55 @@ class ConviteMensagemSerializer(serializers.ModelSerializer):
             "contato",
             "contato_nome",
             "conteudo",
+            "campanha",
             "status",
             "erro",
+            "tentativas",
             "criado_em",
+            "enviado_em",
+        ]
+        read_only_fields = [
+            "id",
+            "contato",
+            "contato_nome",
+            "conteudo",
+            "campanha",
+            "status",
+            "erro",
+            "tentativas",
+            "criado_em",
+            "enviado_em",
         ]
-        read_only_fields = ["id", "contato", "contato_nome", "status", "erro", "criado_em"]
+
+
+class ConviteFiltroSerializer(serializers.Serializer):
+    """Mesmos filtros da listagem de contatos (`?status=&search=&origem=`)."""
+
+    status = serializers.ChoiceField(choices=ConviteContato.Status.choices, required=False)
+    search = serializers.CharField(required=False, allow_blank=True)
+    origem = serializers.CharField(required=False, allow_blank=True)
+
+    def validate(self, attrs):
+        # Campos em branco não filtram nada: sem nenhum preenchido a campanha iria para todos os contatos
+        filtros = {campo: valor for campo, valor in attrs.items() if valor}
+        if not filtros:
+            raise serializers.ValidationError("Informe ao menos um filtro (status, search ou origem).")
+        return filtros
 
 
 class ConviteEnvioSerializer(serializers.Serializer):
     contatos = serializers.ListField(
-        child=serializers.IntegerField(min_value=1), allow_empty=False, write_only=True
+        child=serializers.IntegerField(min_value=1), allow_empty=False, write_only=True, required=False
     )
+    filtros = ConviteFiltroSerializer(required=False)
     mensagem = serializers.CharField(allow_blank=False)
 
     def validate_contatos(self, value):
         if len(set(value)) != len(value):
             raise serializers.ValidationError("Remova contatos duplicados da seleção.")
         return value
+
+    def validate(self, attrs):
+        if ("contatos" in attrs) == ("filtros" in attrs):
+            raise serializers.ValidationError("Informe a lista de 'contatos' ou os 'filtros' da campanha.")
+        return attrs
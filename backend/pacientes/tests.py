@@ -0,0 +1,1238 @@
+import io
+import os
+import threading
+import zipfile
+from datetime import timedelta
+from unittest import mock, skipUnless
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+from PyPDF2 import PdfReader
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import cm
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas
+from rest_framework.test import APIClient, APIRequestFactory
+
+from core.armazenamento import PREFIXO, obter_armazenamento
+from core.models import ArquivoConteudo
+from core.tarefas import FilaCheia
+from core.tests import MidiaTemporariaMixin
+from financeiro.models import Debito, DebitoDocumento
+
+from . import gerador_documentos, particoes, pdf_recursos
+from .entrega import Entregador, FalhaEnvio, TokenBucket, Transporte, agendar_entrega, entregar_pendentes
+from .importacao import CSVInvalido, ImportadorContatos, ImportadorContatosCopy, abrir_csv, criar_importador
+from .models import (
+    Anamnese,
+    ConviteCampanha,
+    ConviteContato,
+    ConviteMensagem,
+    Documento,
+    GeracaoDocumento,
+    Paciente,
+)
+from .views import ConviteContatoViewSet
+
+
+class DocumentoArmazenamentoTests(MidiaTemporariaMixin, TestCase):
+    """Referências dos blobs ao criar, trocar e apagar documentos pela API."""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser("admin", "admin@clinica.test", "senha"))
+        self.paciente = Paciente.objects.create(nome="Ana Souza", cpf="111.111.111-11")
+        # Os arquivos daqui não são PDFs/imagens de verdade: sem miniaturas
+        agendar = mock.patch("pacientes.miniaturas.agendar")
+        agendar.start()
+        self.addCleanup(agendar.stop)
+
+    def _enviar(self, nome, conteudo):
+        with self.captureOnCommitCallbacks(execute=True):
+            resposta = self.client.post(
+                "/api/pacientes/documentos/",
+                {"paciente": self.paciente.pk, "arquivo": SimpleUploadedFile(nome, conteudo)},
+                format="multipart",
+            )
+        self.assertEqual(resposta.status_code, 201, resposta.data)
+        return Documento.objects.get(pk=resposta.data["id"])
+
+    def _referencias(self, doc):
+        return ArquivoConteudo.objects.get(nome=doc.arquivo.name).referencias
+
+    def test_uploads_iguais_compartilham_o_blob(self):
+        a = self._enviar("rx.pdf", b"%PDF-1.4 exame")
+        b = self._enviar("rx-copia.pdf", b"%PDF-1.4 exame")
+
+        self.assertEqual(a.arquivo.name, b.arquivo.name)
+        self.assertTrue(a.arquivo.name.startswith(PREFIXO + "/"))
+        self.assertEqual(self._referencias(a), 2)
+        self.assertEqual(a.content_type, "application/pdf")
+        self.assertEqual(a.tamanho, len(b"%PDF-1.4 exame"))
+
+    def test_apagar_documento_libera_referencia(self):
+        a = self._enviar("rx.pdf", b"%PDF-1.4 exame")
+        b = self._enviar("rx-copia.pdf", b"%PDF-1.4 exame")
+        storage = obter_armazenamento()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete(f"/api/pacientes/documentos/{a.pk}/").status_code, 204)
+        self.assertEqual(self._referencias(b), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f"/api/pacientes/documentos/{b.pk}/")
+        self.assertFalse(ArquivoConteudo.objects.exists())
+        self.assertFalse(storage.exists(b.arquivo.name))
+
+    def test_trocar_arquivo_libera_o_antigo(self):
+        doc = self._enviar("rx.pdf", b"%PDF-1.4 antigo")
+        antigo = doc.arquivo.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            resposta = self.client.patch(
+                f"/api/pacientes/documentos/{doc.pk}/",
+                {"arquivo": SimpleUploadedFile("foto.png", b"\x89PNG\r\n\x1a\nnovo")},
+                format="multipart",
+            )
+        self.assertEqual(resposta.status_code, 200, resposta.data)
+        doc.refresh_from_db()
+
+        self.assertNotEqual(doc.arquivo.name, antigo)
+        self.assertFalse(ArquivoConteudo.objects.filter(nome=antigo).exists())
+        self.assertFalse(obter_armazenamento().exists(antigo))
+        self.assertEqual(self._referencias(doc), 1)
+        self.assertEqual((doc.nome, doc.content_type), ("foto.png", "image/png"))
+
+    def test_trocar_pelo_mesmo_conteudo_mantem_o_blob(self):
+        doc = self._enviar("rx.pdf", b"%PDF-1.4 igual")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(
+                f"/api/pacientes/documentos/{doc.pk}/",
+                {"arquivo": SimpleUploadedFile("rx2.pdf", b"%PDF-1.4 igual")},
+                format="multipart",
+            )
+        doc.refresh_from_db()
+
+        self.assertEqual(self._referencias(doc), 1)
+        self.assertTrue(obter_armazenamento().exists(doc.arquivo.name))
+
+    def test_salvar_sem_trocar_arquivo_nao_libera(self):
+        doc = self._enviar("rx.pdf", b"%PDF-1.4 exame")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            doc.save()
+            doc.save(update_fields=["nome"])
+        self.assertEqual(self._referencias(doc), 1)
+
+
+class DocumentoDownloadTests(MidiaTemporariaMixin, TestCase):
+    """Download autenticado pela API, com Range e requisições condicionais."""
+
+    CONTEUDO = b"%PDF-1.4 " + bytes(range(256))
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser("admin", "admin@clinica.test", "senha"))
+        paciente = Paciente.objects.create(nome="Ana Souza", cpf="111.111.111-11")
+        with mock.patch("pacientes.miniaturas.agendar"):
+            resposta = self.client.post(
+                "/api/pacientes/documentos/",
+                {"paciente": paciente.pk, "arquivo": SimpleUploadedFile("rx.pdf", self.CONTEUDO)},
+                format="multipart",
+            )
+        self.assertEqual(resposta.status_code, 201, resposta.data)
+        self.dados = resposta.data
+        self.url = f"/api/pacientes/documentos/{resposta.data['id']}/download/"
+
+    def _baixar(self, **cabecalhos):
+        resposta = self.client.get(self.url, **cabecalhos)
+        corpo = b"".join(resposta.streaming_content) if resposta.streaming else resposta.content
+        return resposta, corpo
+
+    def test_serializer_nao_expoe_o_caminho_em_media(self):
+        self.assertNotIn("arquivo", self.dados)
+        self.assertNotIn("url", self.dados)
+        self.assertTrue(self.dados["download_url"].endswith(self.url))
+
+    def test_anonimo_nao_baixa_nem_ve_miniatura(self):
+        anonimo = APIClient()
+        self.assertEqual(anonimo.get(self.url).status_code, 401)
+        self.assertEqual(anonimo.get(self.url.replace("download", "miniatura")).status_code, 401)
+
+    def test_arquivo_inteiro(self):
+        resposta, corpo = self._baixar()
+
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(corpo, self.CONTEUDO)
+        self.assertEqual(resposta["Accept-Ranges"], "bytes")
+        self.assertEqual(resposta["Content-Type"], "application/pdf")
+        self.assertIn('filename="rx.pdf"', resposta["Content-Disposition"])
+
+    def test_range_inicial_e_sufixo(self):
+        resposta, corpo = self._baixar(HTTP_RANGE="bytes=0-9")
+        self.assertEqual(resposta.status_code, 206)
+        self.assertEqual(corpo, self.CONTEUDO[:10])
+        self.assertEqual(resposta["Content-Range"], f"bytes 0-9/{len(self.CONTEUDO)}")
+        self.assertEqual(resposta["Content-Length"], "10")
+
+        resposta, corpo = self._baixar(HTTP_RANGE="bytes=-5")
+        self.assertEqual(resposta.status_code, 206)
+        self.assertEqual(corpo, self.CONTEUDO[-5:])
+
+        resposta, corpo = self._baixar(HTTP_RANGE="bytes=260-")
+        self.assertEqual(corpo, self.CONTEUDO[260:])
+
+    def test_range_fora_do_arquivo_416(self):
+        resposta, _ = self._baixar(HTTP_RANGE=f"bytes={len(self.CONTEUDO)}-")
+
+        self.assertEqual(resposta.status_code, 416)
+        self.assertEqual(resposta["Content-Range"], f"bytes */{len(self.CONTEUDO)}")
+
+    def test_range_malformado_ou_multiplo_manda_tudo(self):
+        for cabecalho in ("bytes=0-1,4-5", "linhas=0-9", "bytes=-"):
+            resposta, corpo = self._baixar(HTTP_RANGE=cabecalho)
+            self.assertEqual((resposta.status_code, corpo), (200, self.CONTEUDO), cabecalho)
+
+    def test_if_range(self):
+        etag = self._baixar()[0]["ETag"]
+
+        resposta, corpo = self._baixar(HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE=etag)
+        self.assertEqual((resposta.status_code, corpo), (206, self.CONTEUDO[:10]))
+
+        # Validador de uma versão antiga: arquivo atual inteiro
+        resposta, corpo = self._baixar(HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"antigo"')
+        self.assertEqual((resposta.status_code, corpo), (200, self.CONTEUDO))
+
+    def test_if_none_match_304(self):
+        etag = self._baixar()[0]["ETag"]
+
+        resposta, corpo = self._baixar(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resposta.status_code, 304)
+        self.assertEqual(corpo, b"")
+        self.assertEqual(resposta["ETag"], etag)
+
+    def test_x_accel_redirect(self):
+        with self.settings(DOWNLOAD_PROXY="x-accel-redirect", DOWNLOAD_ACCEL_PREFIXO="/protegido/"):
+            resposta, corpo = self._baixar()
+
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(corpo, b"")
+        nome = Documento.objects.get(pk=self.dados["id"]).arquivo.name
+        self.assertEqual(resposta["X-Accel-Redirect"], f"/protegido/{nome}")
+
+
+class DocumentosZipLinkTests(MidiaTemporariaMixin, TestCase):
+    """ZIP do paciente aberto pelo navegador com um link assinado, sem token."""
+
+    def setUp(self):
+        super().setUp()
+        self.usuario = User.objects.create_superuser("admin", "admin@clinica.test", "senha")
+        self.client = APIClient()
+        self.client.force_authenticate(self.usuario)
+        self.paciente = Paciente.objects.create(nome="Ana Souza", cpf="111.111.111-11")
+        self.outro = Paciente.objects.create(nome="Bruno Lima", cpf="222.222.222-22")
+        with mock.patch("pacientes.miniaturas.agendar"):
+            self.client.post(
+                "/api/pacientes/documentos/",
+                {"paciente": self.paciente.pk, "arquivo": SimpleUploadedFile("rx.pdf", b"%PDF-1.4 exame")},
+                format="multipart",
+            )
+
+    def _link(self, paciente=None):
+        paciente = paciente or self.paciente
+        resposta = self.client.post(f"/api/pacientes/{paciente.pk}/documentos.zip/link/")
+        self.assertEqual(resposta.status_code, 200)
+        return resposta.data["url"]
+
+    def test_link_baixa_o_zip_sem_token(self):
+        resposta = APIClient().get(self._link())
+
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta["Content-Type"], "application/zip")
+        with zipfile.ZipFile(io.BytesIO(b"".join(resposta.streaming_content))) as arquivo:
+            self.assertEqual(arquivo.namelist(), ["documentos/rx.pdf"])
+
+    def test_sem_assinatura_ou_adulterada(self):
+        anonimo = APIClient()
+        self.assertEqual(anonimo.get(f"/api/pacientes/{self.paciente.pk}/documentos.zip").status_code, 401)
+        self.assertEqual(anonimo.get(self._link() + "x").status_code, 401)
+
+    def test_link_vale_so_para_o_paciente_dele(self):
+        url = self._link(self.outro).replace(f"/{self.outro.pk}/", f"/{self.paciente.pk}/")
+
+        self.assertEqual(APIClient().get(url).status_code, 401)
+
+    def test_link_expirado(self):
+        url = self._link()
+        with self.settings(DOWNLOAD_LINK_VALIDADE_SEGUNDOS=-1):
+            self.assertEqual(APIClient().get(url).status_code, 401)
+
+    def test_usuario_desativado(self):
+        url = self._link()
+        self.usuario.is_active = False
+        self.usuario.save()
+
+        self.assertEqual(APIClient().get(url).status_code, 401)
+
+
+class MiniaturasTests(MidiaTemporariaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser("admin", "admin@clinica.test", "senha"))
+        self.paciente = Paciente.objects.create(nome="Ana Souza", cpf="111.111.111-11")
+
+    def test_imagem_enviada_tem_miniatura(self):
+        buffer = io.BytesIO()
+        Image.new("RGB", (1200, 800), "white").save(buffer, "JPEG")
+        with self.captureOnCommitCallbacks(execute=True):
+            resposta = self.client.post(
+                "/api/pacientes/documentos/",
+                {"paciente": self.paciente.pk, "arquivo": SimpleUploadedFile("foto.jpg", buffer.getvalue())},
+                format="multipart",
+            )
+
+        miniatura = self.client.get(resposta.data["thumb_url"])
+        self.assertEqual(miniatura.status_code, 200)
+        imagem = Image.open(io.BytesIO(b"".join(miniatura.streaming_content)))
+        self.assertLessEqual(max(imagem.size), 320)
+
+    def test_pdf_nao_anuncia_miniatura(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            resposta = self.client.post(
+                "/api/pacientes/documentos/gerar/", {"paciente": self.paciente.pk, "tipo": "receita-basica"}, format="json"
+            )
+
+        self.assertIsNone(resposta.data["thumb_url"])
+        miniatura = self.client.get(f"/api/pacientes/documentos/{resposta.data['id']}/miniatura/")
+        self.assertEqual(miniatura.status_code, 404)
+        self.assertFalse(os.path.exists(os.path.join(self.media, "miniaturas")))
+
+
+class DeduplicarDocumentosTests(MidiaTemporariaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.paciente = Paciente.objects.create(nome="Ana Souza", cpf="111.111.111-11")
+
+    def _legado(self, nome, conteudo):
+        caminho = os.path.join(self.media, nome)
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        with open(caminho, "wb") as arquivo:
+            arquivo.write(conteudo)
+        return caminho
+
+    def _executar(self, *args):
+        saida = io.StringIO()
+        call_command("deduplicar_documentos", *args, stdout=saida, stderr=io.StringIO())
+        return saida.getvalue()
+
+    def test_move_arquivos_antigos_para_os_blobs(self):
+        a = self._legado("documentos/2024/01/02/rx.pdf", b"%PDF-1.4 exame")
+        b = self._legado("documentos/2024/03/04/rx_copia.pdf", b"%PDF-1.4 exame")
+        c = self._legado("documentos/debitos/recibo.pdf", b"%PDF-1.4 recibo")
+        doc_a = Documento.objects.create(paciente=self.paciente, arquivo="documentos/2024/01/02/rx.pdf")
+        doc_b = Documento.objects.create(paciente=self.paciente, arquivo="documentos/2024/03/04/rx_copia.pdf")
+        debito = Debito.objects.create(paciente=self.paciente, data_vencimento="2026-01-01")
+        anexo = DebitoDocumento.objects.create(debito=debito, arquivo="documentos/debitos/recibo.pdf")
+
+        self._executar()
+
+        doc_a.refresh_from_db()
+        doc_b.refresh_from_db()
+        anexo.refresh_from_db()
+        self.assertEqual(doc_a.arquivo.name, doc_b.arquivo.name)
+        self.assertTrue(doc_a.arquivo.name.startswith(PREFIXO + "/"))
+        self.assertEqual(ArquivoConteudo.objects.get(nome=doc_a.arquivo.name).referencias, 2)
+        self.assertEqual(ArquivoConteudo.objects.get(nome=anexo.arquivo.name).referencias, 1)
+        for caminho in (a, b, c):
+            self.assertFalse(os.path.exists(caminho))
+        with doc_b.arquivo.open("rb") as arquivo:
+            self.assertEqual(arquivo.read(), b"%PDF-1.4 exame")
+
+    def test_simular_nao_altera_nada(self):
+        a = self._legado("documentos/2024/01/02/rx.pdf", b"%PDF-1.4 exame")
+        self._legado("documentos/2024/03/04/rx_copia.pdf", b"%PDF-1.4 exame")
+        Documento.objects.create(paciente=self.paciente, arquivo="documentos/2024/01/02/rx.pdf")
+        Documento.objects.create(paciente=self.paciente, arquivo="documentos/2024/03/04/rx_copia.pdf")
+
+        saida = self._executar("--simular")
+
+        self.assertIn("1 cópia(s) repetida(s)", saida)
+        self.assertTrue(os.path.exists(a))
+        self.assertFalse(ArquivoConteudo.objects.exists())
+        self.assertFalse(Documento.objects.filter(arquivo__startswith=PREFIXO).exists())
+
+    def test_falha_ao_apontar_registros_preserva_o_arquivo(self):
+        a = self._legado("documentos/2024/01/02/rx.pdf", b"%PDF-1.4 exame")
+        doc = Documento.objects.create(paciente=self.paciente, arquivo="documentos/2024/01/02/rx.pdf")
+
+        with self.assertRaises(RuntimeError):
+            with _falhar_update(Documento):
+                self._executar()
+
+        doc.refresh_from_db()
+        self.assertEqual(doc.arquivo.name, "documentos/2024/01/02/rx.pdf")
+        self.assertTrue(os.path.exists(a))
+        self.assertFalse(ArquivoConteudo.objects.exists())
+
+    def test_remover_orfaos(self):
+        orfao = self._legado("documentos/2024/01/02/perdido.pdf", b"sem registro")
+
+        saida = self._executar("--remover-orfaos")
+
+        self.assertIn("1 arquivo(s) sem registro", saida)
+        self.assertFalse(os.path.exists(orfao))
+
+
+class CabecalhoPdfTests(MidiaTemporariaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.logo = os.path.join(self.media, "logo.png")
+        Image.new("RGBA", (40, 20), (200, 0, 0, 128)).save(self.logo)
+        configuracao = override_settings(CLINIC_LOGO_PATH=self.logo, PDF_RECURSOS_VERIFICACAO_SEGUNDOS=60)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+
+    def _pdf(self, paginas):
+        saida = io.BytesIO()
+        c = canvas.Canvas(saida, pagesize=A4)
+        for numero in range(paginas):
+            pdf_recursos.desenhar_cabecalho(c, f"Página {numero + 1}")
+            c.showPage()
+        c.save()
+        return saida.getvalue()
+
+    def test_logo_entra_uma_vez_por_documento(self):
+        pdf = self._pdf(3)
+
+        self.assertEqual(len(PdfReader(io.BytesIO(pdf)).pages), 3)
+        self.assertEqual(pdf.count(b"/Subtype /Form"), 1)
+        # Imagem e a máscara da transparência
+        self.assertEqual(pdf.count(b"/Subtype /Image"), 2)
+        self.assertIn(b"/SMask", pdf)
+
+    def test_logo_lido_uma_vez_por_processo(self):
+        self._pdf(1)
+        logo = pdf_recursos.obter_recursos().logo
+        self.assertIsNotNone(logo)
+        with mock.patch.object(pdf_recursos, "ImageReader") as leitor:
+            self._pdf(2)
+        leitor.assert_not_called()
+        self.assertIs(pdf_recursos.obter_recursos().logo, logo)
+
+    def test_logo_invalido_gera_pdf_sem_imagem(self):
+        with open(self.logo, "wb") as arquivo:
+            arquivo.write(b"nao e uma imagem")
+        with override_settings(PDF_RECURSOS_VERIFICACAO_SEGUNDOS=0), self.assertLogs("pacientes.pdf_recursos", "WARNING"):
+            pdf = self._pdf(1)
+        self.assertNotIn(b"/Subtype /Image", pdf)
+
+
+class ModeloPrescricaoTests(MidiaTemporariaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.caminho = os.path.join(self.media, "timbrado.pdf")
+        with open(self.caminho, "wb") as arquivo:
+            arquivo.write(self._pdf(["TIMBRADO"]))
+        configuracao = override_settings(PRESCRIPTION_TEMPLATE_PATH=self.caminho, PDF_RECURSOS_VERIFICACAO_SEGUNDOS=60)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+        self.addCleanup(pdf_recursos.limpar_cache_modelo)
+
+    @staticmethod
+    def _pdf(textos):
+        saida = io.BytesIO()
+        c = canvas.Canvas(saida, pagesize=A4)
+        for texto in textos:
+            c.drawString(100, 100, texto)
+            c.showPage()
+        c.save()
+        return saida.getvalue()
+
+    @staticmethod
+    def _textos(pdf_bytes):
+        return [pagina.extract_text() for pagina in PdfReader(io.BytesIO(pdf_bytes)).pages]
+
+    def test_cada_pagina_recebe_o_modelo(self):
+        textos = self._textos(pdf_recursos.aplicar_modelo_prescricao(self._pdf(["Página 1", "Página 2", "Página 3"])))
+
+        self.assertEqual(len(textos), 3)
+        for numero, texto in enumerate(textos, start=1):
+            self.assertEqual(texto.count("TIMBRADO"), 1)
+            self.assertIn(f"Página {numero}", texto)
+
+    def test_leitor_em_cache_nao_e_alterado(self):
+        modelo = pdf_recursos.obter_modelo_prescricao()
+        pagina = modelo.leitor().pages[0]
+        conteudo, chaves = pagina.get_contents().get_data(), sorted(pagina.keys())
+
+        for _ in range(2):
+            pdf_recursos.aplicar_modelo_prescricao(self._pdf(["Página 1", "Página 2"]))
+
+        self.assertIs(pdf_recursos.obter_modelo_prescricao(), modelo)
+        self.assertEqual(pagina.get_contents().get_data(), conteudo)
+        self.assertEqual(sorted(pagina.keys()), chaves)
+
+    def test_leitor_por_thread(self):
+        modelo = pdf_recursos.obter_modelo_prescricao()
+        leitores = []
+        thread = threading.Thread(target=lambda: leitores.append(modelo.leitor()))
+        thread.start()
+        thread.join()
+
+        self.assertIs(modelo.leitor(), modelo.leitor())
+        self.assertIsNot(leitores[0], modelo.leitor())
+
+    def test_modelo_mapeado(self):
+        with override_settings(PRESCRIPTION_TEMPLATE_MMAP=True):
+            textos = self._textos(pdf_recursos.aplicar_modelo_prescricao(self._pdf(["Página 1"])))
+            self.assertIsNotNone(pdf_recursos.obter_modelo_prescricao().arquivo)
+        self.assertIn("TIMBRADO", textos[0])
+
+    def test_modelo_invalido_devolve_pdf_original(self):
+        with open(self.caminho, "wb") as arquivo:
+            arquivo.write(b"nao e um pdf")
+        pdf = self._pdf(["Página 1"])
+        with self.assertLogs("pacientes.pdf_recursos", "WARNING"):
+            self.assertEqual(pdf_recursos.aplicar_modelo_prescricao(pdf), pdf)
+
+
+class GeradorDocumentosTests(TestCase):
+    MODELO = {
+        "titulo": "Termo",
+        "blocos": [
+            {"paragrafo": "Declaro que {paciente} foi informado(a) sobre o procedimento.", "depois": 0.5},
+            {"texto": "Fim"},
+        ],
+    }
+
+    def _desenhar(self, nome, definicao=None):
+        c = mock.MagicMock()
+        modelo = gerador_documentos.compilar("termo", definicao or self.MODELO)
+        modelo.desenhar(c, {"paciente": nome, "cpf": "", "data": "01/01/2026"})
+        linhas = [chamada.args[0] for chamada in c.beginText.return_value.textLine.call_args_list]
+        fim = next(chamada.args[1] for chamada in c.drawString.call_args_list if chamada.args[2] == "Fim")
+        return linhas, fim
+
+    def test_paragrafo_com_campos_quebra_depois_do_preenchimento(self):
+        largura = A4[0] - 4 * cm
+        curto, fim_curto = self._desenhar("Ana")
+        longo, fim_longo = self._desenhar("Maria " * 20 + "Silva")
+
+        self.assertEqual(len(curto), 1)
+        self.assertGreater(len(longo), 1)
+        for linha in longo:
+            self.assertLessEqual(stringWidth(linha, "Helvetica", 11), largura)
+        self.assertEqual(" ".join(longo), "Declaro que " + "Maria " * 20 + "Silva foi informado(a) sobre o procedimento.")
+        # O que vem depois desce junto com as linhas a mais
+        self.assertAlmostEqual(fim_curto - fim_longo, 14 * (len(longo) - 1))
+
+    def test_palavra_maior_que_a_linha_e_cortada(self):
+        linhas, _ = self._desenhar("X" * 200)
+        self.assertEqual("".join(linhas).count("X"), 200)
+        for linha in linhas:
+            self.assertLessEqual(stringWidth(linha, "Helvetica", 11), A4[0] - 4 * cm)
+
+    def test_paragrafo_sem_campos_ja_sai_quebrado_da_compilacao(self):
+        modelo = gerador_documentos.compilar("termo", {"titulo": "T", "blocos": [{"paragrafo": "palavra " * 60}]})
+        (op,) = [op for op in modelo.operacoes if op[0] in ("linhas", "paragrafo")]
+        self.assertEqual(op[0], "linhas")
+        self.assertGreater(len(op[3]), 1)
+
+    def test_definicao_invalida(self):
+        for definicao in (
+            {"titulo": "T", "blocos": [{"texto": "{desconhecido}"}]},
+            {"titulo": "T", "blocos": [{"texto": "x", "fonte": "Inexistente"}]},
+            {"titulo": "T", "blocos": [{"imagem": "logo.png"}]},
+        ):
+            with self.subTest(definicao=definicao), self.assertRaises(ValueError):
+                gerador_documentos.compilar("termo", definicao)
+
+    def test_modelos_padrao_com_nome_longo(self):
+        nome = "Maria " * 20 + "Silva"
+        modelos = gerador_documentos.obter_modelos()
+        self.assertIn("termo-hipertensao", modelos)
+        for tipo, modelo in modelos.items():
+            with self.subTest(tipo=tipo):
+                pdf = gerador_documentos.gerar_pdf(modelo, gerador_documentos.DadosPaciente(1, nome, "123.456.789-00"))
+                self.assertTrue(pdf.startswith(b"%PDF"))
+
+
+class GerarLoteTests(MidiaTemporariaMixin, TestCase):
+    URL = "/api/pacientes/documentos/gerar-lote/"
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser("admin", "admin@example.com", "x"))
+        self.pacientes = [
+            Paciente.objects.create(nome=f"Paciente {i}", cpf=f"000.000.000-0{i}") for i in range(3)
+        ]
+        for paciente in self.pacientes[:2]:
+            Anamnese.objects.create(paciente=paciente, possui_hipertensao=True)
+
+    def test_agenda_o_lote_e_processa_na_fila(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            resposta = self.client.post(
+                self.URL, {"tipo": "termo-hipertensao", "condicao": "possui_hipertensao"}, format="json"
+            )
+
+        self.assertEqual(resposta.status_code, 202)
+        self.assertEqual(resposta.data["total"], 2)
+        self.assertTrue(all(g["status"] == "pendente" for g in resposta.data["geracoes"]))
+        geracoes = GeracaoDocumento.objects.order_by("paciente_id")
+        self.assertEqual([g.paciente_id for g in geracoes], [p.pk for p in self.pacientes[:2]])
+        for geracao in geracoes:
+            self.assertEqual(geracao.status, GeracaoDocumento.Status.CONCLUIDO)
+            self.assertEqual(geracao.documento.paciente_id, geracao.paciente_id)
+
+    def test_limite_de_pacientes(self):
+        with override_settings(DOCUMENTOS_LOTE_MAX_PACIENTES=2):
+            ids = [p.pk for p in self.pacientes]
+            resposta = self.client.post(self.URL, {"tipo": "receita-basica", "pacientes": ids[:2]}, format="json")
+            self.assertEqual(resposta.status_code, 202)
+            resposta = self.client.post(self.URL, {"tipo": "receita-basica", "pacientes": ids}, format="json")
+
+        self.assertEqual(resposta.status_code, 400)
+        self.assertEqual(resposta.data["limite"], 2)
+
+    def test_fila_cheia(self):
+        with mock.patch("pacientes.geracoes.Fila.tem_vaga", return_value=False):
+            resposta = self.client.post(self.URL, {"tipo": "receita-basica", "pacientes": [self.pacientes[0].pk]}, format="json")
+
+        self.assertEqual(resposta.status_code, 503)
+        self.assertFalse(GeracaoDocumento.objects.exists())
+
+    def test_exige_permissao(self):
+        self.client.force_authenticate(None)
+        resposta = self.client.post(self.URL, {"tipo": "receita-basica", "pacientes": [self.pacientes[0].pk]}, format="json")
+
+        self.assertEqual(resposta.status_code, 401)
+        self.assertFalse(GeracaoDocumento.objects.exists())
+
+
+class ImportadorContatosTests(TestCase):
+    """Upsert em lotes do CSV de convites pelo ORM (caminho do SQLite)."""
+
+    COLUNAS = {"nome": 0, "cpf": 1, "telefone": 2, "data_nascimento": 3, "idade": 4, "origem": 5}
+
+    def _importar(self, linhas, chunk_size=1000, origem="planilha"):
+        self.lotes = []
+        importador = ImportadorContatos(
+            origem, self.COLUNAS, len(self.COLUNAS), chunk_size=chunk_size,
+            ao_progresso=lambda imp: self.lotes.append(dict(imp.stats)),
+        )
+        importador.importar(enumerate(linhas, start=2))
+        return importador
+
+    def test_linhas_repetidas_no_arquivo_viram_um_contato(self):
+        importador = self._importar([
+            ["Ana", "", "(11) 90000-0001", "", "", ""],
+            ["Ana Souza", "111.111.111-11", "11900000001", "", "", ""],
+            ["Ana Souza", "111.111.111-11", "11900000001", "", "", ""],
+        ])
+
+        contato = ConviteContato.objects.get()
+        self.assertEqual((contato.nome, contato.cpf_normalizado), ("Ana Souza", "11111111111"))
+        self.assertEqual(contato.origem, "planilha")
+        self.assertEqual(
+            importador.stats,
+            {"total": 3, "importados": 1, "atualizados": 1, "ignorados": 1, "erros": 0},
+        )
+
+    def test_atualiza_contatos_existentes(self):
+        existente = ConviteContato.objects.create(nome="Bia", telefone="11900000002", origem="site")
+        igual = ConviteContato.objects.create(nome="Caio", telefone="11900000003", origem="site")
+
+        importador = self._importar([
+            ["Beatriz", "222.222.222-22", "11900000002", "01/02/1990", "", ""],
+            ["Caio", "", "11900000003", "", "", ""],
+        ])
+
+        existente.refresh_from_db()
+        self.assertEqual(existente.nome, "Beatriz")
+        self.assertEqual(existente.cpf_normalizado, "22222222222")
+        self.assertEqual(str(existente.data_nascimento), "1990-02-01")
+        self.assertIsNotNone(existente.idade)
+        # Origem já preenchida não é trocada pela origem padrão da importação
+        self.assertEqual(existente.origem, "site")
+        igual.refresh_from_db()
+        self.assertEqual(igual.nome, "Caio")
+        self.assertEqual((importador.stats["atualizados"], importador.stats["ignorados"]), (1, 1))
+
+    def test_troca_de_telefones_entre_contatos_no_mesmo_lote(self):
+        a = ConviteContato.objects.create(nome="Ana", cpf="111.111.111-11", telefone="11900000001")
+        b = ConviteContato.objects.create(nome="Bia", cpf="222.222.222-22", telefone="11900000002")
+
+        importador = self._importar([
+            ["Ana", "111.111.111-11", "11900000009", "", "", ""],
+            ["Bia", "222.222.222-22", "11900000001", "", "", ""],
+        ])
+
+        a.refresh_from_db()
+        b.refresh_from_db()
+        self.assertEqual((a.telefone_normalizado, b.telefone_normalizado), ("11900000009", "11900000001"))
+        self.assertEqual(importador.stats["erros"], 0)
+
+    def test_chave_de_outro_contato_e_erros_de_linha(self):
+        ConviteContato.objects.create(nome="Ana", cpf="111.111.111-11", telefone="11900000001")
+        ConviteContato.objects.create(nome="Bia", telefone="11900000002")
+
+        importador = self._importar([
+            ["Bia", "111.111.111-11", "11900000002", "", "", ""],
+            ["", "", "11900000004", "", "", ""],
+            ["Davi", "", "", "", "", ""],
+            ["Eva", "", "sem número", "", "", ""],
+            ["", "", "", "", "", ""],
+        ])
+
+        self.assertEqual(importador.stats["erros"], 4)
+        self.assertEqual(
+            importador.erros,
+            [
+                "Linha 2: telefone '11900000002' já pertence a outro contato.",
+                "Linha 3: campo 'nome' vazio.",
+                "Linha 4: campo 'telefone' vazio.",
+                "Linha 5: telefone inválido 'sem número'.",
+            ],
+        )
+        self.assertEqual(ConviteContato.objects.count(), 2)
+
+    def test_arquivo_maior_que_o_lote(self):
+        linhas = [[f"Contato {i:02d}", "", f"119000000{i:02d}", "", "", ""] for i in range(10)]
+        # Repetida em outro lote: o contato já gravado é atualizado, não duplicado
+        linhas.append(["Contato Zero", "", "11900000000", "", "", "indicacao"])
+
+        importador = self._importar(linhas, chunk_size=3)
+
+        self.assertEqual(len(self.lotes), 4)
+        self.assertEqual([lote["total"] for lote in self.lotes], [3, 6, 9, 11])
+        self.assertEqual(ConviteContato.objects.count(), 10)
+        self.assertEqual(
+            ConviteContato.objects.filter(telefone_normalizado="11900000000").values_list("nome", "origem").get(),
+            ("Contato Zero", "indicacao"),
+        )
+        self.assertEqual((importador.stats["importados"], importador.stats["atualizados"]), (10, 1))
+
+
+class AbrirCsvTests(TestCase):
+    """Leitura em streaming do CSV: decodificação por blocos, BOM e cabeçalho."""
+
+    def _ler(self, chunks):
+        headers, colunas, desconhecidas, linhas = abrir_csv(iter(chunks))
+        return headers, colunas, desconhecidas, list(linhas)
+
+    @staticmethod
+    def _em_blocos(dados, tamanho):
+        return [dados[i:i + tamanho] for i in range(0, len(dados), tamanho)]
+
+    def test_bom_utf8_e_acento_dividido_entre_blocos(self):
+        dados = "nome;telefone\nJoão Conceição;11900000001\n".encode("utf-8-sig")
+
+        # Blocos de 1 byte: o BOM e cada caractere de 2 bytes ficam partidos
+        headers, colunas, _, linhas = self._ler(self._em_blocos(dados, 1))
+
+        self.assertEqual(headers, ["nome", "telefone"])
+        self.assertEqual((colunas["nome"], colunas["telefone"]), (0, 1))
+        self.assertEqual(linhas, [(2, ["João Conceição", "11900000001"])])
+
+    def test_latin1_no_meio_do_arquivo(self):
+        inicio = "nome,telefone\n" + "".join(f"Contato {i},119000{i:05d}\n" for i in range(200))
+        dados = inicio.encode("ascii") + "José Ângelo,11999999999\n".encode("latin-1")
+
+        _, _, _, linhas = self._ler(self._em_blocos(dados, 512))
+
+        self.assertEqual(len(linhas), 201)
+        self.assertEqual(linhas[-1], (202, ["José Ângelo", "11999999999"]))
+
+    def test_arquivo_maior_que_a_amostra(self):
+        def blocos():
+            yield b"nome\ttelefone\torigem\n"
+            for i in range(20000):
+                yield f"Contato {i}\t11{i:09d}\tsite\n".encode()
+
+        headers, _, _, linhas = abrir_csv(blocos())
+
+        self.assertEqual(headers, ["nome", "telefone", "origem"])
+        self.assertEqual(sum(1 for _ in linhas), 20000)
+
+    def test_colunas_desconhecidas(self):
+        _, _, desconhecidas, _ = self._ler([b"nome,telefone,cpf,data_nascimento,idade,origem,convenio\n"])
+
+        self.assertEqual(desconhecidas, ["convenio"])
+
+    def test_arquivos_recusados(self):
+        for dados, detalhe in (
+            (b"", "O arquivo CSV está vazio."),
+            (b"\n\n", "O arquivo CSV está vazio."),
+            (b"nome\nAna\n", "Colunas obrigatórias ausentes no cabeçalho do CSV."),
+        ):
+            with self.subTest(dados=dados):
+                with self.assertRaises(CSVInvalido) as erro:
+                    self._ler([dados])
+                self.assertEqual(erro.exception.payload["detail"], detalhe)
+
+    def test_importacao_pela_api_em_latin1(self):
+        client = APIClient()
+        dados = "nome;telefone;origem\nJosé;(11) 90000-0001;\nMárcia;11 90000-0002;feira\n".encode("latin-1")
+
+        resposta = client.post(
+            "/api/pacientes/convites/importacoes/",
+            {"arquivo": SimpleUploadedFile("contatos.csv", dados, content_type="text/csv")},
+            format="multipart",
+        )
+
+        self.assertEqual(resposta.status_code, 201, resposta.data)
+        self.assertEqual(resposta.data["importados"], 2)
+        self.assertEqual(
+            list(ConviteContato.objects.order_by("nome").values_list("nome", "origem")),
+            [("José", "Importação CSV"), ("Márcia", "feira")],
+        )
+
+
+class CriarImportadorTests(TestCase):
+    def test_orm_fora_do_postgresql_ou_com_copy_desligado(self):
+        colunas = ImportadorContatosTests.COLUNAS
+        with self.settings(IMPORTACAO_COPY_POSTGRES=False):
+            self.assertIs(type(criar_importador("csv", colunas, 6)), ImportadorContatos)
+        esperado = ImportadorContatosCopy if connection.vendor == "postgresql" else ImportadorContatos
+        self.assertIs(type(criar_importador("csv", colunas, 6)), esperado)
+
+
+@skipUnless(connection.vendor == "postgresql", "COPY só existe no PostgreSQL.")
+class ImportadorContatosCopyTests(TestCase):
+    """O caminho COPY + INSERT ... ON CONFLICT chega ao mesmo resultado do ORM."""
+
+    LINHAS = [
+        ["Ana Souza", "111.111.111-11", "11900000001", "01/02/1990", "", ""],
+        ["Bia", "", "11900000002", "", "", "feira"],
+        ["Beatriz", "", "11900000002", "", "", ""],  # repetida no arquivo: vai pelo ORM
+        ["Caio", "", "11900000003", "", "", ""],  # existente sem mudança
+        ["Davi Novo", "444.444.444-44", "11900000099", "", "", ""],  # casado só pelo CPF
+        ["Eva", "111.111.111-11", "11900000005", "", "", ""],  # CPF de outra linha
+    ]
+
+    def _importar(self, classe):
+        ConviteContato.objects.create(nome="Caio", telefone="11900000003", origem="site")
+        ConviteContato.objects.create(nome="Davi", cpf="444.444.444-44", telefone="11900000004", origem="site")
+        importador = classe("planilha", ImportadorContatosTests.COLUNAS, 6)
+        importador.importar(enumerate(self.LINHAS, start=2))
+        contatos = list(
+            ConviteContato.objects.order_by("telefone_normalizado").values_list(
+                "nome", "cpf_normalizado", "telefone_normalizado", "data_nascimento", "idade", "origem"
+            )
+        )
+        return importador.stats, importador.erros, contatos
+
+    def test_mesmo_resultado_do_orm(self):
+        with transaction.atomic():
+            esperado = self._importar(ImportadorContatos)
+            transaction.set_rollback(True)
+
+        self.assertEqual(self._importar(ImportadorContatosCopy), esperado)
+
+
+class BenchmarkEnvioTests(TestCase):
+    def test_usa_dados_proprios_e_apaga_ao_final(self):
+        real = ConviteContato.objects.create(nome="Real", telefone="11900000001", origem="benchmark")
+
+        call_command("benchmark_envio", contatos=5, chunk=2, stdout=io.StringIO())
+
+        self.assertEqual(list(ConviteContato.objects.all()), [real])
+        self.assertEqual(real.mensagens.count(), 0)
+        self.assertFalse(ConviteCampanha.objects.exists())
+
+    def test_apaga_mesmo_com_erro(self):
+        with mock.patch("pacientes.management.commands.benchmark_envio.registrar_envio", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                call_command("benchmark_envio", contatos=3, stdout=io.StringIO())
+
+        self.assertFalse(ConviteContato.objects.exists())
+        self.assertFalse(ConviteMensagem.objects.exists())
+        self.assertFalse(ConviteCampanha.objects.exists())
+
+
+class EnvioPorFiltroTests(TestCase):
+    """Campanhas por filtro atingem só os contatos filtrados."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.ana = ConviteContato.objects.create(nome="Ana", telefone="11900000001", origem="feira")
+        self.bia = ConviteContato.objects.create(
+            nome="Bia", telefone="11900000002", origem="feira", status=ConviteContato.Status.ENVIADO
+        )
+        self.caio = ConviteContato.objects.create(nome="Caio", cpf="123.456.789-00", telefone="21900000003", origem="site")
+        entregar = mock.patch("pacientes.views.agendar_entrega")
+        entregar.start()
+        self.addCleanup(entregar.stop)
+
+    def _enviar(self, filtros):
+        return self.client.post(
+            "/api/pacientes/convites/enviar/", {"filtros": filtros, "mensagem": "Olá {nome}"}, format="json"
+        )
+
+    def _destinatarios(self, resposta):
+        return set(ConviteMensagem.objects.filter(campanha_id=resposta.data["campanha"]).values_list("contato", flat=True))
+
+    def test_filtros_vazios_sao_recusados(self):
+        for filtros in ({}, {"search": "", "origem": ""}, {"search": "   "}):
+            with self.subTest(filtros=filtros):
+                resposta = self._enviar(filtros)
+                self.assertEqual(resposta.status_code, 400)
+                self.assertIn("filtros", resposta.data)
+        self.assertFalse(ConviteMensagem.objects.exists())
+        self.assertFalse(ConviteCampanha.objects.exists())
+
+    def test_envia_so_para_os_filtrados(self):
+        casos = [
+            ({"origem": "feira"}, {self.ana.pk, self.bia.pk}),
+            ({"origem": "feira", "status": "novo"}, {self.ana.pk}),
+            ({"search": "caio", "origem": ""}, {self.caio.pk}),
+            ({"search": "(21) 9"}, {self.caio.pk}),
+            ({"search": "123.456"}, {self.caio.pk}),
+        ]
+        for filtros, esperado in casos:
+            with self.subTest(filtros=filtros):
+                resposta = self._enviar(filtros)
+                self.assertEqual(resposta.status_code, 202, resposta.data)
+                self.assertEqual(resposta.data["enfileirados"], len(esperado))
+                self.assertEqual(self._destinatarios(resposta), esperado)
+
+    def test_filtro_sem_contatos(self):
+        resposta = self._enviar({"origem": "outdoor"})
+
+        self.assertEqual(resposta.status_code, 404)
+        self.assertFalse(ConviteCampanha.objects.exists())
+
+
+class _TransporteInstavel(Transporte):
+    """Falha temporariamente `falhas` vezes por telefone e depois entrega."""
+
+    def __init__(self, falhas, temporaria=True):
+        self.falhas = falhas
+        self.temporaria = temporaria
+        self.tentativas = {}
+        self.enviadas = []
+
+    def enviar(self, telefone, texto):
+        self.tentativas[telefone] = self.tentativas.get(telefone, 0) + 1
+        if self.tentativas[telefone] <= self.falhas:
+            raise FalhaEnvio("Gateway indisponível.", temporaria=self.temporaria)
+        self.enviadas.append((telefone, texto))
+
+
+class EntregaTests(TestCase):
+    """Fila de entrega: reserva, reagendamento das falhas temporárias e limite de tentativas."""
+
+    def setUp(self):
+        self.contato = ConviteContato.objects.create(nome="Ana Souza", telefone="11900000001")
+        campanha = ConviteCampanha.objects.create(conteudo="Olá {primeiro_nome}!")
+        self.mensagem = ConviteMensagem.objects.create(contato=self.contato, campanha=campanha)
+        # Sem espera do limitador de taxa nem timers de retomada de verdade
+        self.bucket = TokenBucket(taxa=1000, capacidade=1000)
+        retomada = mock.patch("pacientes.entrega._agendar_retomada")
+        self.retomada = retomada.start()
+        self.addCleanup(retomada.stop)
+
+    def _entregar(self, transporte, **opcoes):
+        opcoes.setdefault("max_tentativas", 3)
+        opcoes.setdefault("backoff_base", 60)
+        with mock.patch("pacientes.entrega.time.sleep", side_effect=AssertionError("dormiu")):
+            stats = Entregador(transporte=transporte, bucket=self.bucket, concorrencia=2, **opcoes).executar()
+        self.mensagem.refresh_from_db()
+        self.contato.refresh_from_db()
+        return stats
+
+    def _vencer(self):
+        ConviteMensagem.objects.update(proxima_tentativa=timezone.now() - timedelta(seconds=1))
+
+    def test_entrega_com_texto_da_campanha(self):
+        transporte = _TransporteInstavel(falhas=0)
+
+        stats = self._entregar(transporte)
+
+        self.assertEqual(stats, {"enviados": 1, "falhas": 0, "reagendadas": 0})
+        self.assertEqual(transporte.enviadas, [("11900000001", "Olá Ana!")])
+        self.assertEqual((self.mensagem.status, self.mensagem.tentativas), (ConviteMensagem.Status.ENVIADO, 1))
+        self.assertIsNotNone(self.mensagem.enviado_em)
+        self.assertEqual(self.contato.status, ConviteContato.Status.ENVIADO)
+
+    def test_falha_temporaria_e_reagendada_sem_dormir(self):
+        transporte = _TransporteInstavel(falhas=2)
+
+        antes = timezone.now()
+        stats = self._entregar(transporte)
+        self.assertEqual(stats["reagendadas"], 1)
+        self.assertEqual(self.mensagem.status, ConviteMensagem.Status.PENDENTE)
+        self.assertEqual((self.mensagem.tentativas, self.mensagem.erro), (1, "Gateway indisponível."))
+        # backoff_base de 60 s (com até 25% de jitter) a partir da falha
+        self.assertGreaterEqual(self.mensagem.proxima_tentativa, antes + timedelta(seconds=60))
+        self.assertLessEqual(self.mensagem.proxima_tentativa, timezone.now() + timedelta(seconds=75))
+        self.assertEqual(self.contato.status, ConviteContato.Status.NOVO)
+
+        # Ainda não venceu: a próxima execução não a reserva
+        self.assertEqual(self._entregar(transporte)["reagendadas"], 0)
+        self.assertEqual(transporte.tentativas["11900000001"], 1)
+
+        self._vencer()
+        self._entregar(transporte)
+        self.assertEqual(self.mensagem.tentativas, 2)
+        primeira_espera = self.mensagem.proxima_tentativa - timezone.now()
+        self.assertGreater(primeira_espera, timedelta(seconds=110))
+
+        self._vencer()
+        self._entregar(transporte)
+        self.assertEqual((self.mensagem.status, self.mensagem.tentativas), (ConviteMensagem.Status.ENVIADO, 3))
+        self.assertIsNone(self.mensagem.proxima_tentativa)
+        self.assertEqual(self.contato.status, ConviteContato.Status.ENVIADO)
+
+    def test_desiste_depois_do_maximo_de_tentativas(self):
+        transporte = _TransporteInstavel(falhas=10)
+
+        for _ in range(3):
+            self._vencer()
+            self._entregar(transporte)
+
+        self.assertEqual((self.mensagem.status, self.mensagem.tentativas), (ConviteMensagem.Status.FALHA, 3))
+        self.assertEqual(self.contato.status, ConviteContato.Status.FALHA)
+        self._vencer()
+        self.assertEqual(self._entregar(transporte), {"enviados": 0, "falhas": 0, "reagendadas": 0})
+
+    def test_falha_definitiva_nao_repete(self):
+        stats = self._entregar(_TransporteInstavel(falhas=1, temporaria=False))
+
+        self.assertEqual(stats["falhas"], 1)
+        self.assertEqual((self.mensagem.status, self.mensagem.tentativas), (ConviteMensagem.Status.FALHA, 1))
+
+    def test_entregar_pendentes_agenda_a_retomada(self):
+        with mock.patch("pacientes.entrega.obter_transporte", return_value=_TransporteInstavel(falhas=1)):
+            with mock.patch("pacientes.entrega._obter_bucket", return_value=self.bucket):
+                stats = entregar_pendentes()
+
+        self.assertEqual(stats["reagendadas"], 1)
+        self.retomada.assert_called_once_with()
+
+    def test_transporte_fake_recusado_sem_debug(self):
+        with mock.patch("pacientes.entrega._transporte", None):
+            with self.settings(DEBUG=False, MENSAGENS_TRANSPORTE="pacientes.entrega.TransporteFake"):
+                with self.assertRaises(ImproperlyConfigured):
+                    entregar_pendentes()
+
+        self.mensagem.refresh_from_db()
+        self.assertEqual(self.mensagem.status, ConviteMensagem.Status.PENDENTE)
+
+    def test_enviar_usa_a_fila_propria(self):
+        fila = mock.Mock()
+        with mock.patch("pacientes.entrega.fila_mensagens", return_value=fila):
+            resposta = APIClient().post(
+                "/api/pacientes/convites/enviar/",
+                {"contatos": [self.contato.pk], "mensagem": "Oi"},
+                format="json",
+            )
+
+        self.assertEqual(resposta.status_code, 202, resposta.data)
+        fila.enfileirar.assert_called_once_with(entregar_pendentes)
+        # Fila cheia: já há uma entrega esperando, que vai pegar as mensagens novas
+        fila.enfileirar.side_effect = FilaCheia(mock.Mock(nome="mensagens", limite=2))
+        with mock.patch("pacientes.entrega.fila_mensagens", return_value=fila):
+            agendar_entrega()
+
+
+class TokenBucketTests(TestCase):
+    def test_rajada_e_depois_a_taxa(self):
+        relogio = {"agora": 100.0}
+        esperas = []
+
+        def dormir(segundos):
+            esperas.append(segundos)
+            relogio["agora"] += segundos
+
+        with mock.patch("pacientes.entrega.time.monotonic", side_effect=lambda: relogio["agora"]), \
+                mock.patch("pacientes.entrega.time.sleep", side_effect=dormir):
+            bucket = TokenBucket(taxa=2, capacidade=3)
+            for _ in range(5):
+                bucket.consumir()
+
+        # 3 fichas de rajada e depois uma a cada 0,5 s
+        self.assertEqual(esperas, [0.5, 0.5])
+        self.assertEqual(relogio["agora"], 101.0)
+
+
+class ConviteMensagemApiTests(TestCase):
+    def test_lista_com_conteudo_renderizado_sem_n_mais_1(self):
+        campanha = ConviteCampanha.objects.create(conteudo="Olá {primeiro_nome}, venha nos visitar!")
+        for i, nome in enumerate(["Ana Souza", "Bia Lima", "Caio Melo"]):
+            contato = ConviteContato.objects.create(nome=nome, telefone=f"1190000000{i}")
+            ConviteMensagem.objects.create(contato=contato, campanha=campanha)
+        client = APIClient()
+
+        # COUNT da paginação + uma consulta com contato e campanha, seja qual for o número de mensagens
+        with self.assertNumQueries(2):
+            resposta = client.get(f"/api/pacientes/convites/mensagens/?campanha={campanha.pk}")
+
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(
+            sorted(item["conteudo"] for item in resposta.data["results"]),
+            ["Olá Ana, venha nos visitar!", "Olá Bia, venha nos visitar!", "Olá Caio, venha nos visitar!"],
+        )
+
+
+class BuscaConvitesTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser("admin", "admin@example.com", "x"))
+        ConviteContato.objects.create(nome="Maria Souza", cpf="123.456.789-00", telefone="(11) 98765-4321")
+        ConviteContato.objects.create(nome="João Lima", cpf="987.654.321-00", telefone="(21) 91234-5678")
+        ConviteContato.objects.create(nome="Ana Maria", telefone="11 3333-4444", origem="planilha")
+
+    def _buscar(self, **params):
+        resposta = self.client.get("/api/pacientes/convites/", params)
+        self.assertEqual(resposta.status_code, 200)
+        return sorted(item["nome"] for item in resposta.data["results"])
+
+    def test_busca_por_nome(self):
+        self.assertEqual(self._buscar(search="maria"), ["Ana Maria", "Maria Souza"])
+
+    def test_busca_por_digitos_ignora_formatacao(self):
+        self.assertEqual(self._buscar(search="(11) 9876"), ["Maria Souza"])
+        self.assertEqual(self._buscar(search="11"), ["Ana Maria", "Maria Souza"])
+        self.assertEqual(self._buscar(search="987.654"), ["João Lima"])
+
+    def test_busca_combina_com_outros_filtros(self):
+        self.assertEqual(self._buscar(search="maria", origem="planilha"), ["Ana Maria"])
+
+
+@skipUnless(connection.vendor == "postgresql", "Plano de consulta verificado só no PostgreSQL.")
+class BuscaConvitesPlanoTests(TestCase):
+    """A busca da tela de convites precisa ser servida por índices, não por seq scan."""
+
+    tabela = ConviteContato._meta.db_table
+
+    def _plano(self, **params):
+        # Mesmo queryset da listagem `/convites/?search=`: get_queryset + filter backends
+        view = ConviteContatoViewSet()
+        view.setup(APIRequestFactory().get("/api/pacientes/convites/", params))
+        view.request = view.initialize_request(view.request)
+        view.action = "list"
+        view.format_kwarg = None
+        qs = view.filter_queryset(view.get_queryset())
+        # Com seq scan desligado o planner só recorre a ele se nenhum índice
+        # servir a consulta; assim o plano não depende do tamanho da tabela
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+            return qs.explain()
+
+    def test_busca_por_nome_usa_indice_trigram(self):
+        plano = self._plano(search="maria")
+        self.assertIn("pacientes_convitecontato_nome_trgm", plano)
+        self.assertNotIn(f"Seq Scan on {self.tabela}", plano)
+
+    def test_busca_por_digitos_usa_indices(self):
+        for termo in ("(11) 9876", "123.456"):
+            with self.subTest(termo=termo):
+                plano = self._plano(search=termo)
+                self.assertIn("pacientes_convitecontato_nome_trgm", plano)
+                self.assertIn("_like", plano)
+                self.assertNotIn(f"Seq Scan on {self.tabela}", plano)
+
+
+@skipUnless(connection.vendor == "postgresql", "Particionamento só existe no PostgreSQL.")
+class ParticoesMensagensTests(TestCase):
+    def setUp(self):
+        self.contato = ConviteContato.objects.create(nome="Ana", telefone="11999990000")
+        self.campanha = ConviteCampanha.objects.create(conteudo="Olá!")
+        self.mes_atual = particoes.inicio_do_mes()
+        self.antiga = self._mensagem(particoes.somar_meses(self.mes_atual, -14) + timedelta(days=3))
+        self.recente = self._mensagem(self.mes_atual + timedelta(hours=5))
+
+    def _mensagem(self, criado_em):
+        mensagem = ConviteMensagem.objects.create(contato=self.contato, campanha=self.campanha)
+        ConviteMensagem.objects.filter(pk=mensagem.pk).update(criado_em=criado_em)
+        # Checagens de FK adiadas pendentes impediriam o ALTER/ATTACH na mesma transação do teste
+        connection.check_constraints()
+        return mensagem
+
+    def _particao_de(self, mensagem):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT tableoid::regclass::text FROM {particoes.TABELA} WHERE id = %s", [mensagem.pk]
+            )
+            return cursor.fetchone()[0]
+
+    def _meses(self, *deslocamentos):
+        return [particoes.nome_particao(particoes.somar_meses(self.mes_atual, d)) for d in deslocamentos]
+
+    def test_converter_preserva_dados_e_separa_por_mes(self):
+        particoes.converter(meses_futuros=2)
+
+        self.assertTrue(particoes.esta_particionada())
+        nomes = [nome for nome, _ in particoes.listar_particoes()]
+        self.assertEqual(nomes, self._meses(*range(-14, 3)))
+        self.assertEqual(ConviteMensagem.objects.count(), 2)
+        self.assertEqual(self._particao_de(self.antiga), self._meses(-14)[0])
+        self.assertEqual(self._particao_de(self.recente), self._meses(0)[0])
+        # A sequência continua depois do maior id copiado
+        nova = ConviteMensagem.objects.create(contato=self.contato, campanha=self.campanha)
+        self.assertGreater(nova.pk, self.recente.pk)
+        self.assertEqual(self._particao_de(nova), self._meses(0)[0])
+
+    def test_criar_particoes_futuras_move_linhas_da_particao_padrao(self):
+        particoes.converter(meses_futuros=1)
+        adiantada = self._mensagem(particoes.somar_meses(self.mes_atual, 3) + timedelta(days=1))
+        self.assertEqual(self._particao_de(adiantada), particoes.PARTICAO_PADRAO)
+
+        self.assertEqual(particoes.criar_particoes_futuras(3), self._meses(2, 3))
+        self.assertEqual(self._particao_de(adiantada), self._meses(3)[0])
+        self.assertEqual(particoes.criar_particoes_futuras(3), [])
+
+    def test_desanexar_antigas_arquiva_fora_da_retencao(self):
+        particoes.converter(meses_futuros=1)
+
+        desanexadas = particoes.desanexar_antigas(retencao_meses=12)
+
+        self.assertEqual(desanexadas, self._meses(-14, -13))
+        self.assertEqual(particoes.listar_arquivadas(), desanexadas)
+        self.assertEqual(list(ConviteMensagem.objects.values_list("pk", flat=True)), [self.recente.pk])
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT count(*) FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'f'",
+                [desanexadas[0]],
+            )
+            self.assertEqual(cursor.fetchone()[0], 0)
+        # Sem as FKs no arquivo, o contato pode ser excluído normalmente
+        self.contato.delete()
+        self.assertEqual(particoes.desanexar_antigas(retencao_meses=12), [])
+
+
+class _falhar_update:
+    """Faz o `QuerySet.update` de `modelo` levantar RuntimeError (simula erro no banco)."""
+
+    def __init__(self, modelo):
+        self.modelo = modelo
+
+    def __enter__(self):
+        original = type(self.modelo.objects.all()).update
+        modelo = self.modelo
+
+        def update(qs, **kwargs):
+            if qs.model is modelo:
+                raise RuntimeError("falha no UPDATE")
+            return original(qs, **kwargs)
+
+        self.patch = mock.patch.object(type(self.modelo.objects.all()), "update", update)
+        self.patch.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.patch.stop()
+        return False
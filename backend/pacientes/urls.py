@@ -1,3 +1,4 @@
+from django.urls import path
 from rest_framework.routers import DefaultRouter
 from . import views
 
@@ -6,12 +7,22 @@ app_name = "pacientes"
 router = DefaultRouter()
 # IMPORTANTE: registre 'anamneses' ANTES de '' para evitar que o detalhe de Paciente
 # capture a URL '/anamneses/' como se fosse um pk.
+router.register(r'documentos/geracoes', views.GeracaoDocumentoViewSet, basename='geracao-documento')
 router.register(r'documentos', views.DocumentoViewSet, basename='documento')
 router.register(r'anamneses', views.AnamneseViewSet, basename='anamnese')
 router.register(r'prescricoes', views.PrescricaoViewSet, basename='prescricao')
 router.register(r'convites/importacoes', views.ConviteImportacaoViewSet, basename='convite-importacao')
+router.register(r'convites/campanhas', views.ConviteCampanhaViewSet, basename='convite-campanha')
 router.register(r'convites/mensagens', views.ConviteMensagemViewSet, basename='convite-mensagem')
 router.register(r'convites', views.ConviteContatoViewSet, basename='convite-contato')
 router.register(r'', views.PacienteViewSet, basename='paciente')
 
-urlpatterns = router.urls
+urlpatterns = [
+    # Mesmo endpoint da action `documentos.zip/`, também sem a barra final (com as
+    # permissões da action, como o router faria)
+    path(
+        "<int:pk>/documentos.zip",
+        views.PacienteViewSet.as_view({"get": "documentos_zip"}, **views.PacienteViewSet.documentos_zip.kwargs),
+        name="paciente-documentos-zip-arquivo",
+    ),
+] + router.urls
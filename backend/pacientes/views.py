@@ -1,14 +1,19 @@
-import csv
-import io, os
-import re
-from datetime import datetime
-from django.core.files.base import ContentFile
+import os
+from datetime import datetime, timedelta
+from django.core.cache import cache
 from django.db import transaction
-from django.db.models import Q
+from django.db.models import Count, F, Prefetch, Q, Subquery
+from django.db.models.functions import TruncDate
+from django.http import FileResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.text import slugify
 from django.conf import settings
 from rest_framework import viewsets, filters, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import MethodNotAllowed
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework.permissions import DjangoModelPermissions, AllowAny
 from rest_framework.response import Response
@@ -16,7 +21,9 @@ from .models import (
     Paciente,
     Anamnese,
     Documento,
+    GeracaoDocumento,
     Prescricao,
+    ConviteCampanha,
     ConviteContato,
     ConviteImportacao,
     ConviteMensagem,
@@ -25,75 +32,256 @@ from .serializers import (
     PacienteSerializer,
     AnamneseSerializer,
     DocumentoSerializer,
+    GeracaoDocumentoSerializer,
     PrescricaoSerializer,
     ConviteContatoSerializer,
     ConviteImportacaoSerializer,
     ConviteMensagemSerializer,
     ConviteEnvioSerializer,
+    ConviteCampanhaSerializer,
 )
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import cm
-from reportlab.lib.utils import ImageReader
-import copy
+from . import miniaturas
+from .entrega import agendar_entrega
+from .envio import ENVIO_CHUNK_SIZE, registrar_envio
+from .filters import ConviteContatoSearchFilter, PacienteSearchFilter, buscar_contatos
+from .gerador_documentos import obter_modelos
+from .geracao_lote import condicoes_anamnese, filtrar_pacientes
+from .geracoes import agendar as agendar_geracao, agendar_lote, exportar_prescricao, gerar_modelo
+from .importacao import (
+    CSVInvalido,
+    abrir_csv,
+    criar_importador,
+    processar_importacao,
+)
+from core.downloads import LinkAssinado, link_assinado, resposta_arquivo, resposta_zip
+from core.tarefas import FilaCheia, enfileirar
+from core.uploads import UploadConteudoMixin
+from orcamentos.models import Orcamento
+from orcamentos.serializers import OrcamentoSerializer
+from financeiro.models import Debito, DebitoDocumento
+from financeiro.serializers import DebitoSerializer
 
-CSV_EXPECTED_COLUMNS = {"nome", "cpf", "telefone", "data_nascimento", "idade", "origem"}
-CSV_REQUIRED_COLUMNS = {"nome", "telefone"}
-IMPORT_MAX_LOG = 50
+PACIENTES_STATS_CACHE_KEY = "pacientes:stats"
+PRONTUARIO_SECOES = ("anamnese", "documentos", "prescricoes", "orcamentos", "debitos")
+PRONTUARIO_MAX_DOCUMENTOS = 20
+PDF_FILA_CHEIA_RETRY_AFTER = 5  # segundos
 
 
-def _normalizar_digitos(valor: str) -> str:
-    return "".join(ch for ch in (valor or "") if ch.isdigit())
+class PacienteViewSet(viewsets.ModelViewSet):
+    queryset = Paciente.objects.all()
+    serializer_class = PacienteSerializer
+    permission_classes = [DjangoModelPermissions]
+    filter_backends = [PacienteSearchFilter, filters.OrderingFilter]
+    ordering_fields = ["nome", "criado_em", "atualizado_em"]
 
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        cache.delete(PACIENTES_STATS_CACHE_KEY)
 
-def _parse_data(value: str):
-    if not value:
-        return None
-    value = value.strip()
-    if not value:
-        return None
-    formatos = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y")
-    for fmt in formatos:
-        try:
-            return datetime.strptime(value, fmt).date()
-        except ValueError:
-            continue
-    return None
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        cache.delete(PACIENTES_STATS_CACHE_KEY)
 
+    @action(detail=False, methods=["get"], url_path="stats")
+    def stats(self, request):
+        """Contagens de novos pacientes para o dashboard (hoje/semana/mês e séries).
 
-def _calcular_idade(data_nascimento):
-    from django.utils import timezone
+        Um único GROUP BY por dia sobre `criado_em` (janela de 12 meses) alimenta
+        todas as contagens; semanas e meses são agregados em memória a partir dos dias.
+        O resultado fica em cache por `PACIENTES_STATS_CACHE_TTL` segundos.
+        """
+        data = cache.get(PACIENTES_STATS_CACHE_KEY)
+        if data is None:
+            data = self._compute_stats()
+            ttl = getattr(settings, "PACIENTES_STATS_CACHE_TTL", 60)
+            cache.set(PACIENTES_STATS_CACHE_KEY, data, ttl)
+        return Response(data)
+
+    @action(detail=True, methods=["get"], url_path="prontuario")
+    def prontuario(self, request, pk=None):
+        """Paciente com anamnese, documentos recentes, prescrições, orçamentos e débitos.
+
+        `?include=anamnese,documentos` limita as seções retornadas (padrão: todas).
+        O número de queries é fixo: um SELECT do paciente (com anamnese via JOIN)
+        e um por relação prefetchada, independentemente da quantidade de registros.
+        """
+        include = request.query_params.get("include")
+        if include:
+            secoes = {parte.strip() for parte in include.split(",") if parte.strip()}
+            invalidas = secoes - set(PRONTUARIO_SECOES)
+            if invalidas:
+                return Response(
+                    {
+                        "detail": "Seções inválidas em 'include'.",
+                        "secoes_invalidas": sorted(invalidas),
+                        "secoes_suportadas": list(PRONTUARIO_SECOES),
+                    },
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+        else:
+            secoes = set(PRONTUARIO_SECOES)
+
+        qs = Paciente.objects.all()
+        if "anamnese" in secoes:
+            qs = qs.select_related("anamnese")
+        if "documentos" in secoes:
+            recentes = Documento.objects.order_by("-criado_em", "-id")[:PRONTUARIO_MAX_DOCUMENTOS]
+            qs = qs.prefetch_related(Prefetch("documentos", queryset=recentes, to_attr="documentos_recentes"))
+        if "prescricoes" in secoes:
+            qs = qs.prefetch_related(Prefetch("prescricoes", queryset=Prescricao.objects.order_by("-criado_em")))
+        if "orcamentos" in secoes:
+            qs = qs.prefetch_related(
+                Prefetch("orcamentos", queryset=Orcamento.objects.order_by("-criado_em").prefetch_related("itens"))
+            )
+        if "debitos" in secoes:
+            qs = qs.prefetch_related(
+                Prefetch("debitos", queryset=Debito.objects.prefetch_related("itens", "documentos"))
+            )
 
-    if not data_nascimento:
-        return None
-    hoje = timezone.localdate()
-    anos = hoje.year - data_nascimento.year - (
-        (hoje.month, hoje.day) < (data_nascimento.month, data_nascimento.day)
-    )
-    return max(anos, 0)
+        paciente = get_object_or_404(qs, pk=pk)
+        self.check_object_permissions(request, paciente)
+
+        ctx = self.get_serializer_context()
+        data = {"paciente": PacienteSerializer(paciente, context=ctx).data}
+        if "anamnese" in secoes:
+            anamnese = getattr(paciente, "anamnese", None)
+            data["anamnese"] = AnamneseSerializer(anamnese, context=ctx).data if anamnese else None
+        if "documentos" in secoes:
+            data["documentos"] = DocumentoSerializer(paciente.documentos_recentes, many=True, context=ctx).data
+        if "prescricoes" in secoes:
+            data["prescricoes"] = PrescricaoSerializer(paciente.prescricoes.all(), many=True, context=ctx).data
+        if "orcamentos" in secoes:
+            data["orcamentos"] = OrcamentoSerializer(paciente.orcamentos.all(), many=True, context=ctx).data
+        if "debitos" in secoes:
+            data["debitos"] = DebitoSerializer(paciente.debitos.all(), many=True, context=ctx).data
+        return Response(data)
+
+    @action(detail=True, methods=["post"], url_path=r"documentos\.zip/link")
+    def documentos_zip_link(self, request, pk=None):
+        """Link assinado e de curta duração para o ZIP, aberto direto pelo navegador.
+
+        Assim o download vai para o disco em streaming, em vez de passar pelo
+        client com o token e ficar inteiro na memória da página.
+        """
+        paciente = self.get_object()
+        caminho = reverse("pacientes:paciente-documentos-zip-arquivo", kwargs={"pk": paciente.pk})
+        return Response(
+            {
+                "url": link_assinado(request, caminho),
+                "expira_em": getattr(settings, "DOWNLOAD_LINK_VALIDADE_SEGUNDOS", 60),
+            }
+        )
 
+    @action(
+        detail=True,
+        methods=["get"],
+        url_path=r"documentos\.zip",
+        permission_classes=[LinkAssinado | DjangoModelPermissions],
+    )
+    def documentos_zip(self, request, pk=None):
+        """Todos os arquivos do paciente num ZIP (encaminhamento, pedido de dados pela LGPD).
 
-def _normalize_header_text(text: str) -> str:
-    return "".join(ch for ch in (text or "").lower() if ch.isalnum())
+        Documentos (inclusive as prescrições exportadas em PDF) ficam em `documentos/`
+        e os anexos dos débitos em `financeiro/debito_<id>/`. O ZIP é gerado em
+        streaming (ver core.downloads.resposta_zip), sem arquivo temporário. Além
+        do token, aceita o link de `documentos.zip/link/`.
+        """
+        paciente = self.get_object()
+        documentos = paciente.documentos.exclude(arquivo="").order_by("criado_em", "id")
+        anexos = (
+            DebitoDocumento.objects.filter(debito__paciente=paciente)
+            .exclude(arquivo="")
+            .order_by("debito_id", "criado_em", "id")
+        )
+        usados = set()
+        entradas = [
+            (_nome_zip("documentos", doc.nome, doc.arquivo, usados), doc.arquivo, doc.criado_em)
+            for doc in documentos
+        ]
+        entradas += [
+            (_nome_zip(f"financeiro/debito_{anexo.debito_id}", anexo.nome, anexo.arquivo, usados), anexo.arquivo, anexo.criado_em)
+            for anexo in anexos
+        ]
+        return resposta_zip(entradas, f"documentos_{slugify(paciente.nome) or 'paciente'}_{paciente.pk}.zip")
+
+    def _compute_stats(self):
+        hoje = timezone.localdate()
+        inicio_semana = hoje - timedelta(days=7)
+        fim_mes_anterior = hoje.replace(day=1) - timedelta(days=1)
+        inicio_mes = fim_mes_anterior.replace(day=min(hoje.day, fim_mes_anterior.day))
+
+        # Primeiro dia do mês, 11 meses atrás: cobre a série mensal de 12 pontos
+        ano, mes = hoje.year, hoje.month - 11
+        if mes < 1:
+            ano, mes = ano - 1, mes + 12
+        inicio_janela = hoje.replace(year=ano, month=mes, day=1)
+        inicio_dt = timezone.make_aware(datetime.combine(inicio_janela, datetime.min.time()))
+
+        por_dia = dict(
+            Paciente.objects.filter(criado_em__gte=inicio_dt)
+            .annotate(dia=TruncDate("criado_em"))
+            .values("dia")
+            .annotate(total=Count("id"))
+            .order_by()
+            .values_list("dia", "total")
+        )
 
+        serie_dias = []
+        for offset in range(29, -1, -1):
+            dia = hoje - timedelta(days=offset)
+            serie_dias.append({"periodo": dia.isoformat(), "total": por_dia.get(dia, 0)})
+
+        semana_atual = hoje - timedelta(days=hoje.weekday())
+        por_semana = {}
+        por_mes = {}
+        for dia, total in por_dia.items():
+            chave_semana = dia - timedelta(days=dia.weekday())
+            por_semana[chave_semana] = por_semana.get(chave_semana, 0) + total
+            chave_mes = dia.replace(day=1)
+            por_mes[chave_mes] = por_mes.get(chave_mes, 0) + total
+
+        serie_semanas = []
+        for offset in range(11, -1, -1):
+            semana = semana_atual - timedelta(weeks=offset)
+            serie_semanas.append({"periodo": semana.isoformat(), "total": por_semana.get(semana, 0)})
+
+        serie_meses = []
+        ano, mes = inicio_janela.year, inicio_janela.month
+        for _ in range(12):
+            chave = inicio_janela.replace(year=ano, month=mes, day=1)
+            serie_meses.append({"periodo": chave.strftime("%Y-%m"), "total": por_mes.get(chave, 0)})
+            ano, mes = (ano + 1, 1) if mes == 12 else (ano, mes + 1)
+
+        recentes = Paciente.objects.order_by("-criado_em")[:5]
+        return {
+            "total": Paciente.objects.count(),
+            "hoje": por_dia.get(hoje, 0),
+            "semana": sum(t for d, t in por_dia.items() if d >= inicio_semana),
+            "mes": sum(t for d, t in por_dia.items() if d >= inicio_mes),
+            "series": {
+                "dia": serie_dias,
+                "semana": serie_semanas,
+                "mes": serie_meses,
+            },
+            "recentes": PacienteSerializer(recentes, many=True).data,
+            "gerado_em": timezone.now().isoformat(),
+        }
 
-def _strip_decimal_tail(value: str) -> str:
-    value = (value or "").strip()
-    if not value:
-        return value
-    if "." in value:
-        left, _, right = value.partition(".")
-        if right.strip("0") == "":
-            return left
-    return value
 
-class PacienteViewSet(viewsets.ModelViewSet):
-    queryset = Paciente.objects.all()
-    serializer_class = PacienteSerializer
-    permission_classes = [DjangoModelPermissions]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
-    search_fields = ["nome", "cpf", "email", "telefone"]
-    ordering_fields = ["nome", "criado_em", "atualizado_em"]
+def _nome_zip(pasta, nome, arquivo, usados):
+    """Caminho único dentro do ZIP, com a extensão do arquivo armazenado."""
+    base, extensao = os.path.splitext(os.path.basename(arquivo.name))
+    nome = (nome or base).replace("/", "_").replace("\\", "_").strip() or base
+    if not os.path.splitext(nome)[1]:
+        nome += extensao
+    raiz, extensao = os.path.splitext(nome)
+    caminho = f"{pasta}/{nome}"
+    repeticao = 1
+    while caminho.lower() in usados:
+        repeticao += 1
+        caminho = f"{pasta}/{raiz} ({repeticao}){extensao}"
+    usados.add(caminho.lower())
+    return caminho
 
 
 class AnamneseViewSet(viewsets.ModelViewSet):
@@ -135,7 +323,31 @@ class AnamneseViewSet(viewsets.ModelViewSet):
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
 
-class DocumentoViewSet(viewsets.ModelViewSet):
+class GeracaoAssincronaMixin:
+    """Modo assíncrono das actions que geram PDF (`assincrono=1`).
+
+    A resposta é 202 com a `GeracaoDocumento` pendente, acompanhada em
+    `GET /documentos/geracoes/{id}/` até `concluido` (com o `documento`) ou
+    `falha`. Com a fila de PDFs cheia a resposta é 503 com `Retry-After`.
+    """
+
+    def _pedido_assincrono(self, request):
+        assincrono = request.data.get("assincrono") or request.query_params.get("assincrono")
+        return str(assincrono).lower() in ("1", "true", "sim")
+
+    def _agendar_geracao(self, paciente, tipo, prescricao=None):
+        try:
+            geracao = agendar_geracao(paciente, tipo, prescricao)
+        except FilaCheia as exc:
+            return Response(
+                {"detail": "Muitos PDFs em geração; tente novamente em instantes.", "limite": exc.fila.limite},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": str(PDF_FILA_CHEIA_RETRY_AFTER)},
+            )
+        return Response(GeracaoDocumentoSerializer(geracao).data, status=status.HTTP_202_ACCEPTED)
+
+
+class DocumentoViewSet(UploadConteudoMixin, GeracaoAssincronaMixin, viewsets.ModelViewSet):
     queryset = Documento.objects.select_related("paciente").all()
     serializer_class = DocumentoSerializer
     permission_classes = [AllowAny]  # dev: liberar
@@ -153,14 +365,52 @@ class DocumentoViewSet(viewsets.ModelViewSet):
             qs = qs.filter(paciente_id=paciente_id)
         return qs
 
-    # ---------- Modelos prontos (Receita e Pós-operatório) ----------
+    def perform_create(self, serializer):
+        # Arquivo e registro na mesma transação: se o INSERT falhar, a referência ao blob é desfeita
+        with transaction.atomic():
+            super().perform_create(serializer)
+        miniaturas.agendar(serializer.instance)
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            super().perform_update(serializer)
+
+    # Arquivos de paciente: download e miniatura exigem usuário autenticado mesmo com o viewset liberado
+    @action(detail=True, methods=["get"], url_path="download", permission_classes=[DjangoModelPermissions])
+    def download(self, request, pk=None):
+        """Arquivo do documento (ver core.downloads: proxy ou streaming com Range)."""
+        doc = self.get_object()
+        return resposta_arquivo(request, doc.arquivo, nome=doc.nome or None, content_type=doc.content_type or None)
+
+    @action(detail=True, methods=["get"], url_path="miniatura", permission_classes=[DjangoModelPermissions])
+    def miniatura(self, request, pk=None):
+        """Miniatura do documento de imagem (ver miniaturas).
+
+        Gerada após o upload; se ainda não existir (ou saiu do cache), é gerada agora.
+        """
+        doc = self.get_object()
+        caminho = miniaturas.obter_miniatura(doc) if miniaturas.suporta(doc) else None
+        try:
+            arquivo = open(caminho, "rb") if caminho is not None else None
+        except FileNotFoundError:
+            arquivo = None
+        if arquivo is None:
+            return Response({"detail": "Documento sem miniatura."}, status=status.HTTP_404_NOT_FOUND)
+        response = FileResponse(arquivo, content_type=miniaturas.content_type(caminho))
+        # thumb_url leva a versão do arquivo: a mesma URL nunca muda de conteúdo
+        patch_cache_control(response, private=True, max_age=30 * 24 * 3600, immutable=True)
+        return response
+
+    # ---------- Modelos prontos (pacientes/modelos_documentos) ----------
     @action(detail=False, methods=["post"], url_path="gerar", parser_classes=[JSONParser, MultiPartParser, FormParser])
     def gerar(self, request):
         """Gera um PDF a partir de um modelo pronto e salva nos documentos do paciente.
 
         Body esperado (JSON or form):
         - paciente: ID do paciente
-        - tipo: 'receita-basica' | 'pos-operatorio'
+        - tipo: nome de um modelo, ex. 'receita-basica' | 'pos-operatorio' | 'termo-implante'
+          (ver gerador_documentos; tipos inválidos recebem a lista dos suportados)
+        - assincrono: opcional; '1' responde 202 com a geração pendente (ver GeracaoAssincronaMixin)
         """
         paciente_id = request.data.get("paciente")
         tipo = (request.data.get("tipo") or "").strip()
@@ -172,309 +422,89 @@ class DocumentoViewSet(viewsets.ModelViewSet):
         except Paciente.DoesNotExist:
             return Response({"detail": "Paciente não encontrado."}, status=status.HTTP_404_NOT_FOUND)
 
-        builders = {
-            "receita-basica": self._build_receita_basica,
-            "pos-operatorio": self._build_pos_operatorio,
-            "termo-clareamento": self._build_termo_clareamento,
-            "termo-implante": self._build_termo_implante,
-            "termo-exodontia": self._build_termo_exodontia,
-            "termo-hipertensao": self._build_termo_hipertensao,
-        }
-        if tipo not in builders:
+        modelo = obter_modelos().get(tipo)
+        if modelo is None:
             return Response({
                 "detail": "Tipo inválido.",
-                "tipos_suportados": list(builders.keys()),
+                "tipos_suportados": sorted(obter_modelos()),
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        # Monta o PDF em memória
-        pdf_bytes, titulo = builders[tipo](paciente)
-
-        # Salva como Documento do paciente
-        hoje = datetime.now().strftime("%Y-%m-%d")
-        filename = f"{titulo}_{paciente.nome}_{hoje}.pdf".replace(" ", "_")
-        content = ContentFile(pdf_bytes, name=filename)
-        doc = Documento(paciente=paciente)
-        doc.arquivo.save(filename, content, save=True)
-        doc.nome = titulo
-        doc.content_type = "application/pdf"
-        doc.tamanho = len(pdf_bytes)
-        doc.save()
+        if self._pedido_assincrono(request):
+            return self._agendar_geracao(paciente, tipo)
 
+        # Monta o PDF em memória e salva como Documento do paciente
+        doc = gerar_modelo(paciente, modelo)
         data = DocumentoSerializer(doc, context={"request": request}).data
         return Response(data, status=status.HTTP_201_CREATED)
 
-    # ---------- Helpers de geração de PDF ----------
-    def _pdf_canvas(self):
-        buf = io.BytesIO()
-        c = canvas.Canvas(buf, pagesize=A4)
-        return c, buf
-
-    def _finish_pdf(self, c, buf):
-        c.showPage(); c.save()
-        return buf.getvalue()
-
-    def _draw_header(self, c, titulo):
-        w, h = A4
-        # Logo opcional
-        logo_path = getattr(settings, "CLINIC_LOGO_PATH", "") or ""
-        if logo_path:
-            try:
-                p = logo_path
-                if not os.path.isabs(p):
-                    p = os.path.join(settings.BASE_DIR, p)
-                if os.path.exists(p):
-                    img = ImageReader(p)
-                    # desenha no topo direito
-                    c.drawImage(img, w - 5*cm, h - 3*cm, width=3*cm, height=3*cm, preserveAspectRatio=True, mask='auto')
-            except Exception:
-                pass
-
-        c.setFont("Helvetica-Bold", 16)
-        clinic_name = getattr(settings, "CLINIC_NAME", "Clínica Odontológica")
-        c.drawString(2*cm, h - 2*cm, clinic_name)
-        c.setFont("Helvetica", 10)
-        address = getattr(settings, "CLINIC_ADDRESS", "Endereço: —")
-        phone = getattr(settings, "CLINIC_PHONE", "Telefone: —")
-        cro = getattr(settings, "CLINIC_CRO", "CRO: —")
-        c.drawString(2*cm, h - 2.6*cm, f"{address} | {phone} | {cro}")
-        c.setFont("Helvetica-Bold", 14)
-        c.drawString(2*cm, h - 3.4*cm, titulo)
-        c.line(2*cm, h - 3.6*cm, w - 2*cm, h - 3.6*cm)
-
-    def _build_receita_basica(self, paciente):
-        c, buf = self._pdf_canvas()
-        w, h = A4
-        self._draw_header(c, "Receita")
-
-        y = h - 4.5*cm
-        c.setFont("Helvetica", 12)
-        data_txt = datetime.now().strftime("%d/%m/%Y")
-        c.drawString(2*cm, y, f"Paciente: {paciente.nome}")
-        y -= 0.8*cm
-        c.drawString(2*cm, y, f"Data: {data_txt}")
-        y -= 1.2*cm
-
-        c.setFont("Helvetica-Bold", 12)
-        c.drawString(2*cm, y, "Prescrições sugeridas:")
-        y -= 0.8*cm
-        c.setFont("Helvetica", 12)
-        linhas = [
-            "1) Ibuprofeno 400 mg — Tomar 1 comprimido de 8/8h por 3 dias, se dor.",
-            "2) Dipirona 500 mg — Tomar 1 comprimido de 6/6h, se dor/Febre.",
-            "3) Amoxicilina 500 mg — Tomar 1 cápsula de 8/8h por 7 dias (se indicado).",
-            "4) Nimesulida 100 mg — Tomar 1 comprimido de 12/12h por 3 dias, após refeições.",
-        ]
-        for ln in linhas:
-            c.drawString(2.2*cm, y, ln)
-            y -= 0.7*cm
-
-        y -= 1.0*cm
-        c.setFont("Helvetica", 11)
-        c.drawString(2*cm, y, "Observações: Suspender em caso de reação alérgica e procurar orientação médica.")
-
-        # Assinatura
-        y -= 2.0*cm
-        c.line(10*cm, y, w - 2*cm, y)
-        c.setFont("Helvetica", 11)
-        c.drawString(10*cm, y - 0.6*cm, "Assinatura e carimbo do cirurgião-dentista")
-
-        pdf = self._finish_pdf(c, buf)
-        return pdf, "Receita"
-
-    def _build_pos_operatorio(self, paciente):
-        c, buf = self._pdf_canvas()
-        w, h = A4
-        self._draw_header(c, "Orientações Pós-operatórias")
-
-        y = h - 4.5*cm
-        c.setFont("Helvetica", 12)
-        data_txt = datetime.now().strftime("%d/%m/%Y")
-        c.drawString(2*cm, y, f"Paciente: {paciente.nome}")
-        y -= 0.8*cm
-        c.drawString(2*cm, y, f"Data: {data_txt}")
-        y -= 1.2*cm
-
-        c.setFont("Helvetica-Bold", 12)
-        c.drawString(2*cm, y, "Cuidados e orientações:")
-        y -= 0.8*cm
-        c.setFont("Helvetica", 12)
-        itens = [
-            "• Morder a gaze por 30 a 60 minutos após o procedimento.",
-            "• Aplicar gelo externo na região nas primeiras 24–48 horas (intervalos de 20 min).",
-            "• Evitar esforços físicos intensos por 48 horas.",
-            "• Evitar fumar e ingerir bebidas alcoólicas por 72 horas.",
-            "• Manter a higiene oral com escovação suave; evitar bochechos vigorosos no primeiro dia.",
-            "• Dieta pastosa e fria nas primeiras 24 horas; retomar conforme conforto.",
-            "• Tomar as medicações prescritas conforme orientação.",
-            "• Em caso de sangramento contínuo, dor intensa ou febre, contatar a clínica.",
-        ]
-        for ln in itens:
-            c.drawString(2.2*cm, y, ln)
-            y -= 0.7*cm
-
-        y -= 1.0*cm
-        c.setFont("Helvetica", 11)
-        c.drawString(2*cm, y, "Estas orientações auxiliam na recuperação adequada e na redução de desconfortos.")
-
-        # Assinatura
-        y -= 2.0*cm
-        c.line(10*cm, y, w - 2*cm, y)
-        c.setFont("Helvetica", 11)
-        c.drawString(10*cm, y - 0.6*cm, "Assinatura e carimbo do cirurgião-dentista")
-
-        pdf = self._finish_pdf(c, buf)
-        return pdf, "Pos-operatorio"
-
-    # ---------------- Termos de consentimento ----------------
-    def _paragraph(self, c, text, x, y, max_chars=95, leading=14):
-        """Desenha um parágrafo simples quebrando por caracteres (aproximação)."""
-        import textwrap
-        lines = []
-        for para in text.split("\n"):
-            lines.extend(textwrap.wrap(para, max_chars) or [""])
-        textobj = c.beginText()
-        textobj.setTextOrigin(x, y)
-        textobj.setLeading(leading)
-        for ln in lines:
-            textobj.textLine(ln)
-        c.drawText(textobj)
-        return y - leading * (len(lines))
-
-    def _build_termo_clareamento(self, paciente):
-        c, buf = self._pdf_canvas()
-        w, h = A4
-        self._draw_header(c, "Termo de Consentimento — Clareamento Dental")
-
-        y = h - 4.6*cm
-        c.setFont("Helvetica", 12)
-        data_txt = datetime.now().strftime("%d/%m/%Y")
-        y = self._paragraph(c, f"Paciente: {paciente.nome}\nData: {data_txt}", 2*cm, y)
-        y -= 0.6*cm
-
-        c.setFont("Helvetica-Bold", 12)
-        c.drawString(2*cm, y, "Declaração:")
-        y -= 0.6*cm
-        c.setFont("Helvetica", 11)
-        texto = (
-            "Declaro ter sido informado(a) sobre o procedimento de clareamento dental, suas indicações, "
-            "benefícios e possíveis efeitos colaterais, como sensibilidade dentária e irritação gengival. "
-            "Compreendo que os resultados podem variar, que podem ser necessárias aplicações adicionais, e "
-            "que restaurações pré-existentes não alteram sua cor." 
-        )
-        y = self._paragraph(c, texto, 2*cm, y)
-        y -= 0.6*cm
-        y = self._paragraph(c, "Autorizo a realização do procedimento e recebi orientações para cuidados domiciliares.", 2*cm, y)
-
-        # Assinatura
-        y -= 2.0*cm
-        c.line(2*cm, y, 9*cm, y)
-        c.drawString(2*cm, y - 0.5*cm, "Assinatura do(a) paciente ou responsável")
-        c.line(11*cm, y, w - 2*cm, y)
-        c.drawString(11*cm, y - 0.5*cm, "Assinatura do profissional")
-
-        pdf = self._finish_pdf(c, buf)
-        return pdf, "Termo_Clareamento"
-
-    def _build_termo_implante(self, paciente):
-        c, buf = self._pdf_canvas()
-        w, h = A4
-        self._draw_header(c, "Termo de Consentimento — Implante Dentário")
-        y = h - 4.6*cm
-        c.setFont("Helvetica", 12)
-        data_txt = datetime.now().strftime("%d/%m/%Y")
-        y = self._paragraph(c, f"Paciente: {paciente.nome}\nData: {data_txt}", 2*cm, y)
-        y -= 0.6*cm
-        c.setFont("Helvetica-Bold", 12)
-        c.drawString(2*cm, y, "Informações e riscos:")
-        y -= 0.6*cm
-        c.setFont("Helvetica", 11)
-        texto = (
-            "Fui informado(a) sobre o procedimento cirúrgico de implante dentário, etapas de planejamento, "
-            "instalação e reabilitação protética. Reconheço riscos inerentes como infecção, dor, edema, "
-            "alterações de sensibilidade, perda de implante, fraturas e necessidade de procedimentos adicionais "
-            "(ex.: enxerto). Compreendo alternativas terapêuticas e a importância do cuidado pós-operatório." 
-        )
-        y = self._paragraph(c, texto, 2*cm, y)
-        y -= 0.6*cm
-        y = self._paragraph(c, "Autorizo o procedimento e comprometo-me a seguir as orientações recebidas.", 2*cm, y)
-
-        # Assinatura
-        y -= 2.0*cm
-        c.line(2*cm, y, 9*cm, y)
-        c.drawString(2*cm, y - 0.5*cm, "Assinatura do(a) paciente ou responsável")
-        c.line(11*cm, y, w - 2*cm, y)
-        c.drawString(11*cm, y - 0.5*cm, "Assinatura do profissional")
-
-        pdf = self._finish_pdf(c, buf)
-        return pdf, "Termo_Implante"
-
-    def _build_termo_exodontia(self, paciente):
-        c, buf = self._pdf_canvas()
-        w, h = A4
-        self._draw_header(c, "Termo de Consentimento — Exodontia (Extração)")
-        y = h - 4.6*cm
-        c.setFont("Helvetica", 12)
-        data_txt = datetime.now().strftime("%d/%m/%Y")
-        y = self._paragraph(c, f"Paciente: {paciente.nome}\nData: {data_txt}", 2*cm, y)
-        y -= 0.6*cm
-        c.setFont("Helvetica-Bold", 12)
-        c.drawString(2*cm, y, "Informações e riscos:")
-        y -= 0.6*cm
-        c.setFont("Helvetica", 11)
-        texto = (
-            "Compreendo que a exodontia pode envolver riscos como sangramento, infecção, dor, edema, trismo, "
-            "exposição de seio maxilar, alterações de sensibilidade e fraturas. Fui orientado(a) sobre cuidados "
-            "pós-operatórios, uso de medicações e retorno para acompanhamento. Estou ciente de alternativas quando aplicáveis." 
-        )
-        y = self._paragraph(c, texto, 2*cm, y)
-        y -= 0.6*cm
-        y = self._paragraph(c, "Autorizo a extração proposta e seguirei as recomendações fornecidas.", 2*cm, y)
-
-        # Assinatura
-        y -= 2.0*cm
-        c.line(2*cm, y, 9*cm, y)
-        c.drawString(2*cm, y - 0.5*cm, "Assinatura do(a) paciente ou responsável")
-        c.line(11*cm, y, w - 2*cm, y)
-        c.drawString(11*cm, y - 0.5*cm, "Assinatura do profissional")
-
-        pdf = self._finish_pdf(c, buf)
-        return pdf, "Termo_Exodontia"
-
-    def _build_termo_hipertensao(self, paciente):
-        c, buf = self._pdf_canvas()
-        w, h = A4
-        self._draw_header(c, "Termo de Consentimento — Paciente com Hipertensão")
-        y = h - 4.6*cm
-        c.setFont("Helvetica", 12)
-        data_txt = datetime.now().strftime("%d/%m/%Y")
-        y = self._paragraph(c, f"Paciente: {paciente.nome}\nData: {data_txt}", 2*cm, y)
-        y -= 0.6*cm
-        c.setFont("Helvetica-Bold", 12)
-        c.drawString(2*cm, y, "Condições e cuidados:")
-        y -= 0.6*cm
-        c.setFont("Helvetica", 11)
-        texto = (
-            "Declaro estar ciente de minha condição de hipertensão arterial e informei medicações em uso. "
-            "Fui orientado(a) sobre monitoramento de pressão arterial durante o atendimento, possíveis ajustes de "
-            "anestésicos e necessidade de cuidados adicionais. Reconheço que, em situações de pressão elevada, "
-            "o procedimento poderá ser adiado por segurança." 
-        )
-        y = self._paragraph(c, texto, 2*cm, y)
-        y -= 0.6*cm
-        y = self._paragraph(c, "Comprometo-me a seguir as recomendações e manter acompanhamento médico regular.", 2*cm, y)
+    @action(
+        detail=False,
+        methods=["post"],
+        url_path="gerar-lote",
+        parser_classes=[JSONParser, MultiPartParser, FormParser],
+        permission_classes=[DjangoModelPermissions],
+    )
+    def gerar_lote(self, request):
+        """Agenda o mesmo modelo para vários pacientes de uma vez (ver geracoes.agendar_lote).
 
-        # Assinatura
-        y -= 2.0*cm
-        c.line(2*cm, y, 9*cm, y)
-        c.drawString(2*cm, y - 0.5*cm, "Assinatura do(a) paciente ou responsável")
-        c.line(11*cm, y, w - 2*cm, y)
-        c.drawString(11*cm, y - 0.5*cm, "Assinatura do profissional")
+        Body esperado (JSON or form):
+        - tipo: nome do modelo, como em `gerar`
+        - pacientes: lista de IDs (ou "1,2,3") e/ou
+        - condicao: condição marcada na anamnese, ex. 'possui_hipertensao'
+        Pelo menos um dos filtros é obrigatório. A resposta é 202 com as gerações
+        pendentes, uma por paciente (como em GeracaoAssincronaMixin). Mais de
+        `DOCUMENTOS_LOTE_MAX_PACIENTES` pacientes: use `manage.py gerar_documentos_lote`.
+        """
+        tipo = (request.data.get("tipo") or "").strip()
+        condicao = (request.data.get("condicao") or "").strip()
+        ids = request.data.get("pacientes") or []
+        if isinstance(ids, str):
+            ids = [i for i in ids.split(",") if i.strip()]
 
-        pdf = self._finish_pdf(c, buf)
-        return pdf, "Termo_Hipertensao"
+        modelo = obter_modelos().get(tipo)
+        if modelo is None:
+            return Response({
+                "detail": "Tipo inválido.",
+                "tipos_suportados": sorted(obter_modelos()),
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if not ids and not condicao:
+            return Response({"detail": "Informe 'pacientes' e/ou 'condicao'."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            ids = [int(i) for i in ids]
+        except (TypeError, ValueError):
+            return Response({"detail": "'pacientes' deve ser uma lista de IDs."}, status=status.HTTP_400_BAD_REQUEST)
+        if condicao and condicao not in condicoes_anamnese():
+            return Response({
+                "detail": "Condição inválida.",
+                "condicoes_suportadas": condicoes_anamnese(),
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        limite = getattr(settings, "DOCUMENTOS_LOTE_MAX_PACIENTES", 500)
+        pacientes = list(filtrar_pacientes(ids, condicao).only("id")[:limite + 1])
+        if not pacientes:
+            return Response({"detail": "Nenhum paciente encontrado."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(pacientes) > limite:
+            return Response(
+                {"detail": f"O lote passa de {limite} pacientes; divida o pedido.", "limite": limite},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        try:
+            geracoes = agendar_lote(pacientes, tipo)
+        except FilaCheia as exc:
+            return Response(
+                {"detail": "Muitos PDFs em geração; tente novamente em instantes.", "limite": exc.fila.limite},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": str(PDF_FILA_CHEIA_RETRY_AFTER)},
+            )
+        return Response({
+            "tipo": tipo,
+            "total": len(geracoes),
+            "geracoes": GeracaoDocumentoSerializer(geracoes, many=True).data,
+        }, status=status.HTTP_202_ACCEPTED)
 
 
-class PrescricaoViewSet(viewsets.ModelViewSet):
+class PrescricaoViewSet(GeracaoAssincronaMixin, viewsets.ModelViewSet):
     queryset = Prescricao.objects.select_related("paciente").all()
     serializer_class = PrescricaoSerializer
     permission_classes = [AllowAny]
@@ -494,197 +524,39 @@ class PrescricaoViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=["post"], url_path="exportar")
     def exportar(self, request, pk=None):
+        """Gera o PDF da prescrição e salva nos documentos do paciente.
+
+        Com `assincrono=1` (body ou query string) responde 202 com a geração
+        pendente; ver `GeracaoAssincronaMixin`.
+        """
         prescricao = self.get_object()
-        pdf_bytes = self._build_prescricao_pdf(prescricao)
-        pdf_bytes = self._apply_template(pdf_bytes)
-
-        hoje = datetime.now().strftime("%Y-%m-%d")
-        titulo = f"Prescrição"
-        filename = f"prescricao_{prescricao.paciente.nome}_{prescricao.id}_{hoje}.pdf".replace(" ", "_")
-        content = ContentFile(pdf_bytes, name=filename)
-        doc = Documento(paciente=prescricao.paciente)
-        doc.arquivo.save(filename, content, save=True)
-        doc.nome = f"Prescrição #{prescricao.id}"
-        doc.content_type = "application/pdf"
-        doc.tamanho = len(pdf_bytes)
-        doc.save()
+        if self._pedido_assincrono(request):
+            return self._agendar_geracao(prescricao.paciente, GeracaoDocumento.TIPO_PRESCRICAO, prescricao)
 
+        doc = exportar_prescricao(prescricao)
         data = DocumentoSerializer(doc, context={"request": request}).data
-        download_url = data.get("url") or data.get("arquivo")
         return Response(
             {
                 "detail": "PDF gerado e salvo nos documentos do paciente.",
                 "documento": data,
-                "download_url": download_url,
+                "download_url": data["download_url"],
             },
             status=status.HTTP_201_CREATED,
         )
 
-    # --------- Helpers ---------
-    def _pdf_canvas(self):
-        buf = io.BytesIO()
-        c = canvas.Canvas(buf, pagesize=A4)
-        return c, buf
-
-    def _finish_pdf(self, c, buf):
-        c.showPage(); c.save()
-        return buf.getvalue()
-
-    def _draw_header(self, c, titulo, prescricao):
-        w, h = A4
-        logo_path = getattr(settings, "CLINIC_LOGO_PATH", "") or ""
-        if logo_path:
-            try:
-                p = logo_path
-                if not os.path.isabs(p):
-                    p = os.path.join(settings.BASE_DIR, p)
-                if os.path.exists(p):
-                    img = ImageReader(p)
-                    c.drawImage(img, w - 5 * cm, h - 3 * cm, width=3 * cm, height=3 * cm, preserveAspectRatio=True, mask='auto')
-            except Exception:
-                pass
-
-        clinic_name = getattr(settings, "CLINIC_NAME", "Clínica Odontológica")
-        address = getattr(settings, "CLINIC_ADDRESS", "Endereço: —")
-        phone = getattr(settings, "CLINIC_PHONE", "Telefone: —")
-        cro = getattr(settings, "CLINIC_CRO", "CRO: —")
-
-        c.setFont("Helvetica-Bold", 16)
-        c.drawString(2 * cm, h - 2 * cm, clinic_name)
-        c.setFont("Helvetica", 10)
-        c.drawString(2 * cm, h - 2.6 * cm, f"{address} | {phone} | {cro}")
-        c.setFont("Helvetica-Bold", 14)
-        c.drawString(2 * cm, h - 3.4 * cm, titulo)
-        c.line(2 * cm, h - 3.6 * cm, w - 2 * cm, h - 3.6 * cm)
-
-    def _draw_text_block(self, c, text, x, y, font="Helvetica", size=11, leading=14, max_chars=95):
-        import textwrap
-
-        c.setFont(font, size)
-        lines = []
-        for part in str(text).split("\n"):
-            lines.extend(textwrap.wrap(part, max_chars) or [""])
-        for line in lines:
-            c.drawString(x, y, line)
-            y -= leading / 10 * cm
-        return y
-
-    def _build_prescricao_pdf(self, prescricao):
-        c, buf = self._pdf_canvas()
-        w, h = A4
-        self._draw_header(c, "Prescrição Odontológica", prescricao)
-
-        y = h - 4.5 * cm
-        data_txt = datetime.now().strftime("%d/%m/%Y")
-        paciente = prescricao.paciente
-
-        c.setFont("Helvetica", 12)
-        c.drawString(2 * cm, y, f"Paciente: {paciente.nome}")
-        y -= 0.7 * cm
-        if paciente.cpf:
-            c.drawString(2 * cm, y, f"CPF: {paciente.cpf}")
-            y -= 0.7 * cm
-        if paciente.data_nascimento:
-            c.drawString(2 * cm, y, f"Data de nascimento: {paciente.data_nascimento.strftime('%d/%m/%Y')}")
-            y -= 0.7 * cm
-        c.drawString(2 * cm, y, f"Data da prescrição: {data_txt}")
-        y -= 1.0 * cm
-
-        c.setFont("Helvetica-Bold", 12)
-        c.drawString(2 * cm, y, "Medicamentos prescritos:")
-        y -= 0.8 * cm
-
-        c.setFont("Helvetica", 11)
-        for idx, item in enumerate(prescricao.itens or [], start=1):
-            if y < 4 * cm:
-                c.showPage()
-                self._draw_header(c, "Prescrição Odontológica", prescricao)
-                y = h - 4.5 * cm
-                c.setFont("Helvetica", 11)
-            c.drawString(2.1 * cm, y, f"{idx}. {item.get('nome', '—')}")
-            y -= 0.6 * cm
-            campos = [
-                ("Classe", item.get("classe_nome")),
-                ("Dose", item.get("dose")),
-                ("Frequência", item.get("frequencia")),
-                ("Duração", item.get("duracao")),
-            ]
-            for label, value in campos:
-                if value:
-                    c.drawString(2.4 * cm, y, f"{label}: {value}")
-                    y -= 0.5 * cm
-            orient = item.get("orientacoes")
-            if orient:
-                c.drawString(2.4 * cm, y, "Orientações:")
-                y -= 0.5 * cm
-                c.setFont("Helvetica", 10)
-                wrapper = self._draw_text_block(c, orient, 2.6 * cm, y + 0.3 * cm, font="Helvetica", size=10, leading=13, max_chars=90)
-                y = wrapper - 0.2 * cm
-                c.setFont("Helvetica", 11)
-            y -= 0.4 * cm
-
-        if prescricao.observacoes:
-            if y < 5 * cm:
-                c.showPage()
-                self._draw_header(c, "Prescrição Odontológica", prescricao)
-                y = h - 4.5 * cm
-            c.setFont("Helvetica-Bold", 11)
-            c.drawString(2 * cm, y, "Observações adicionais:")
-            y -= 0.6 * cm
-            c.setFont("Helvetica", 10)
-            y = self._draw_text_block(c, prescricao.observacoes, 2.2 * cm, y + 0.3 * cm, font="Helvetica", size=10, leading=13, max_chars=95) - 0.3 * cm
-
-        y -= 1.2 * cm
-        c.setFont("Helvetica", 11)
-        responsavel = prescricao.profissional or getattr(settings, "CLINIC_RESPONSAVEL_PADRAO", "")
-        cro = prescricao.cro or getattr(settings, "CLINIC_CRO", "")
-        if responsavel:
-            c.drawString(2 * cm, y, f"Profissional responsável: {responsavel}")
-            y -= 0.6 * cm
-        if cro:
-            c.drawString(2 * cm, y, f"CRO: {cro}")
-            y -= 0.8 * cm
-
-        # Assinatura
-        c.line(2 * cm, y, 10 * cm, y)
-        c.drawString(2 * cm, y - 0.5 * cm, "Assinatura do profissional")
-
-        pdf = self._finish_pdf(c, buf)
-        return pdf
-
-    def _apply_template(self, pdf_bytes: bytes) -> bytes:
-        template_path = getattr(settings, "PRESCRIPTION_TEMPLATE_PATH", "") or ""
-        if not template_path:
-            return pdf_bytes
-        try:
-            from PyPDF2 import PdfReader, PdfWriter
-        except ImportError:
-            return pdf_bytes
 
-        path = template_path
-        if not os.path.isabs(path):
-            path = os.path.join(settings.BASE_DIR, path)
-        if not os.path.exists(path):
-            return pdf_bytes
+class GeracaoDocumentoViewSet(viewsets.ReadOnlyModelViewSet):
+    """Acompanhamento das gerações de PDF em segundo plano (`?paciente=` filtra)."""
+    queryset = GeracaoDocumento.objects.select_related("documento").all()
+    serializer_class = GeracaoDocumentoSerializer
+    permission_classes = [AllowAny]
 
-        try:
-            with open(path, "rb") as template_file:
-                template_reader = PdfReader(template_file)
-                overlay_reader = PdfReader(io.BytesIO(pdf_bytes))
-                writer = PdfWriter()
-                total_template = len(template_reader.pages)
-                for idx, overlay_page in enumerate(overlay_reader.pages):
-                    base_index = idx if idx < total_template else total_template - 1
-                    base_page = copy.copy(template_reader.pages[base_index])
-                    base_page.merge_page(overlay_page)
-                    writer.add_page(base_page)
-                out_stream = io.BytesIO()
-                writer.write(out_stream)
-                return out_stream.getvalue()
-        except Exception:
-            return pdf_bytes
-
-        return pdf_bytes
+    def get_queryset(self):
+        qs = super().get_queryset()
+        paciente_id = self.request.query_params.get("paciente")
+        if paciente_id:
+            qs = qs.filter(paciente_id=paciente_id)
+        return qs
 
 
 class ConviteImportacaoViewSet(viewsets.ReadOnlyModelViewSet):
@@ -695,6 +567,13 @@ class ConviteImportacaoViewSet(viewsets.ReadOnlyModelViewSet):
     http_method_names = ["get", "post", "head", "options"]
 
     def create(self, request, *args, **kwargs):
+        """Importa um CSV de contatos.
+
+        Com `assincrono=1` (campo do formulário ou query string) o arquivo é
+        validado (cabeçalho), guardado e processado em segundo plano: a resposta
+        é 202 com a importação em `pendente`, e o progresso pode ser acompanhado
+        em `GET /convites/importacoes/{id}/`. Sem o parâmetro, processa na hora (201).
+        """
         arquivo = request.FILES.get("arquivo")
         if not arquivo:
             return Response(
@@ -704,193 +583,50 @@ class ConviteImportacaoViewSet(viewsets.ReadOnlyModelViewSet):
 
         origem = (request.data.get("origem") or "").strip() or "Importação CSV"
         try:
-            conteudo = arquivo.read().decode("utf-8-sig")
-        except UnicodeDecodeError:
-            arquivo.seek(0)
-            conteudo = arquivo.read().decode("latin-1")
-
-        if not conteudo.strip():
-            return Response({"detail": "O arquivo CSV está vazio."}, status=status.HTTP_400_BAD_REQUEST)
-
-        stream = io.StringIO(conteudo)
-        try:
-            dialect = csv.Sniffer().sniff(conteudo, delimiters=",	;|")
-            stream.seek(0)
-            reader = csv.reader(stream, dialect)
-        except csv.Error:
-            stream.seek(0)
-            reader = csv.reader(stream, delimiter=";")
-
-        headers = next(reader, None)
-        if headers is None:
-            return Response({"detail": "O arquivo CSV não possui cabeçalho."}, status=status.HTTP_400_BAD_REQUEST)
-
-        if len(headers) == 1:
-            inline_headers = re.split(r"[;,]", headers[0])
-            if len(inline_headers) > 1:
-                headers = [parte.strip().strip(".") for parte in inline_headers if parte.strip().strip(".")]
-
-        expected_order = ["nome", "cpf", "telefone", "data_nascimento", "idade", "origem"]
-        index_by_name = {}
-
-        for idx, header in enumerate(headers):
-            normalized = _normalize_header_text(header)
-            if not normalized:
-                continue
-            for expected in expected_order:
-                key = expected.replace("_", "")
-                if normalized == key or key in normalized:
-                    index_by_name[expected] = idx
-
-        for idx, expected in enumerate(expected_order):
-            if expected not in index_by_name and idx < len(headers):
-                index_by_name[expected] = idx
-
-        missing_required = [col for col in CSV_REQUIRED_COLUMNS if col not in index_by_name]
-        if missing_required:
-            return Response(
-                {
-                    "detail": "Colunas obrigatórias ausentes no cabeçalho do CSV.",
-                    "colunas_obrigatorias": sorted(CSV_REQUIRED_COLUMNS),
-                    "colunas_ausentes": sorted(missing_required),
-                },
-                status=status.HTTP_400_BAD_REQUEST,
+            headers, index_by_name, colunas_desconhecidas, linhas = abrir_csv(arquivo.chunks())
+        except CSVInvalido as exc:
+            return Response(exc.payload, status=status.HTTP_400_BAD_REQUEST)
+
+        assincrono = request.data.get("assincrono") or request.query_params.get("assincrono")
+        if str(assincrono).lower() in ("1", "true", "sim"):
+            importacao = ConviteImportacao(
+                arquivo_nome=getattr(arquivo, "name", "importacao.csv"),
+                origem=origem,
+                status=ConviteImportacao.Status.PENDENTE,
+                colunas_desconhecidas=colunas_desconhecidas,
             )
+            arquivo.seek(0)
+            importacao.arquivo.save(importacao.arquivo_nome, arquivo, save=False)
+            importacao.save()
+            enfileirar(processar_importacao, importacao.pk)
 
-        matched_indexes = set(index_by_name.values())
-        colunas_desconhecidas = [
-            headers[idx]
-            for idx in range(len(headers))
-            if headers[idx] and idx not in matched_indexes
-        ]
-
-        def campo(row, chave):
-            idx = index_by_name.get(chave)
-            if idx is None or idx >= len(row):
-                return ""
-            return (row[idx] or "").strip()
-
-        stats = {
-            "total": 0,
-            "importados": 0,
-            "atualizados": 0,
-            "ignorados": 0,
-            "erros": 0,
-        }
-        erros = []
+            payload = self.get_serializer(importacao).data
+            payload["origem_utilizada"] = origem
+            return Response(payload, status=status.HTTP_202_ACCEPTED)
 
+        importador = criar_importador(origem, index_by_name, len(headers))
         with transaction.atomic():
-            for linha, row in enumerate(reader, start=2):
-                if not row or not any((valor or "").strip() for valor in row):
-                    continue
-                if len(row) < len(headers):
-                    row = row + [""] * (len(headers) - len(row))
-                stats["total"] += 1
-                nome = campo(row, "nome")
-                telefone_original = _strip_decimal_tail(campo(row, "telefone"))
-                cpf_original = _strip_decimal_tail(campo(row, "cpf"))
-                data_nascimento_raw = campo(row, "data_nascimento")
-                idade_raw = _strip_decimal_tail(campo(row, "idade"))
-                origem_csv = campo(row, "origem")
-                origem_final = origem_csv or origem
-
-                if not nome and not telefone_original and not cpf_original:
-                    stats["ignorados"] += 1
-                    continue
-
-                if not nome:
-                    stats["erros"] += 1
-                    if len(erros) < IMPORT_MAX_LOG:
-                        erros.append(f"Linha {linha}: campo 'nome' vazio.")
-                    continue
-
-                if not telefone_original:
-                    stats["erros"] += 1
-                    if len(erros) < IMPORT_MAX_LOG:
-                        erros.append(f"Linha {linha}: campo 'telefone' vazio.")
-                    continue
-
-                telefone_normalizado = _normalizar_digitos(telefone_original)
-                if not telefone_normalizado:
-                    stats["erros"] += 1
-                    if len(erros) < IMPORT_MAX_LOG:
-                        erros.append(f"Linha {linha}: telefone inválido '{telefone_original}'.")
-                    continue
-
-                cpf_normalizado = _normalizar_digitos(cpf_original)
-                data_nascimento = _parse_data(data_nascimento_raw)
-                idade = None
-                if idade_raw:
-                    try:
-                        idade = int(float(idade_raw))
-                    except ValueError:
-                        idade = None
-                if idade is None and data_nascimento:
-                    idade = _calcular_idade(data_nascimento)
-
-                contato = None
-                query = Q()
-                if cpf_normalizado:
-                    query |= Q(cpf_normalizado=cpf_normalizado)
-                if telefone_normalizado:
-                    query |= Q(telefone_normalizado=telefone_normalizado)
-                if query:
-                    contato = ConviteContato.objects.filter(query).first()
-
-                if contato:
-                    atualizado = False
-                    if contato.nome != nome:
-                        contato.nome = nome
-                        atualizado = True
-                    if cpf_original and contato.cpf != cpf_original:
-                        contato.cpf = cpf_original
-                        atualizado = True
-                    if telefone_original and contato.telefone != telefone_original:
-                        contato.telefone = telefone_original
-                        atualizado = True
-                    if data_nascimento and contato.data_nascimento != data_nascimento:
-                        contato.data_nascimento = data_nascimento
-                        atualizado = True
-                    if idade is not None and contato.idade != idade:
-                        contato.idade = idade
-                        atualizado = True
-                    if origem_csv and contato.origem != origem_csv:
-                        contato.origem = origem_csv
-                        atualizado = True
-                    elif not contato.origem and origem and contato.origem != origem:
-                        contato.origem = origem
-                        atualizado = True
-                    if atualizado:
-                        contato.save()
-                        stats["atualizados"] += 1
-                    else:
-                        stats["ignorados"] += 1
-                    continue
-
-                ConviteContato.objects.create(
-                    nome=nome,
-                    cpf=cpf_original,
-                    telefone=telefone_original,
-                    data_nascimento=data_nascimento,
-                    idade=idade,
-                    origem=origem_final,
-                )
-                stats["importados"] += 1
+            stats = importador.importar(linhas)
+        erros = importador.erros
 
+        agora = timezone.now()
         importacao = ConviteImportacao.objects.create(
             arquivo_nome=getattr(arquivo, "name", "importacao.csv"),
             origem=origem,
+            status=ConviteImportacao.Status.CONCLUIDO,
             total_linhas=stats["total"],
             importados=stats["importados"],
             atualizados=stats["atualizados"],
             ignorados=stats["ignorados"],
             erros=stats["erros"],
+            colunas_desconhecidas=colunas_desconhecidas,
             log="\n".join(erros),
+            iniciado_em=agora,
+            finalizado_em=agora,
         )
 
         serializer = self.get_serializer(importacao)
         payload = serializer.data
-        payload["colunas_desconhecidas"] = colunas_desconhecidas
         payload["origem_utilizada"] = origem
         return Response(payload, status=status.HTTP_201_CREATED)
 
@@ -899,27 +635,31 @@ class ConviteContatoViewSet(viewsets.ModelViewSet):
     queryset = ConviteContato.objects.all()
     serializer_class = ConviteContatoSerializer
     permission_classes = [AllowAny]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
-    search_fields = ["nome", "cpf", "telefone"]
+    filter_backends = [ConviteContatoSearchFilter, filters.OrderingFilter]
     ordering_fields = ["criado_em", "ultima_mensagem_em", "nome"]
     ordering = ["nome"]
-    http_method_names = ["get", "patch", "head", "options"]
+    # "post" só para a action enviar; contatos são criados pela importação
+    http_method_names = ["get", "post", "patch", "head", "options"]
 
     def get_queryset(self):
-        qs = super().get_queryset()
-        status_param = self.request.query_params.get("status")
+        # `?search=` fica com o filter backend (ConviteContatoSearchFilter)
+        return self._filtrar(super().get_queryset(), self.request.query_params, busca=False)
+
+    @staticmethod
+    def _filtrar(qs, params, busca=True):
+        status_param = params.get("status")
         if status_param:
             qs = qs.filter(status=status_param)
-        search_value = self.request.query_params.get("search")
-        if search_value:
-            termo = search_value.strip()
-            digits = _normalizar_digitos(termo)
-            filtro = Q(nome__icontains=termo)
-            if digits:
-                filtro |= Q(cpf_normalizado__startswith=digits) | Q(telefone_normalizado__startswith=digits)
-            qs = qs.filter(filtro)
+        if busca:
+            qs = buscar_contatos(qs, params.get("search"))
+        origem = params.get("origem")
+        if origem:
+            qs = qs.filter(origem=origem)
         return qs
 
+    def create(self, request, *args, **kwargs):
+        raise MethodNotAllowed(request.method)
+
     def partial_update(self, request, *args, **kwargs):
         dados = request.data
         permitido = {"status"}
@@ -935,48 +675,71 @@ class ConviteContatoViewSet(viewsets.ModelViewSet):
         serializer = ConviteEnvioSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        ids = serializer.validated_data["contatos"]
         mensagem = serializer.validated_data["mensagem"].strip()
         if not mensagem:
             return Response({"detail": "Informe a mensagem a ser enviada."}, status=status.HTTP_400_BAD_REQUEST)
 
-        contatos = list(self.get_queryset().filter(id__in=ids))
-        encontrados = {contato.id for contato in contatos}
-        ids_faltantes = [i for i in ids if i not in encontrados]
-        if ids_faltantes:
-            return Response(
-                {"detail": "Alguns contatos não foram encontrados.", "ids": ids_faltantes},
-                status=status.HTTP_404_NOT_FOUND,
-            )
-
-        enviados = 0
-        falhas = []
-        agora = timezone.now()
-
-        with transaction.atomic():
-            for contato in contatos:
-                ConviteMensagem.objects.create(
-                    contato=contato,
-                    conteudo=mensagem,
-                    status=ConviteMensagem.Status.ENVIADO,
+        filtros = serializer.validated_data.get("filtros")
+        if filtros is not None:
+            # Campanha por filtro: os ids saem de um cursor no servidor, em lotes,
+            # sem montar a lista inteira na memória nem trafegá-la na requisição
+            qs = self._filtrar(ConviteContato.objects.all(), filtros)
+            ids = qs.values_list("id", flat=True).iterator(chunk_size=ENVIO_CHUNK_SIZE)
+            campanha, enfileirados = registrar_envio(ids, mensagem)
+            if campanha is None:
+                return Response(
+                    {"detail": "Nenhum contato corresponde aos filtros informados."},
+                    status=status.HTTP_404_NOT_FOUND,
+                )
+        else:
+            ids = serializer.validated_data["contatos"]
+            encontrados = list(self.get_queryset().filter(id__in=ids).values_list("id", flat=True))
+            conjunto = set(encontrados)
+            ids_faltantes = [i for i in ids if i not in conjunto]
+            if ids_faltantes:
+                return Response(
+                    {"detail": "Alguns contatos não foram encontrados.", "ids": ids_faltantes},
+                    status=status.HTTP_404_NOT_FOUND,
                 )
-                contato.status = ConviteContato.Status.ENVIADO
-                contato.ultima_mensagem_em = agora
-                contato.save(update_fields=["status", "ultima_mensagem_em", "atualizado_em"])
-                enviados += 1
+            campanha, enfileirados = registrar_envio(encontrados, mensagem)
 
+        # A entrega roda em segundo plano; o status de cada mensagem/contato é
+        # atualizado conforme o gateway responde
+        agendar_entrega()
         return Response(
             {
-                "detail": "Mensagens registradas com sucesso.",
-                "enviados": enviados,
-                "falhas": falhas,
+                "detail": "Mensagens enfileiradas para envio.",
+                "campanha": campanha.pk,
+                "enfileirados": enfileirados,
             },
-            status=status.HTTP_201_CREATED,
+            status=status.HTTP_202_ACCEPTED,
         )
 
 
+class ConviteCampanhaViewSet(viewsets.ReadOnlyModelViewSet):
+    """Campanhas de convite com o texto e o andamento da entrega."""
+
+    serializer_class = ConviteCampanhaSerializer
+    permission_classes = [AllowAny]
+    filter_backends = [filters.OrderingFilter]
+    ordering_fields = ["criado_em"]
+    ordering = ["-criado_em"]
+
+    def get_queryset(self):
+        por_status = {
+            campo: Count("mensagens", filter=Q(mensagens__status=valor))
+            for campo, valor in (
+                ("pendentes", ConviteMensagem.Status.PENDENTE),
+                ("enviados", ConviteMensagem.Status.ENVIADO),
+                ("falhas", ConviteMensagem.Status.FALHA),
+            )
+        }
+        return ConviteCampanha.objects.annotate(total=Count("mensagens"), **por_status)
+
+
 class ConviteMensagemViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = ConviteMensagem.objects.select_related("contato").all()
+    # contato e campanha entram no JOIN: `conteudo` é renderizado a partir dos dois
+    queryset = ConviteMensagem.objects.select_related("contato", "campanha").all()
     serializer_class = ConviteMensagemSerializer
     permission_classes = [AllowAny]
     filter_backends = [filters.OrderingFilter]
@@ -987,7 +750,13 @@ class ConviteMensagemViewSet(viewsets.ReadOnlyModelViewSet):
         qs = super().get_queryset()
         contato_id = self.request.query_params.get("contato")
         if contato_id:
-            qs = qs.filter(contato_id=contato_id)
+            qs = qs.filter(contato_id=contato_id, criado_em__gte=self._criado_desde(ConviteContato, contato_id))
+        campanha_id = self.request.query_params.get("campanha")
+        if campanha_id:
+            qs = qs.filter(campanha_id=campanha_id, criado_em__gte=self._criado_desde(ConviteCampanha, campanha_id))
+        status_param = self.request.query_params.get("status")
+        if status_param:
+            qs = qs.filter(status=status_param)
         return qs
 
         serializer = self.get_serializer(importacao)
@@ -1000,3 +769,11 @@ class ConviteMensagemViewSet(viewsets.ReadOnlyModelViewSet):
             },
             status=status.HTTP_201_CREATED,
         )
+
+    @staticmethod
+    def _criado_desde(modelo, pk):
+        # Nenhuma mensagem é anterior ao contato/campanha a que pertence; com o limite
+        # em `criado_em` o PostgreSQL deixa de ler as partições mensais mais antigas
+        # (pacientes.particoes). A folga de um dia cobre relógios de servidores diferentes.
+        limite = modelo.objects.filter(pk=pk).order_by().annotate(limite=F("criado_em") - timedelta(days=1))
+        return Subquery(limite.values("limite")[:1])
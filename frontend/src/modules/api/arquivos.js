@@ -0,0 +1,25 @@
+import { api } from './client.js'
+
+// Arquivos protegidos (download_url / thumb_url) exigem o token: são baixados pelo
+// client, com o cabeçalho Authorization, e usados como object URL
+export async function obterObjectUrl(url) {
+  const res = await api.get(url, { responseType: 'blob', timeout: 0 })
+  return URL.createObjectURL(res.data)
+}
+
+export async function abrirArquivo(url) {
+  const objectUrl = await obterObjectUrl(url)
+  window.open(objectUrl, '_blank', 'noopener,noreferrer')
+  setTimeout(() => URL.revokeObjectURL(objectUrl), 60000)
+}
+
+export async function baixarArquivo(url, nome) {
+  const objectUrl = await obterObjectUrl(url)
+  const dl = document.createElement('a')
+  dl.href = objectUrl
+  dl.download = nome || ''
+  document.body.appendChild(dl)
+  dl.click()
+  dl.remove()
+  setTimeout(() => URL.revokeObjectURL(objectUrl), 60000)
+}
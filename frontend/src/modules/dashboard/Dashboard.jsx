@@ -20,43 +20,18 @@ export default function Dashboard() {
   async function loadDashboardData() {
     setLoading(true)
     try {
-      const { data } = await api.get('/pacientes/')
-      const pacientes = data.results ?? data
-      
-      // Calcular estatísticas
-      const hoje = new Date()
-      hoje.setHours(0, 0, 0, 0)
-      
-      const umaSemanaAtras = new Date(hoje)
-      umaSemanaAtras.setDate(hoje.getDate() - 7)
-      
-      const umMesAtras = new Date(hoje)
-      umMesAtras.setMonth(hoje.getMonth() - 1)
-
-      const pacientesHoje = pacientes.filter(p => {
-        const dataCriacao = new Date(p.criado_em || p.created_at)
-        return dataCriacao >= hoje
-      }).length
-
-      const pacientesSemana = pacientes.filter(p => {
-        const dataCriacao = new Date(p.criado_em || p.created_at)
-        return dataCriacao >= umaSemanaAtras
-      }).length
-
-      const pacientesMes = pacientes.filter(p => {
-        const dataCriacao = new Date(p.criado_em || p.created_at)
-        return dataCriacao >= umMesAtras
-      }).length
+      // Contagens calculadas no servidor (GET /pacientes/stats/, com cache curto)
+      const { data } = await api.get('/pacientes/stats/')
 
       setStats({
-        totalPacientes: pacientes.length,
-        pacientesHoje,
-        pacientesSemana,
-        pacientesMes
+        totalPacientes: data.total,
+        pacientesHoje: data.hoje,
+        pacientesSemana: data.semana,
+        pacientesMes: data.mes
       })
 
       // Últimos 5 pacientes
-      setRecentPacientes(pacientes.slice(0, 5))
+      setRecentPacientes(data.recentes ?? [])
     } catch (e) {
       console.error('Erro ao carregar dashboard:', e)
     } finally {
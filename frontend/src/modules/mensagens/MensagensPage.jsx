@@ -121,6 +121,28 @@ export default function MensagensPage() {
     setSelected(() => new Set())
   }
 
+  function importacaoToResult(importacao) {
+    const detalhes = {
+      pendente: 'Importação na fila…',
+      processando: 'Importando contatos…',
+      concluido: 'Importação concluída.',
+    }
+    if (importacao.status === 'falha') {
+      return { detail: importacao.log || 'Falha durante a importação do CSV.', resumo: null }
+    }
+    return {
+      detail: detalhes[importacao.status] ?? 'Importação processada.',
+      colunas_desconhecidas: importacao.colunas_desconhecidas,
+      resumo: {
+        total: importacao.total_linhas,
+        importados: importacao.importados,
+        atualizados: importacao.atualizados,
+        ignorados: importacao.ignorados,
+        erros: importacao.erros,
+      },
+    }
+  }
+
   async function handleUpload(event) {
     event.preventDefault()
     if (!uploadFile) return
@@ -131,10 +153,17 @@ export default function MensagensPage() {
       const formData = new FormData()
       formData.append('arquivo', uploadFile)
       if (uploadOrigin) formData.append('origem', uploadOrigin)
-  const { data } = await api.post('/pacientes/convites/importacoes/', formData, {
+      formData.append('assincrono', '1')
+  let { data } = await api.post('/pacientes/convites/importacoes/', formData, {
         headers: { 'Content-Type': 'multipart/form-data' },
       })
-      setUploadResult(data)
+      setUploadResult(importacaoToResult(data))
+      // Processamento em segundo plano: acompanha os contadores até terminar
+      while (data.status === 'pendente' || data.status === 'processando') {
+        await new Promise((resolve) => setTimeout(resolve, 1500))
+        ;({ data } = await api.get(`/pacientes/convites/importacoes/${data.id}/`))
+        setUploadResult(importacaoToResult(data))
+      }
       await loadContacts(1)
       await loadHistory()
       setUploadFile(null)
@@ -164,13 +193,13 @@ export default function MensagensPage() {
         mensagem: messageText.trim(),
       }
   const { data } = await api.post('/pacientes/convites/enviar/', payload)
-      setSendFeedback({ type: 'success', message: `${data.enviados} mensagem(ns) registradas.` })
+      setSendFeedback({ type: 'success', message: `${data.enfileirados} mensagem(ns) na fila de envio.` })
       setMessageText('')
       clearSelection()
       await loadContacts(page)
     } catch (error) {
       console.error(error)
-      const detail = error?.response?.data?.detail || 'Falha ao registrar as mensagens.'
+      const detail = error?.response?.data?.detail || 'Falha ao enfileirar as mensagens.'
       setSendFeedback({ type: 'error', message: detail })
     } finally {
       setSending(false)
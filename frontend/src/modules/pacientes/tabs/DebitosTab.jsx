@@ -1,5 +1,6 @@
 import React, { useEffect, useMemo, useRef, useState } from 'react'
 import { api } from '../../api/client.js'
+import { abrirArquivo } from '../../api/arquivos.js'
 
 const PLANOS = ['Particular', 'Convênio', 'Plano empresarial', 'Plano familiar']
 const STATUS_OPTIONS = [
@@ -181,6 +182,14 @@ export default function DebitosTab({ pacienteId, pacienteNome }) {
     }
   }
 
+  async function handleAbrirDocumento(doc) {
+    try {
+      await abrirArquivo(doc.download_url)
+    } catch {
+      setErro('Não foi possível abrir o documento selecionado.')
+    }
+  }
+
   const selectedDebito = docTargetId ? debitos.find(d => d.id === docTargetId) : null
 
   return (
@@ -384,11 +393,11 @@ export default function DebitosTab({ pacienteId, pacienteNome }) {
                       {selectedDebito.documentos.map(doc => (
                         <div key={doc.id} className="flex items-center justify-between bg-[#11121C] border border-gray-800/70 rounded px-3 py-2">
                           <div>
-                            <div className="text-sm text-white">{doc.nome || doc.arquivo?.split('/').pop()}</div>
+                            <div className="text-sm text-white">{doc.nome || `comprovante_${doc.id}`}</div>
                             <div className="text-xs text-gray-500">{new Date(doc.criado_em).toLocaleString('pt-BR')}</div>
                           </div>
                           <div className="flex gap-2">
-                            <a className="btn btn-secondary btn-xs" href={doc.arquivo} target="_blank" rel="noreferrer">Abrir</a>
+                            <button type="button" className="btn btn-secondary btn-xs" onClick={() => handleAbrirDocumento(doc)}>Abrir</button>
                             <button type="button" className="btn btn-danger btn-xs" onClick={() => handleRemoveDocumento(selectedDebito.id, doc.id)}>Excluir</button>
                           </div>
                         </div>
@@ -1,5 +1,6 @@
 import React, { useEffect, useRef, useState } from 'react'
 import { api } from '../../api/client.js'
+import { abrirArquivo, baixarArquivo, obterObjectUrl } from '../../api/arquivos.js'
 
 export default function DocumentosTab({ pacienteId, pacienteNome }){
   const [items, setItems] = useState([])
@@ -52,23 +53,35 @@ export default function DocumentosTab({ pacienteId, pacienteNome }){
   async function handleDownload(doc){
     setErro(''); setMsg('')
     try{
-      const url = doc.url || doc.arquivo
-      if(!url) throw new Error('URL do arquivo não encontrada.')
-      const res = await fetch(url)
-      if(!res.ok) throw new Error(`Erro ao baixar (${res.status})`)
-      const blob = await res.blob()
+      if(!doc.download_url) throw new Error('URL do arquivo não encontrada.')
+      await baixarArquivo(doc.download_url, nomeArquivo(doc))
+    }catch(err){
+      setErro(`Falha ao baixar. ${err?.message||''}`)
+    }
+  }
+
+  async function handleAbrir(doc){
+    setErro('')
+    try{
+      await abrirArquivo(doc.download_url)
+    }catch(err){
+      setErro(`Falha ao abrir o documento. ${err?.message||''}`)
+    }
+  }
+
+  async function handleDownloadZip(){
+    setErro(''); setMsg('')
+    try{
+      // Link assinado e de curta duração: o navegador baixa o ZIP direto para o disco,
+      // sem guardar o arquivo inteiro na memória da página
+      const { data } = await api.post(`/pacientes/${pacienteId}/documentos.zip/link/`)
       const dl = document.createElement('a')
-      const objectUrl = URL.createObjectURL(blob)
-      dl.href = objectUrl
-      const fallback = (url.split('/')?.pop()) || `documento_${doc.id||''}.pdf`
-      const name = (doc.nome && /\.[a-z0-9]+$/i.test(doc.nome) ? doc.nome : (doc.nome ? `${doc.nome}.pdf` : fallback))
-      dl.download = name
+      dl.href = data.url
       document.body.appendChild(dl)
       dl.click()
       dl.remove()
-      URL.revokeObjectURL(objectUrl)
     }catch(err){
-      setErro(`Falha ao baixar. ${err?.message||''}`)
+      setErro(`Falha ao baixar os documentos. ${err?.message||''}`)
     }
   }
 
@@ -121,10 +134,15 @@ export default function DocumentosTab({ pacienteId, pacienteNome }){
             <h2 className="text-xl font-bold text-white">Documentos de {pacienteNome}</h2>
             <p className="text-gray-400 text-sm">PDFs, imagens e outros arquivos vinculados ao paciente.</p>
           </div>
-          <label className="btn btn-primary cursor-pointer">
-            Selecionar arquivo
-            <input ref={fileRef} type="file" accept=".pdf,image/*" className="hidden" onChange={handleUpload} />
-          </label>
+          <div className="flex gap-2">
+            <button type="button" className="btn btn-secondary" disabled={items.length === 0} onClick={handleDownloadZip}>
+              Baixar todos (.zip)
+            </button>
+            <label className="btn btn-primary cursor-pointer">
+              Selecionar arquivo
+              <input ref={fileRef} type="file" accept=".pdf,image/*" className="hidden" onChange={handleUpload} />
+            </label>
+          </div>
         </div>
         {(msg || erro) && (
           <div className="mt-3 text-sm">
@@ -155,9 +173,12 @@ export default function DocumentosTab({ pacienteId, pacienteNome }){
                 {items.map(doc => (
                   <tr key={doc.id}>
                     <td className="py-2 pr-4">
-                      <a className="text-blue-400 hover:underline" href={doc.url || doc.arquivo} target="_blank" rel="noreferrer">
-                        {doc.nome || (doc.arquivo?.split('/').pop()) || `arquivo_${doc.id}`}
-                      </a>
+                      <div className="flex items-center gap-3">
+                        {doc.thumb_url && <Miniatura url={doc.thumb_url} />}
+                        <button type="button" className="text-blue-400 hover:underline text-left" onClick={()=>handleAbrir(doc)}>
+                          {doc.nome || `arquivo_${doc.id}`}
+                        </button>
+                      </div>
                     </td>
                     <td className="py-2 pr-4 text-sm text-gray-400">{doc.content_type || '—'}</td>
                     <td className="py-2 pr-4 text-sm text-gray-400">{formatSize(doc.tamanho)}</td>
@@ -177,6 +198,26 @@ export default function DocumentosTab({ pacienteId, pacienteNome }){
   )
 }
 
+function Miniatura({ url }){
+  // A miniatura também exige o token: <img src> não mandaria o cabeçalho
+  const [src, setSrc] = useState(null)
+  useEffect(()=>{
+    let objectUrl = null
+    let ativo = true
+    obterObjectUrl(url)
+      .then(u => { objectUrl = u; if(ativo) setSrc(u); else URL.revokeObjectURL(u) })
+      .catch(()=>{})
+    return ()=>{ ativo = false; if(objectUrl) URL.revokeObjectURL(objectUrl) }
+  }, [url])
+  if(!src) return <div className="w-12 h-12 rounded border border-gray-700/60 bg-gray-800/40" />
+  return <img src={src} alt="" className="w-12 h-12 object-cover rounded border border-gray-700/60" />
+}
+
+function nomeArquivo(doc){
+  const nome = doc.nome || `documento_${doc.id||''}`
+  return /\.[a-z0-9]+$/i.test(nome) ? nome : `${nome}.pdf`
+}
+
 function formatSize(b){
   if(!b) return '—'
   const u = ['B','KB','MB','GB']
@@ -1,5 +1,6 @@
 import React, { useEffect, useMemo, useState } from 'react'
 import { api } from '../../api/client.js'
+import { abrirArquivo } from '../../api/arquivos.js'
 
 const MED_CATEGORIES = [
   {
@@ -361,7 +362,7 @@ export default function PrescricaoTab({ pacienteId, pacienteNome, pacienteDados
     try {
       const { data: resp } = await api.post(`/pacientes/prescricoes/${idToExport}/exportar/`)
       if (resp.download_url) {
-        window.open(resp.download_url, '_blank', 'noopener')
+        await abrirArquivo(resp.download_url)
       }
       setMsg('PDF gerado e salvo nos documentos do paciente.')
       await loadHistorico()
@@ -387,7 +388,7 @@ export default function PrescricaoTab({ pacienteId, pacienteNome, pacienteDados
     try {
       const { data } = await api.post(`/pacientes/prescricoes/${id}/exportar/`)
       if (data.download_url) {
-        window.open(data.download_url, '_blank', 'noopener')
+        await abrirArquivo(data.download_url)
       }
       setMsg('PDF gerado a partir da prescrição selecionada.')
       await loadHistorico()